@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Request, Form, Depends, HTTPException, Response
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlmodel import Session, select
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from sqlalchemy import func, or_
+from sqlmodel import Session, select, text
+from typing import Optional
 import os
+import time
 from pathlib import Path
 
 
@@ -11,10 +13,30 @@ from ..core import *
 
 # --- Configuration ---
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "supersecret")
+USERS_PAGE_SIZE = 50
+USER_COUNT_TTL = 60
+PROFILE_MAX_SECONDS = 60
+# Keys of the stats() dicts below that only ever go up; the rest are gauges
+COUNTER_STATS = {
+    "hits", "misses", "flushes", "flushed_rows", "flush_errors", "rejected", "notifications",
+    "allowed", "throttled", "implausible", "published", "received", "dropped", "resets", "recorded",
+}
+
+# [counted_at, count] for estimate_user_count
+_user_count_cache = [float("-inf"), 0]
 
 # --- Setup ---
 router = APIRouter()
-templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+_templates = None
+
+
+def render_template(name: str, context: dict, status_code: int = 200):
+    """Renders an admin page; Jinja2 is loaded on the first one."""
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+    return _templates.TemplateResponse(name, context, status_code=status_code)
 
 # --- Helper Function to check cookie ---
 def get_admin_user(request: Request):
@@ -24,17 +46,134 @@ def get_admin_user(request: Request):
 
 @router.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request, session: Session = Depends(get_session), is_admin: bool = Depends(get_admin_user)):
-    users = session.exec(select(User).order_by(User.score.desc())).all()
+    # Users are not rendered here; the page pages through /admin/users instead
     tasks = session.exec(select(Task).order_by(Task.id)).all() 
-    return templates.TemplateResponse("dashboard.html", {
+    return render_template("dashboard.html", {
         "request": request, 
-        "users": users,
-        "tasks": tasks  
+        "tasks": tasks,
+        "user_count": estimate_user_count(session),
+        "page_size": USERS_PAGE_SIZE,
     })
 
+
+def estimate_user_count(session: Session) -> int:
+    """
+    A cheap user count for the dashboard header: the planner's row estimate on
+    PostgreSQL, otherwise an exact count cached for USER_COUNT_TTL seconds.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        estimate = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'user'")).first()
+        if estimate and estimate[0] >= 0:
+            return estimate[0]
+
+    counted_at, count = _user_count_cache
+    if time.monotonic() - counted_at > USER_COUNT_TTL:
+        count = session.exec(select(func.count()).select_from(User)).one()
+        _user_count_cache[:] = [time.monotonic(), count]
+    return count
+
+
+def _decode_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        score, user_id = cursor.split(":")
+        return int(score), int(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/users")
+def list_users(
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = USERS_PAGE_SIZE,
+    session: Session = Depends(get_session),
+    is_admin: bool = Depends(get_admin_user)
+):
+    """
+    One page of users ordered by score, for the dashboard. Keyset pagination on
+    (score DESC, id) keeps every page an index range scan, however deep it is.
+    `q` matches an exact user id or a username / wallet address prefix.
+    """
+    limit = max(1, min(limit, 200))
+    statement = users_by_score_statement(_decode_cursor(cursor) if cursor else None, limit)
+
+    if q:
+        q = q.strip()
+        matches = [User.username.startswith(q, autoescape=True),
+                   User.wallet_address.startswith(q, autoescape=True)]
+        if q.isdigit():
+            matches.append(User.id == int(q))
+        statement = statement.where(or_(*matches))
+
+    rows = session.exec(statement).all()
+    page = rows[:limit]
+    next_cursor = f"{page[-1].score}:{page[-1].id}" if len(rows) > limit else None
+    return {
+        "users": [
+            {"id": row.id, "username": row.username, "score": row.balance, "wallet_address": row.wallet_address}
+            for row in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+@router.get("/export/users")
+def export_users_endpoint(
+    format: str = "csv",
+    gzip: bool = False,
+    min_score: Optional[int] = None,
+    has_wallet: bool = False,
+    is_admin: bool = Depends(get_admin_user)
+):
+    """Streams users (for airdrop snapshots) as CSV or NDJSON, optionally gzipped."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    filename = f"users.{format}" + (".gz" if gzip else "")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        export_users(engine, format, gzip=gzip, min_score=min_score, has_wallet=has_wallet),
+        media_type=media_type,
+        headers=headers,
+    )
+
+@router.get("/ledger/{user_id}")
+def user_ledger_endpoint(
+    user_id: int,
+    session: Session = Depends(get_session),
+    is_admin: bool = Depends(get_admin_user)
+):
+    """A user's stored score next to their ledger balance, with their latest score events."""
+    ledger = user_ledger(session, user_id)
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return ledger
+
+@router.post("/ledger/{user_id}/rebuild")
+def rebuild_user_score(
+    user_id: int,
+    session: Session = Depends(get_session),
+    is_admin: bool = Depends(get_admin_user)
+):
+    """Resets the user's score to the balance rebuilt from the ledger."""
+    tap_buffer.drain(session, user_id)
+    previous = session.execute(
+        select(balance_column(user_id, extra=queued_delta(session, user_id))).where(User.id == user_id)
+    ).scalar()
+    row = rebuild_score(session, user_id)
+    if row is None:
+        session.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    session.commit()
+    print(f"Rebuilt score of user {user_id} from the ledger: {previous} -> {row.score}")
+    return {"user_id": user_id, "previous_score": previous, "score": row.score}
+
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return render_template("login.html", {"request": request})
 
 @router.post("/login", response_class=HTMLResponse)
 async def handle_login(request: Request, password: str = Form(...)):
@@ -44,12 +183,72 @@ async def handle_login(request: Request, password: str = Form(...)):
         response.set_cookie(key="admin_auth", value=ADMIN_PASSWORD, httponly=True )
         return response
     else:
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Incorrect password"}, status_code=401)
+        return render_template("login.html", {"request": request, "error": "Incorrect password"}, status_code=401)
 
-@router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, session: Session = Depends(get_session), is_admin: bool = Depends(get_admin_user)):
-    users = session.exec(select(User).order_by(User.score.desc())).all()
-    return templates.TemplateResponse("dashboard.html", {"request": request, "users": users})
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(is_admin: bool = Depends(get_admin_user)):
+    """Prometheus scrape endpoint; per-route metrics need METRICS_ENABLED=true."""
+    gauges = {"rank_index_users": len(rank_index)}
+    counters = {}
+    for prefix, stats in (
+        ("auth_cache", auth_cache_stats()),
+        ("tap_buffer", tap_buffer.stats()),
+        ("task_catalog", task_catalog.stats()),
+        ("user_cache", user_cache.stats()),
+        ("live", live_hub.stats()),
+        ("rate_limit", score_rate_limiter.stats()),
+        ("cache_bus", cache_bus.stats()),
+        ("slow_requests", slow_requests.stats()),
+    ):
+        for key, value in stats.items():
+            target = counters if key in COUNTER_STATS else gauges
+            target[f"{prefix}_{key}"] = int(value) if isinstance(value, bool) else value
+    return PlainTextResponse(render_prometheus(gauges, counters), media_type="text/plain; version=0.0.4")
+
+
+def _folded_download(stacks, name: str) -> PlainTextResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{name}.folded"', "X-Worker-Pid": str(os.getpid())}
+    return PlainTextResponse(folded(stacks), headers=headers)
+
+@router.get("/profile", response_class=PlainTextResponse)
+def capture_profile(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    is_admin: bool = Depends(get_admin_user)
+):
+    """
+    Samples the stacks of the worker that answers for `seconds` and returns them
+    in the folded format (flamegraph.pl, inferno, speedscope). Each worker is
+    profiled on its own; X-Worker-Pid tells which one this was.
+    """
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+    try:
+        stacks = sample_profile(seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _folded_download(stacks, f"profile-{os.getpid()}-{int(time.time())}")
+
+@router.get("/slow_requests")
+def list_slow_requests(is_admin: bool = Depends(get_admin_user)):
+    """This worker's latest requests slower than SLOW_REQUEST_MS, newest first."""
+    return {"threshold_ms": SLOW_REQUEST_MS, "worker_pid": os.getpid(), "traces": slow_requests.summaries()}
+
+@router.get("/slow_requests/{trace_id}")
+def slow_request_trace(trace_id: int, is_admin: bool = Depends(get_admin_user)):
+    """A slow request's SQL statements with their timings, and its sampled call tree."""
+    trace = slow_requests.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (or no longer kept by this worker)")
+    return trace.to_dict()
+
+@router.get("/slow_requests/{trace_id}/flamegraph", response_class=PlainTextResponse)
+def slow_request_flamegraph(trace_id: int, is_admin: bool = Depends(get_admin_user)):
+    """The call tree of a slow request in the folded format."""
+    trace = slow_requests.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (or no longer kept by this worker)")
+    return _folded_download(trace.stacks, f"request-{trace_id}")
 
 @router.get("/logout")
 async def logout():
@@ -80,6 +279,7 @@ async def add_task(
 
     session.add(new_task)
     session.commit()
+    task_catalog.invalidate()
 
     return RedirectResponse(url="/admin/dashboard", status_code=303)
 
@@ -108,6 +308,7 @@ async def edit_task(
     
     session.add(task_to_edit)
     session.commit()
+    task_catalog.invalidate()
     
     return RedirectResponse(url="/admin/dashboard", status_code=303)
 
@@ -126,6 +327,7 @@ async def delete_task(
     
     session.delete(task_to_delete)
     session.commit()
+    task_catalog.invalidate()
     
     return RedirectResponse(url="/admin/dashboard", status_code=303)
 
@@ -0,0 +1,173 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime
+from typing import Optional
+
+from .core import (
+    FRIENDS_MAX_PAGE_SIZE, FRIENDS_PAGE_SIZE, REFERRAL_BONUS, SYNC_BATCH_MAX_EVENTS, SyncConflict, Task,
+    UserTask, add_score_async, apply_sync_batch_async, credit_referrer_async, farming_rewards,
+    friends_page_statement, get_async_session, get_validated_data_async, leaderboard_snapshot,
+    load_user_state_async, new_player, rank_index, referral_totals_statement, tap_buffer, task_catalog,
+    touch_user, track_completion, track_score, update_profile_statement,
+)
+from .schemas import (
+    FriendsPageResponse, LeaderboardResponse, SyncBatchRequest, SyncBatchResponse, SyncRequest, TaskResponse,
+    UserDataResponse, friends_page_response, sync_batch_response, task_response, user_state,
+    user_state_response,
+)
+from .dependencies import throttle_sync_batch, throttle_sync_score
+
+# Async versions of the player endpoints in main.py, mounted instead of the
+# sync ones when ASYNC_DB=true. Keep the two in step when changing either.
+router = APIRouter()
+
+
+@router.get("/get_user_data", response_model=UserDataResponse)
+async def get_user_data(
+    validated_data: dict = Depends(get_validated_data_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_data = validated_data.get('user', {})
+    user_id = user_data.get('id')
+    now = datetime.utcnow()
+    db_user = await load_user_state_async(session, user_id)
+
+    if not db_user:
+        print(f"First time user {user_id}. Creating entry.")
+        referrer_id = None
+        referral_code_used = user_data.get('referral_code_used')
+        if referral_code_used:
+            referrer_id = await credit_referrer_async(session, referral_code_used)
+            if referrer_id:
+                print(f"Awarded {REFERRAL_BONUS:,} points to referrer {referrer_id}")
+        db_user = new_player(user_data, referrer_id, now)
+        session.add(db_user)
+        track_score(session, user_id, 0)
+        await session.commit()
+    else:
+        statement = update_profile_statement(db_user, user_data)
+        if statement is not None:
+            await session.execute(statement)
+            touch_user(session, user_id)
+            await session.commit()
+            db_user = await load_user_state_async(session, user_id)
+
+    return user_state_response(db_user, claimable_rewards=farming_rewards(db_user, now), now=now)
+
+
+@router.post("/sync_score", response_model=UserDataResponse)
+async def sync_score(
+    sync_request: SyncRequest,
+    *,
+    validated_data: dict = Depends(throttle_sync_score),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_id = validated_data.get('user', {}).get('id')
+
+    if tap_buffer.enabled:
+        row = await load_user_state_async(session, user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="User not found during sync")
+        tap_buffer.add(user_id, sync_request.taps)
+        return ORJSONResponse(user_state(row))
+
+    row = await add_score_async(session, user_id, sync_request.taps, source="tap", consume_session=True)
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found during sync")
+    await session.commit()
+
+    return user_state_response(row)
+
+
+@router.post("/sync_batch", response_model=SyncBatchResponse)
+async def sync_batch(
+    batch: SyncBatchRequest,
+    *,
+    validated_data: dict = Depends(throttle_sync_batch),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_id = validated_data.get('user', {}).get('id')
+    if len(batch.events) > SYNC_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_BATCH_MAX_EVENTS} events per batch")
+
+    try:
+        result = await apply_sync_batch_async(session, user_id, batch.events)
+    except SyncConflict:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Another sync for this user is in progress, retry")
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found during sync")
+    await session.commit()
+
+    row = result.row or await load_user_state_async(session, user_id)
+    return sync_batch_response(row, result)
+
+
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    *,
+    if_none_match: Optional[str] = Header(None),
+    validated_data: dict = Depends(get_validated_data_async)
+):
+    user_id = validated_data.get('user', {}).get('id')
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid user data")
+
+    return leaderboard_snapshot.response(rank_index.rank(user_id), if_none_match)
+
+
+@router.get("/tasks", response_model=list[TaskResponse])
+async def get_tasks(
+    validated_data: dict = Depends(get_validated_data_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_id = validated_data['user']['id']
+    return Response(await task_catalog.render_async(session, user_id), media_type="application/json")
+
+
+@router.post("/claim_task/{task_id}", response_model=TaskResponse)
+async def claim_task(
+    task_id: int,
+    validated_data: dict = Depends(get_validated_data_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_id = validated_data['user']['id']
+
+    task = await session.get(Task, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    response = task_response(task, completed=True)
+
+    session.add(UserTask(user_id=user_id, task_id=task_id))
+    try:
+        await session.flush()
+    except IntegrityError:
+        await session.rollback()
+        if await session.get(UserTask, (user_id, task_id)):
+            raise HTTPException(status_code=400, detail="Task already completed")
+        raise HTTPException(status_code=404, detail="User not found")
+
+    await tap_buffer.drain_async(session, user_id)
+    if await add_score_async(session, user_id, task.points, source="task") is None:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    track_completion(session, user_id, task_id)
+    await session.commit()
+
+    return response
+
+
+@router.get("/friends", response_model=FriendsPageResponse)
+async def get_friends(
+    cursor: Optional[int] = None,
+    limit: int = FRIENDS_PAGE_SIZE,
+    validated_data: dict = Depends(get_validated_data_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    user_id = validated_data['user']['id']
+    limit = max(1, min(limit, FRIENDS_MAX_PAGE_SIZE))
+    rows = (await session.execute(friends_page_statement(user_id, cursor, limit))).all()
+    totals = (await session.execute(referral_totals_statement(user_id))).first()
+    return friends_page_response(rows, limit, totals)
@@ -0,0 +1,170 @@
+"""
+Command line tools for operating the app.
+
+    python -m backend.cli export-users --format csv --gzip --has-wallet -o snapshot.csv.gz
+    python -m backend.cli ledger-backfill
+    python -m backend.cli ledger-compact
+    python -m backend.cli referrals-backfill
+    python -m backend.cli db-upgrade
+    python -m backend.cli db-check-plans
+    python -m backend.cli cache-bus-serve --port 6379
+    python -m backend.cli build-assets
+    python -m backend.cli airdrop-allocate --total 1000000000 --max-share 0.001 --dry-run
+"""
+from dotenv import load_dotenv
+import argparse
+import sys
+
+load_dotenv()
+
+from .core import (
+    ASSETS_DIST_DIR, EXPORT_FORMATS, REFERRAL_BONUS, AssetBundle, RespBroker, backfill_opening_balances,
+    backfill_referral_stats, check_query_plans, compact_ledger, current_revision, downgrade_database, engine,
+    export_users, head_revision, upgrade_database,
+)
+
+
+def cmd_export_users(args):
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for block in export_users(engine, args.format, gzip=args.gzip,
+                                  min_score=args.min_score, has_wallet=args.has_wallet):
+            output.write(block)
+    finally:
+        if args.output:
+            output.close()
+
+
+def cmd_ledger_backfill(args):
+    print(f"Recorded opening balances for {backfill_opening_balances(engine)} users.")
+
+
+def cmd_ledger_compact(args):
+    print(f"Folded {compact_ledger(engine, lag=args.lag)} ledger events into user scores.")
+
+
+def cmd_referrals_backfill(args):
+    print(f"Recomputed referral totals for {backfill_referral_stats(engine, REFERRAL_BONUS)} referrers.")
+
+
+def cmd_db_upgrade(args):
+    upgrade_database(engine, args.revision)
+    print(f"Database schema is at revision {current_revision(engine)}.")
+
+
+def cmd_db_downgrade(args):
+    downgrade_database(engine, args.revision)
+    print(f"Database schema is at revision {current_revision(engine)}.")
+
+
+def cmd_db_current(args):
+    print(f"current: {current_revision(engine)}, head: {head_revision()}")
+
+
+def cmd_db_check_plans(args):
+    failed = 0
+    for check in check_query_plans(engine):
+        print(f"{'ok  ' if check.uses_index else 'FAIL'} {check.query} -> {check.index}")
+        if not check.uses_index:
+            failed += 1
+            print("     " + check.plan.replace("\n", "\n     "))
+    sys.exit(1 if failed else 0)
+
+
+def cmd_cache_bus_serve(args):
+    RespBroker(args.host, args.port).serve_forever()
+
+
+def cmd_build_assets(args):
+    bundle = AssetBundle.build()
+    bundle.write()
+    for url, asset in sorted(bundle.assets.items()):
+        if url == "/":
+            continue
+        sizes = ", ".join(f"{encoding or 'identity'} {len(body):,}" for encoding, body in asset.bodies.items())
+        print(f"{url}: {sizes}")
+    print(f"Wrote {ASSETS_DIST_DIR}")
+
+
+def cmd_airdrop_allocate(args):
+    from .core.airdrop import AllocationRules, allocate_airdrop
+
+    # Options left out keep the AllocationRules defaults
+    rules = AllocationRules(**{field: getattr(args, field) for field in AllocationRules._fields
+                               if getattr(args, field) is not None})
+    allocation = allocate_airdrop(engine, rules, write=not args.dry_run)
+    for key, value in allocation.stats.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value:,}")
+    print("Dry run, nothing written." if args.dry_run else "Wrote the airdropallocation table.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.cli", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export-users", help="stream all users and wallets for an airdrop snapshot")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--gzip", action="store_true", help="gzip the output")
+    export.add_argument("--min-score", type=int, help="only users with at least this score")
+    export.add_argument("--has-wallet", action="store_true", help="only users with a wallet address")
+    export.add_argument("-o", "--output", help="output file (default: stdout)")
+    export.set_defaults(func=cmd_export_users)
+
+    backfill = commands.add_parser("ledger-backfill",
+                                   help="record pre-ledger scores as opening events (run once, app stopped)")
+    backfill.set_defaults(func=cmd_ledger_backfill)
+
+    compact = commands.add_parser("ledger-compact", help="fold score events into user scores now")
+    compact.add_argument("--lag", type=int, default=0, help="skip events younger than this many seconds")
+    compact.set_defaults(func=cmd_ledger_compact)
+
+    referrals = commands.add_parser("referrals-backfill",
+                                    help="recompute every referrer's friend count and bonus total (app stopped)")
+    referrals.set_defaults(func=cmd_referrals_backfill)
+
+    upgrade = commands.add_parser("db-upgrade", help="apply pending schema migrations")
+    upgrade.add_argument("revision", nargs="?", default="head")
+    upgrade.set_defaults(func=cmd_db_upgrade)
+
+    downgrade = commands.add_parser("db-downgrade", help="revert schema migrations down to a revision")
+    downgrade.add_argument("revision", help='target revision, e.g. "0001" or "-1"')
+    downgrade.set_defaults(func=cmd_db_downgrade)
+
+    current = commands.add_parser("db-current", help="show the schema revision of the database")
+    current.set_defaults(func=cmd_db_current)
+
+    plans = commands.add_parser("db-check-plans",
+                                help="check that the hot queries use their indexes (exit status 1 if not)")
+    plans.set_defaults(func=cmd_db_check_plans)
+
+    broker = commands.add_parser("cache-bus-serve",
+                                 help="run a stand-in Redis pub/sub broker for CACHE_BUS=redis")
+    broker.add_argument("--host", default="127.0.0.1")
+    broker.add_argument("--port", type=int, default=6379)
+    broker.set_defaults(func=cmd_cache_bus_serve)
+
+    assets = commands.add_parser("build-assets",
+                                 help="fingerprint and precompress the frontend into ASSETS_DIST_DIR")
+    assets.set_defaults(func=cmd_build_assets)
+
+    airdrop = commands.add_parser("airdrop-allocate",
+                                  help="compute every wallet's airdrop amount into the airdropallocation table")
+    airdrop.add_argument("--total", type=int, required=True, help="units to distribute")
+    airdrop.add_argument("--min-score", type=int, help="users below this score get nothing (default 1)")
+    airdrop.add_argument("--task-bonus", type=float, help="weight added per completed task (0.05)")
+    airdrop.add_argument("--referral-bonus", type=float, help="weight added per qualifying referral (0.02)")
+    airdrop.add_argument("--referral-level2-bonus", type=float, help="weight added per referral of a referral (0.005)")
+    airdrop.add_argument("--referral-cap", type=int, help="referrals counted per level, at most (100)")
+    airdrop.add_argument("--max-share", type=float, help="most of the total one wallet can get (0.001)")
+    airdrop.add_argument("--wallet-policy", choices=("max", "sum"),
+                         help="accounts sharing a wallet: count the best one (max, default) or all of them")
+    airdrop.add_argument("--dry-run", action="store_true", help="compute and report, write nothing")
+    airdrop.set_defaults(func=cmd_airdrop_allocate)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
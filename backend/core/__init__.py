@@ -1,4 +1,23 @@
-from .security import *
+from .metrics import *
+from .profiling import *
+from .cachebus import *
 from .database import *
+from .migrations import *
 from .security import *
-from .models import *
\ No newline at end of file
+from .models import *
+from .usercache import *
+from .ledger import *
+from .referrals import *
+from .ranking import *
+from .leaderboard import *
+from .scoring import *
+from .tapbuffer import *
+from .export import *
+from .taskcatalog import *
+from .syncbatch import *
+from .ratelimit import *
+from .livefeed import *
+from .queryplans import *
+from .assets import *
+from .health import *
+# .airdrop is imported where it is used: it needs NumPy, which the workers do not
@@ -0,0 +1,279 @@
+from typing import NamedTuple
+import os
+import time
+
+import numpy as np
+from sqlalchemy import delete, func, insert
+from sqlmodel import select
+
+from .ledger import balance_join
+from .models import AirdropAllocation, User, UserTask
+
+# Rows fetched per round trip, and inserted per statement when writing.
+AIRDROP_CHUNK_SIZE = int(os.getenv("AIRDROP_CHUNK_SIZE", "50000"))
+# The lengths /save_wallet accepts for a Solana address
+WALLET_MIN_LENGTH = 32
+WALLET_MAX_LENGTH = 44
+WALLET_POLICIES = ("max", "sum")
+# Amounts are computed in float64, exact up to this many units
+MAX_TOTAL = 2 ** 53
+
+
+class AllocationRules(NamedTuple):
+    # Units to distribute
+    total: int
+    # Users below this score get nothing and do not count as referrals
+    min_score: int = 1
+    # Weight added per completed task
+    task_bonus: float = 0.05
+    # Weight added per qualifying referral, and per referral of a referral
+    referral_bonus: float = 0.02
+    referral_level2_bonus: float = 0.005
+    # Referrals counted at each level, at most
+    referral_cap: int = 100
+    # Most of `total` a single wallet can receive; the excess goes to the others
+    max_share: float = 0.001
+    # Accounts sharing a wallet: "max" counts the best one, "sum" all of them
+    wallet_policy: str = "max"
+
+
+class UserArrays(NamedTuple):
+    """The users table as columns, one element per user in id order."""
+    ids: np.ndarray  # int64, ascending
+    scores: np.ndarray  # int64
+    parents: np.ndarray  # int64 referred_by_id, 0 if none
+    tasks: np.ndarray  # int32 completed tasks
+    # Users with a well-formed wallet: their row and the address, as ASCII bytes
+    wallet_rows: np.ndarray
+    wallets: np.ndarray
+    invalid_wallets: int
+
+
+class Allocation(NamedTuple):
+    """One element per wallet."""
+    wallets: np.ndarray
+    amounts: np.ndarray  # int64 units
+    users: np.ndarray  # accounts sharing the wallet
+    scores: np.ndarray
+    weights: np.ndarray
+    capped: np.ndarray
+    stats: dict
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _fetch_chunks(connection, statement, chunk_size: int):
+    """
+    Runs `statement` on the DBAPI cursor and yields its rows as plain tuples,
+    `chunk_size` at a time: building SQLAlchemy rows costs more than the fetch.
+    On PostgreSQL a named cursor keeps the result on the server.
+    """
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    dbapi_connection = connection.connection.dbapi_connection
+    if connection.dialect.name == "postgresql":
+        cursor = dbapi_connection.cursor(name="airdrop")
+    else:
+        cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(sql)
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+    finally:
+        cursor.close()
+
+
+def load_users(engine, chunk_size: int = AIRDROP_CHUNK_SIZE) -> UserArrays:
+    """
+    Streams the users, their wallets and task counts into NumPy arrays,
+    `chunk_size` rows at a time. Wallets are only kept for the users that
+    have one, so memory is about 28 bytes per user plus 52 per wallet.
+    """
+    joined, balance = balance_join()
+    users = select(User.id, balance, func.coalesce(User.referred_by_id, 0)).select_from(joined).order_by(User.id)
+    wallets = select(User.id, User.wallet_address).where(
+        User.wallet_address.is_not(None), User.wallet_address != ""
+    ).order_by(User.id)
+    completions = select(UserTask.user_id, func.count()).group_by(UserTask.user_id)
+
+    with engine.connect() as connection:
+        expected = connection.execute(select(func.count()).select_from(User)).scalar()
+        columns = np.zeros((expected, 3), np.int64)
+        size = 0
+        for partition in _fetch_chunks(connection, users, chunk_size):
+            if size + len(partition) > len(columns):
+                # Users that signed up since the count
+                columns = _grow(columns, size + len(partition))
+            columns[size:size + len(partition)] = partition
+            size += len(partition)
+        ids, scores, parents = (np.ascontiguousarray(column) for column in columns[:size].T)
+        del columns
+
+        wallet_ids, wallet_chunks = [], []
+        invalid_wallets = 0
+        for partition in _fetch_chunks(connection, wallets, chunk_size):
+            valid_ids, valid = [], []
+            for user_id, wallet in partition:
+                wallet = wallet.strip()
+                if WALLET_MIN_LENGTH <= len(wallet) <= WALLET_MAX_LENGTH and wallet.isascii():
+                    valid_ids.append(user_id)
+                    valid.append(wallet)
+                else:
+                    invalid_wallets += 1
+            wallet_ids.append(np.array(valid_ids, np.int64))
+            wallet_chunks.append(np.array(valid, f"S{WALLET_MAX_LENGTH}"))
+        wallet_rows, found = _rows_of(ids, np.concatenate(wallet_ids or [np.zeros(0, np.int64)]))
+
+        tasks = np.zeros(size, np.int32)
+        for partition in _fetch_chunks(connection, completions, chunk_size):
+            counts = np.array(partition, np.int64)
+            task_rows, task_found = _rows_of(ids, counts[:, 0])
+            tasks[task_rows[task_found]] = counts[task_found, 1]
+
+    wallets = np.concatenate(wallet_chunks or [np.zeros(0, f"S{WALLET_MAX_LENGTH}")])
+    return UserArrays(ids, scores, parents, tasks, wallet_rows[found], wallets[found], invalid_wallets)
+
+
+def _rows_of(ids: np.ndarray, user_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The positions of `user_ids` in the sorted `ids`, and which of them are there at all."""
+    if not len(ids):
+        return np.zeros(len(user_ids), np.int64), np.zeros(len(user_ids), bool)
+    rows = np.minimum(np.searchsorted(ids, user_ids), len(ids) - 1)
+    return rows, ids[rows] == user_ids
+
+
+def referral_counts(ids: np.ndarray, parents: np.ndarray, qualified: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per user, the qualified users they referred, and the qualified users
+    those referred in turn. Referrers missing from `ids` and self-referrals
+    are ignored.
+    """
+    rows, found = _rows_of(ids, parents)
+    referred = found & (parents != 0) & (parents != ids)
+    direct = np.bincount(rows[referred & qualified], minlength=len(ids))
+    second = np.bincount(rows[referred], weights=direct[referred], minlength=len(ids)).astype(np.int64)
+    return direct, second
+
+
+def user_weights(users: UserArrays, rules: AllocationRules) -> np.ndarray:
+    """score x task multiplier x referral multiplier, 0 for users below min_score."""
+    qualified = users.scores >= rules.min_score
+    direct, second = referral_counts(users.ids, users.parents, qualified)
+    multiplier = (1 + rules.task_bonus * users.tasks) * (
+        1
+        + rules.referral_bonus * np.minimum(direct, rules.referral_cap)
+        + rules.referral_level2_bonus * np.minimum(second, rules.referral_cap)
+    )
+    return np.where(qualified, np.maximum(users.scores, 0) * multiplier, 0.0)
+
+
+def pro_rata(weights: np.ndarray, total: int, cap: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Splits `total` in proportion to `weights`, no share above `cap`: shares
+    over it are capped and the excess split among the others, until no
+    share is over. Returns the shares and which ones were capped.
+    """
+    shares = np.zeros(len(weights))
+    capped = np.zeros(len(weights), bool)
+    free = weights > 0
+    remaining = float(total)
+    while remaining > 0 and free.any():
+        free_weights = np.where(free, weights, 0.0)
+        round_shares = free_weights * (remaining / free_weights.sum())
+        over = round_shares > cap
+        if not over.any():
+            shares += round_shares
+            break
+        shares[over] = cap
+        capped |= over
+        free &= ~over
+        remaining -= cap * np.count_nonzero(over)
+    return shares, capped
+
+
+def to_units(shares: np.ndarray, target: int, capped: np.ndarray) -> np.ndarray:
+    """Rounds shares down to whole units, then hands the remainder to the largest fractions."""
+    amounts = np.floor(shares).astype(np.int64)
+    remainder = target - int(amounts.sum())
+    if remainder > 0:
+        fractions = np.where(capped, -1.0, shares - amounts)
+        remainder = min(remainder, np.count_nonzero(~capped))
+        if remainder:
+            amounts[np.argpartition(-fractions, remainder - 1)[:remainder]] += 1
+    return amounts
+
+
+def compute_allocation(users: UserArrays, rules: AllocationRules) -> Allocation:
+    """Per-wallet amounts for `users`, with the duplicate wallets merged per rules.wallet_policy."""
+    if rules.wallet_policy not in WALLET_POLICIES:
+        raise ValueError(f"wallet_policy must be one of {', '.join(WALLET_POLICIES)}")
+    if not 0 < rules.total < MAX_TOTAL:
+        raise ValueError(f"total must be between 1 and {MAX_TOTAL - 1} units")
+    # A cap of 0 units would cap every wallet at nothing and leave the whole total unallocated
+    cap = float(np.floor(rules.max_share * rules.total))
+    if cap < 1:
+        raise ValueError(f"max_share of total must be at least 1 unit, raise max_share to 1/{rules.total} or more")
+
+    weights = user_weights(users, rules)
+    eligible = weights[users.wallet_rows] > 0
+    rows = users.wallet_rows[eligible]
+    wallets, wallet_of = np.unique(users.wallets[eligible], return_inverse=True)
+    accounts = np.bincount(wallet_of, minlength=len(wallets))
+    scores = np.zeros(len(wallets), np.int64)
+    if rules.wallet_policy == "max":
+        wallet_weights = np.zeros(len(wallets))
+        np.maximum.at(wallet_weights, wallet_of, weights[rows])
+        np.maximum.at(scores, wallet_of, users.scores[rows])
+    else:
+        wallet_weights = np.bincount(wallet_of, weights=weights[rows], minlength=len(wallets))
+        np.add.at(scores, wallet_of, users.scores[rows])
+
+    shares, capped = pro_rata(wallet_weights, rules.total, cap)
+    amounts = to_units(shares, min(rules.total, round(float(shares.sum()))), capped)
+    stats = {
+        "users": len(users.ids),
+        "eligible_users": len(rows),
+        "invalid_wallets": users.invalid_wallets,
+        "wallets": len(wallets),
+        "shared_wallets": int(np.count_nonzero(accounts > 1)),
+        "capped_wallets": int(np.count_nonzero(capped)),
+        "allocated": int(amounts.sum()),
+        "unallocated": rules.total - int(amounts.sum()),
+    }
+    return Allocation(wallets, amounts, accounts.astype(np.int32), scores, wallet_weights, capped, stats)
+
+
+def write_allocation(engine, allocation: Allocation, chunk_size: int = AIRDROP_CHUNK_SIZE):
+    """Replaces the AirdropAllocation table with `allocation`, in one transaction."""
+    with engine.begin() as connection:
+        connection.execute(delete(AirdropAllocation))
+        for start in range(0, len(allocation.wallets), chunk_size):
+            part = slice(start, start + chunk_size)
+            connection.execute(insert(AirdropAllocation), [
+                {"wallet_address": wallet, "amount": amount, "users": users, "score": score,
+                 "weight": weight, "capped": capped}
+                for wallet, amount, users, score, weight, capped in zip(
+                    np.char.decode(allocation.wallets[part], "ascii").tolist(),
+                    allocation.amounts[part].tolist(), allocation.users[part].tolist(),
+                    allocation.scores[part].tolist(), allocation.weights[part].tolist(),
+                    allocation.capped[part].tolist(),
+                )
+            ])
+
+
+def allocate_airdrop(engine, rules: AllocationRules, *, write: bool = True,
+                     chunk_size: int = AIRDROP_CHUNK_SIZE) -> Allocation:
+    """Loads the users, computes every wallet's amount and, unless `write` is False, stores them."""
+    started = time.perf_counter()
+    users = load_users(engine, chunk_size)
+    loaded = time.perf_counter()
+    allocation = compute_allocation(users, rules)
+    computed = time.perf_counter()
+    if write:
+        write_allocation(engine, allocation, chunk_size)
+    allocation.stats.update(load_seconds=loaded - started, compute_seconds=computed - loaded,
+                            write_seconds=time.perf_counter() - computed)
+    return allocation
@@ -0,0 +1,193 @@
+from pathlib import Path
+from typing import NamedTuple, Optional
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+
+from fastapi import Response
+import orjson
+
+from .leaderboard import etag_matches
+
+FRONTEND_DIR = Path(__file__).resolve().parents[2] / "frontend"
+# Output of `python -m backend.cli build-assets`, served when present.
+ASSETS_DIST_DIR = Path(os.getenv("ASSETS_DIST_DIR", str(FRONTEND_DIR / "dist")))
+# URL prefix of the fingerprinted files, cached by clients for a year.
+ASSETS_URL_PREFIX = "/assets/"
+ENTRY_POINT = "index.html"
+# A compressed variant is only kept when it saves at least this much.
+MIN_COMPRESSION_SAVING = 0.1
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# index.html and the unhashed names must be revalidated, the ETag makes that a 304
+REVALIDATE = "no-cache"
+
+# Content-coding -> file suffix, preferred first; identity is always available.
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+class Asset(NamedTuple):
+    media_type: str
+    digest: str
+    cache_control: str
+    # content-coding ("" for identity) -> body
+    bodies: dict
+
+
+def _fingerprint(name: str, digest: str) -> str:
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+
+
+def _compress(data: bytes, best: bool) -> dict:
+    """
+    The identity body plus every compressed variant worth keeping. `best`
+    is for the build step; the maximum brotli quality costs a fraction of a
+    second per file, too slow for a worker's startup.
+    """
+    variants = {"gzip": gzip.compress(data, compresslevel=9 if best else 6, mtime=0)}
+    try:
+        import brotli
+        variants["br"] = brotli.compress(data, quality=11 if best else 5)
+    except ImportError:
+        pass
+    bodies = {"": data}
+    for encoding, body in variants.items():
+        if len(body) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+            bodies[encoding] = body
+    return bodies
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """The content-codings of an Accept-Encoding header, minus those refused with q=0."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _rewrite_references(html: str, urls: dict) -> str:
+    """Points every quoted reference to a source file at its fingerprinted URL."""
+    for name, url in urls.items():
+        html = re.sub(r"""(["'(])%s(["')])""" % re.escape(name), lambda m: m.group(1) + url + m.group(2), html)
+    return html
+
+
+class AssetBundle:
+    """
+    The frontend as a set of in-memory responses: every file under a
+    content-hashed name below ASSETS_URL_PREFIX, with gzip and brotli
+    variants, and index.html rewritten to reference those names.
+    """
+
+    def __init__(self, assets: dict):
+        # URL path -> Asset
+        self.assets = assets
+
+    @classmethod
+    def build(cls, source_dir: Path = FRONTEND_DIR, best: bool = True) -> "AssetBundle":
+        """Fingerprints and compresses the files of `source_dir`."""
+        assets = {}
+        urls = {}
+        for path in sorted(source_dir.iterdir()):
+            if not path.is_file() or path.name == ENTRY_POINT:
+                continue
+            data = path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            bodies = _compress(data, best)
+            urls[path.name] = ASSETS_URL_PREFIX + _fingerprint(path.name, digest)
+            assets[urls[path.name]] = Asset(media_type, digest, IMMUTABLE, bodies)
+            # Pages loaded before the rewrite still ask for the plain name
+            assets["/" + path.name] = Asset(media_type, digest, REVALIDATE, bodies)
+
+        html = _rewrite_references((source_dir / ENTRY_POINT).read_text(encoding="utf-8"), urls).encode()
+        digest = hashlib.sha256(html).hexdigest()[:12]
+        entry = Asset("text/html; charset=utf-8", digest, REVALIDATE, _compress(html, best))
+        assets["/"] = assets["/" + ENTRY_POINT] = entry
+        return cls(assets)
+
+    def write(self, dist_dir: Path = ASSETS_DIST_DIR):
+        """
+        Writes every variant to `dist_dir` with a manifest, so workers load the
+        bundle instead of compressing at startup.
+        """
+        if dist_dir.exists():
+            shutil.rmtree(dist_dir)
+        dist_dir.mkdir(parents=True)
+        manifest = {}
+        for url, asset in self.assets.items():
+            if url == "/":
+                continue
+            # A file and its plain-name alias share one copy
+            name = url.rpartition("/")[2]
+            if not url.startswith(ASSETS_URL_PREFIX):
+                name = _fingerprint(name, asset.digest)
+            for encoding, body in asset.bodies.items():
+                (dist_dir / (name + ENCODINGS.get(encoding, ""))).write_bytes(body)
+            manifest[url] = {"file": name, "media_type": asset.media_type, "digest": asset.digest,
+                             "cache_control": asset.cache_control, "encodings": sorted(asset.bodies)}
+        (dist_dir / "manifest.json").write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    @classmethod
+    def load(cls, dist_dir: Path = ASSETS_DIST_DIR) -> "AssetBundle":
+        manifest = orjson.loads((dist_dir / "manifest.json").read_bytes())
+        assets = {}
+        for url, entry in manifest.items():
+            bodies = {encoding: (dist_dir / (entry["file"] + ENCODINGS.get(encoding, ""))).read_bytes()
+                      for encoding in entry["encodings"]}
+            assets[url] = Asset(entry["media_type"], entry["digest"], entry["cache_control"], bodies)
+        assets["/"] = assets["/" + ENTRY_POINT]
+        return cls(assets)
+
+    @classmethod
+    def load_or_build(cls) -> "AssetBundle":
+        if (ASSETS_DIST_DIR / "manifest.json").exists():
+            return cls.load()
+        print("Frontend assets are not built, compressing them in memory "
+              "(run `python -m backend.cli build-assets` at deploy time).")
+        return cls.build(best=False)
+
+    def response(self, path: str, accept_encoding: Optional[str] = None,
+                 if_none_match: Optional[str] = None) -> Optional[Response]:
+        """The response for `path`, or None if there is no such asset."""
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+        encoding = ""
+        if len(asset.bodies) > 1:
+            accepted = _accepted_encodings(accept_encoding)
+            encoding = next((name for name in ENCODINGS if name in asset.bodies and name in accepted), "")
+
+        # Every encoding is a different representation and gets its own ETag
+        etag = f'"{asset.digest}-{encoding}"' if encoding else f'"{asset.digest}"'
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control}
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+
+frontend_assets: Optional[AssetBundle] = None
+
+
+def get_frontend_assets() -> AssetBundle:
+    """The bundle, loaded on first use."""
+    global frontend_assets
+    if frontend_assets is None:
+        frontend_assets = AssetBundle.load_or_build()
+    return frontend_assets
@@ -0,0 +1,454 @@
+from collections import deque
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+import os
+import socket
+import threading
+import time
+import uuid
+
+import orjson
+
+# Cross-worker invalidations for the in-process caches. Off by default: a
+# single worker needs none. "unix" connects the workers of one host through
+# datagram sockets in CACHE_BUS_DIR, "redis" through PUBLISH/SUBSCRIBE on
+# CACHE_BUS_URL (Redis, or any server speaking its protocol, such as
+# `python -m backend.cli cache-bus-serve`).
+CACHE_BUS = os.getenv("CACHE_BUS", "").lower()
+CACHE_BUS_DIR = os.getenv("CACHE_BUS_DIR", "/tmp/unique-cache-bus")
+CACHE_BUS_URL = os.getenv("CACHE_BUS_URL", "redis://127.0.0.1:6379/0")
+CACHE_BUS_CHANNEL = os.getenv("CACHE_BUS_CHANNEL", "unique:cache")
+# Items per message, keeps unix datagrams well under the socket buffer size.
+CACHE_BUS_CHUNK = 2000
+
+# Local handlers run when a gap in a peer's sequence numbers shows that
+# invalidations were lost, and after reconnecting to the broker.
+RESET = "reset"
+
+
+class UnixSocketTransport:
+    """
+    Every worker binds a datagram socket in `directory` and sends each message
+    to all the others. Sockets of workers that are gone are removed on the
+    first failed send.
+    """
+
+    def __init__(self, directory: str = CACHE_BUS_DIR):
+        self.directory = directory
+        self.path: Optional[str] = None
+        self._receiver: Optional[socket.socket] = None
+        self._sender: Optional[socket.socket] = None
+        self.peers = 0
+
+    def open(self):
+        # Named when opened, in the worker, not in a master that imported the app before forking
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        os.makedirs(self.directory, exist_ok=True)
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._receiver.settimeout(0.5)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # A peer that is behind holds up the sender thread only briefly
+        self._sender.settimeout(0.05)
+
+    def close(self):
+        for sock in (self._receiver, self._sender):
+            if sock is not None:
+                sock.close()
+        self._receiver = self._sender = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def send(self, message: bytes) -> bool:
+        # Listed on every send so a worker that just started gets everything
+        delivered = True
+        peers = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".sock") or entry.path == self.path:
+                continue
+            peers += 1
+            try:
+                self._sender.sendto(message, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                peers -= 1
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+            except (socket.timeout, BlockingIOError):
+                # That worker's queue stayed full; it sees the gap and resets
+                delivered = False
+        self.peers = peers
+        return delivered
+
+    def receive(self) -> Optional[bytes]:
+        """The next message, or None after a short timeout."""
+        try:
+            return self._receiver.recv(65536)
+        except socket.timeout:
+            return None
+
+
+def _resp_command(*parts: bytes) -> bytes:
+    return b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+
+
+class _Reader:
+    """Buffered reads from a blocking socket that can tell whether a reply is waiting."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    def _fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("connection closed")
+        self.buffer += chunk
+
+    def readline(self) -> bytes:
+        while (end := self.buffer.find(b"\r\n")) < 0:
+            self._fill()
+        line = bytes(self.buffer[:end + 2])
+        del self.buffer[:end + 2]
+        return line
+
+    def read(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def ready(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for data."""
+        if self.buffer:
+            return True
+        self.sock.settimeout(timeout)
+        try:
+            self._fill()
+        except socket.timeout:
+            return False
+        finally:
+            self.sock.settimeout(None)
+        return True
+
+
+def _resp_read(reader: _Reader):
+    """Reads one RESP value."""
+    line = reader.readline()
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        raise ConnectionError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        return None if size < 0 else reader.read(size + 2)[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [_resp_read(reader) for _ in range(size)]
+    raise ConnectionError(f"unexpected reply {line!r}")
+
+
+class RedisTransport:
+    """
+    PUBLISH/SUBSCRIBE on one channel over the Redis protocol, on two plain
+    socket connections. A message that cannot be published is dropped: the
+    receivers see the gap and reset.
+    """
+
+    def __init__(self, url: str = CACHE_BUS_URL, channel: str = CACHE_BUS_CHANNEL):
+        parts = urlsplit(url)
+        self.address = (parts.hostname or "127.0.0.1", parts.port or 6379)
+        self.password = parts.password
+        self.channel = channel.encode()
+        self._publisher = None
+        self._subscriber = None
+        self.reconnected = False
+        self.peers = 0
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        reader = _Reader(sock)
+        if self.password:
+            sock.sendall(_resp_command(b"AUTH", self.password.encode()))
+            _resp_read(reader)
+        return sock, reader
+
+    def open(self):
+        try:
+            self._subscribe()
+            self.reconnected = False
+        except OSError as e:
+            # receive() keeps retrying; the app starts without the bus meanwhile
+            print(f"Cache bus cannot subscribe: {e}")
+
+    def close(self):
+        for connection in (self._publisher, self._subscriber):
+            if connection is not None:
+                connection[0].close()
+        self._publisher = self._subscriber = None
+
+    def _subscribe(self):
+        sock, reader = self._connect()
+        sock.sendall(_resp_command(b"SUBSCRIBE", self.channel))
+        _resp_read(reader)
+        sock.settimeout(None)
+        self._subscriber = (sock, reader)
+        self.reconnected = True
+
+    def send(self, message: bytes) -> bool:
+        try:
+            if self._publisher is None:
+                self._publisher = self._connect()
+            sock, reader = self._publisher
+            sock.sendall(_resp_command(b"PUBLISH", self.channel, message))
+            # Subscribers that got it, ourselves included
+            self.peers = max(_resp_read(reader) - 1, 0)
+            return True
+        except OSError as e:
+            print(f"Cache bus publish failed: {e}")
+            if self._publisher is not None:
+                self._publisher[0].close()
+                self._publisher = None
+            return False
+
+    def receive(self) -> Optional[bytes]:
+        if self._subscriber is None:
+            try:
+                self._subscribe()
+            except OSError as e:
+                print(f"Cache bus cannot subscribe: {e}")
+                time.sleep(1)
+                return None
+        try:
+            if not self._subscriber[1].ready(0.5):
+                return None
+            reply = _resp_read(self._subscriber[1])
+        except OSError as e:
+            print(f"Cache bus subscription lost: {e}")
+            self._subscriber[0].close()
+            self._subscriber = None
+            return None
+        if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+            return reply[2]
+        return None
+
+
+class CacheBus:
+    """
+    Carries invalidations between the workers of a deployment.
+
+    publish() only queues the message, a background thread batches what was
+    queued, stamps it with this worker's origin and next sequence number and
+    sends it. Receivers apply each message through the handlers registered
+    for its topic. A gap in a peer's sequence numbers means messages were
+    lost, so the RESET handlers drop everything cached locally.
+    """
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.origin = ""
+        self._handlers: dict[str, list[Callable[[list], None]]] = {}
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._seq = 0
+        # origin -> last sequence number applied
+        self._seen: dict[str, int] = {}
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.resets = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.transport is not None
+
+    def on(self, topic: str, handler: Callable[[list], None]):
+        """Calls `handler` with the items of every `topic` message from another worker."""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic: str, items=()):
+        # Nothing is queued unless the bus runs, e.g. in CLI commands
+        if not self._threads:
+            return
+        self._queue.append((topic, items))
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def start(self):
+        if self.transport is None or self._threads:
+            return
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.transport.open()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._send_loop, name="cache-bus-sender", daemon=True),
+            threading.Thread(target=self._receive_loop, name="cache-bus-receiver", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Sends whatever is still queued and closes the transport."""
+        if not self._threads:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self.transport.close()
+
+    def _send_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Cache bus send failed: {e}")
+        self.flush()
+
+    def flush(self):
+        """Sends the queued messages, merged per topic."""
+        merged: dict[str, list] = {}
+        while self._queue:
+            topic, items = self._queue.popleft()
+            merged.setdefault(topic, []).extend(items)
+        for topic, items in merged.items():
+            for start in range(0, max(len(items), 1), CACHE_BUS_CHUNK):
+                self._seq += 1
+                message = orjson.dumps([self.origin, self._seq, topic, items[start:start + CACHE_BUS_CHUNK]])
+                if self.transport.send(message):
+                    self.published += 1
+                else:
+                    self.dropped += 1
+
+    def _receive_loop(self):
+        while not self._stop.is_set():
+            try:
+                message = self.transport.receive()
+                if getattr(self.transport, "reconnected", False):
+                    # Whatever was published while we were away is lost
+                    self.transport.reconnected = False
+                    self._seen.clear()
+                    self._dispatch(RESET, [])
+                if message is not None:
+                    self.apply(message)
+            except Exception as e:
+                print(f"Cache bus receive failed: {e}")
+
+    def apply(self, message: bytes):
+        origin, seq, topic, items = orjson.loads(message)
+        if origin == self.origin:
+            return
+        self.received += 1
+        last = self._seen.get(origin)
+        self._seen[origin] = seq
+        if last is not None and seq != last + 1:
+            print(f"Cache bus lost {seq - last - 1} messages from {origin}, resetting caches.")
+            self._dispatch(RESET, [])
+        self._dispatch(topic, items)
+
+    def _dispatch(self, topic: str, items: list):
+        if topic == RESET:
+            self.resets += 1
+        for handler in self._handlers.get(topic, ()):
+            handler(items)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "peers": getattr(self.transport, "peers", 0),
+            "queued": len(self._queue),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "resets": self.resets,
+        }
+
+
+def _transport_from_env():
+    if CACHE_BUS == "unix":
+        return UnixSocketTransport()
+    if CACHE_BUS == "redis":
+        return RedisTransport()
+    if CACHE_BUS:
+        raise ValueError(f"Unknown CACHE_BUS {CACHE_BUS!r}, expected unix or redis")
+    return None
+
+
+cache_bus = CacheBus(_transport_from_env())
+
+
+class RespBroker:
+    """
+    A minimal stand-in for Redis pub/sub: enough of the protocol (PUBLISH,
+    SUBSCRIBE, PING, AUTH) for RedisTransport, for hosts without a Redis.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379):
+        self.address = (host, port)
+        self._lock = threading.Lock()
+        # channel -> sockets subscribed to it
+        self._channels: dict[bytes, set] = {}
+
+    def serve_forever(self):
+        with socket.create_server(self.address) as server:
+            print(f"Cache bus broker listening on {self.address[0]}:{self.address[1]}")
+            while True:
+                sock, _ = server.accept()
+                threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        reader = _Reader(sock)
+        subscribed = set()
+        try:
+            while True:
+                command = _resp_read(reader)
+                if not isinstance(command, list) or not command:
+                    break
+                name = command[0].upper()
+                if name == b"PUBLISH":
+                    sock.sendall(b":%d\r\n" % self._publish(command[1], command[2]))
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        with self._lock:
+                            self._channels.setdefault(channel, set()).add(sock)
+                        subscribed.add(channel)
+                        sock.sendall(b"*3\r\n$9\r\nsubscribe\r\n$%d\r\n%s\r\n:%d\r\n"
+                                     % (len(channel), channel, len(subscribed)))
+                elif name == b"PING":
+                    sock.sendall(b"+PONG\r\n")
+                elif name == b"AUTH":
+                    sock.sendall(b"+OK\r\n")
+                else:
+                    sock.sendall(b"-ERR unknown command\r\n")
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                for channel in subscribed:
+                    self._channels.get(channel, set()).discard(sock)
+            sock.close()
+
+    def _publish(self, channel: bytes, message: bytes) -> int:
+        payload = _resp_command(b"message", channel, message)
+        delivered = 0
+        # Held while sending so messages from concurrent publishers never interleave
+        with self._lock:
+            for sock in self._channels.get(channel, ()):
+                try:
+                    sock.sendall(payload)
+                    delivered += 1
+                except OSError:
+                    pass
+        return delivered
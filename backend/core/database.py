@@ -1,28 +1,146 @@
-
-from sqlmodel import create_engine, SQLModel, Session
+from sqlalchemy import event
+from sqlmodel import create_engine, Session
 import os
 
+from .metrics import instrument_engine
+from .profiling import trace_engine
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not DATABASE_URL:
     print("--- Database_url not found")
     DATABASE_URL = "sqlite:///../database.db"
 
-engine = create_engine(DATABASE_URL, echo=True)
+# Hosting providers still hand out the old "postgres://" scheme, which SQLAlchemy rejects
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL[len("postgres://"):]
+
+# --- Engine configuration ---
+DB_ECHO = os.getenv("DB_ECHO") == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Serve the player endpoints from async handlers on an async engine.
+# Needs aiosqlite (SQLite) or asyncpg (PostgreSQL).
+ASYNC_DB = os.getenv("ASYNC_DB") == "true"
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the single writer, and synchronous=NORMAL
+    is durable enough in WAL mode while skipping an fsync per commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _engine_options(url: str, echo: bool) -> dict:
+    if url.startswith("sqlite"):
+        return {"echo": echo}
+    return {
+        "echo": echo,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: str = DATABASE_URL, *, echo: bool = DB_ECHO):
+    """
+    Creates the engine with production settings: pooled, health-checked
+    connections for PostgreSQL and WAL mode for SQLite. SQL echo is opt-in
+    through DB_ECHO=true.
+    """
+    new_engine = create_engine(url, **_engine_options(url, echo))
+    if url.startswith("sqlite") and ":memory:" not in url:
+        event.listen(new_engine, "connect", _set_sqlite_pragmas)
+    instrument_engine(new_engine)
+    trace_engine(new_engine)
+    return new_engine
+
+
+engine = build_engine()
+
 def create_db_and_tables():
     """
-    Initializes the database by creating all tables defined by SQLModel.
+    Brings the database schema up to date by applying the pending migrations
+    in backend/migrations. With DB_AUTO_MIGRATE=false it only reports them.
+    A database already at head costs one query: Alembic is not even loaded.
     """
-    print("Creating database and tables...")
-    SQLModel.metadata.create_all(engine, checkfirst=True)
+    from .migrations import DB_AUTO_MIGRATE, current_revision, head_revision, is_up_to_date, upgrade_database
 
-    print("Database and tables created successfully.")
+    if is_up_to_date(engine):
+        return
+    if not DB_AUTO_MIGRATE:
+        current, head = current_revision(engine), head_revision()
+        if current != head:
+            print(f"--- Database schema is at {current}, not {head}; run `python -m backend.cli db-upgrade`")
+        return
+
+    print("Applying database migrations...")
+    upgrade_database(engine)
+    print(f"Database schema is at revision {current_revision(engine)}.")
 
 def get_session():
     """
-    A FastAPI dependency to provide a database session to endpoints.
+    A FastAPI dependency to provide a database session to endpoints. An
+    endpoint that raises is rolled back explicitly: closing the session
+    would not run the after_rollback hooks, which return drained taps to
+    the tap buffer.
     """
     with Session(engine) as session:
-        yield session
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
+
+
+def async_database_url(url: str = DATABASE_URL) -> str:
+    """Swaps the sync driver in `url` for its asyncio counterpart."""
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS[scheme.split('+')[0]]}://{rest}"
 
 
+_async_engine = None
+
+def get_async_engine():
+    """Creates the async engine on first use, with the same settings as build_engine()."""
+    global _async_engine
+    if _async_engine is None:
+        # The asyncio extension is only loaded when ASYNC_DB is used
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        url = async_database_url()
+        _async_engine = create_async_engine(url, **_engine_options(url, DB_ECHO))
+        if url.startswith("sqlite") and ":memory:" not in url:
+            event.listen(_async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        instrument_engine(_async_engine.sync_engine)
+        trace_engine(_async_engine.sync_engine)
+    return _async_engine
+
+async def get_async_session():
+    """
+    The async counterpart of get_session. Objects stay loaded after commit,
+    since lazy refreshes are not possible outside an await.
+    """
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
@@ -0,0 +1,71 @@
+from typing import Iterable, Iterator, Optional
+import csv
+import io
+import json
+import zlib
+
+from sqlmodel import select
+
+from .ledger import balance_join
+from .models import User
+
+EXPORT_FIELDS = ("id", "username", "first_name", "score", "wallet_address", "referred_by_id")
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_CHUNK_SIZE = 5000
+
+
+def iter_user_rows(engine, *, min_score: Optional[int] = None, has_wallet: bool = False,
+                   chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[list]:
+    """
+    Yields the users table in chunks of `chunk_size` rows through a server-side
+    cursor, so memory stays flat no matter how many users there are.
+    """
+    joined, balance = balance_join()
+    columns = [balance.label(field) if field == "score" else getattr(User, field) for field in EXPORT_FIELDS]
+    statement = select(*columns).select_from(joined).order_by(User.id)
+    if min_score is not None:
+        statement = statement.where(balance >= min_score)
+    if has_wallet:
+        statement = statement.where(User.wallet_address.is_not(None), User.wallet_address != "")
+
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+        for partition in result.partitions():
+            yield partition
+
+
+def encode_rows(chunks: Iterable[list], fmt: str) -> Iterator[bytes]:
+    """Encodes row chunks as CSV (with a header line) or NDJSON, one bytes block per chunk."""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    elif fmt == "ndjson":
+        for chunk in chunks:
+            yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n" for row in chunk).encode()
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def gzip_stream(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Gzip-compresses a stream of blocks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_users(engine, fmt: str = "csv", *, gzip: bool = False, min_score: Optional[int] = None,
+                 has_wallet: bool = False) -> Iterator[bytes]:
+    """The full export pipeline: stream users, encode them, optionally gzip."""
+    blocks = encode_rows(iter_user_rows(engine, min_score=min_score, has_wallet=has_wallet), fmt)
+    return gzip_stream(blocks) if gzip else blocks
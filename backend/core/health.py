@@ -0,0 +1,97 @@
+from typing import Callable, Optional
+import os
+import time
+
+from sqlalchemy import text
+
+from .database import get_async_engine
+
+# Pooled connections opened at startup, so the first requests after a
+# restart do not each pay for connecting.
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))
+
+
+def warm_pool(engine, size: int = DB_POOL_WARM) -> int:
+    """Opens `size` connections at once, then returns them to the pool."""
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+async def warm_async_pool(size: int = DB_POOL_WARM) -> int:
+    """warm_pool for the async engine."""
+    connections = []
+    try:
+        for _ in range(size):
+            connection = await get_async_engine().connect()
+            await connection.execute(text("SELECT 1"))
+            connections.append(connection)
+    finally:
+        for connection in connections:
+            await connection.close()
+    return len(connections)
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    if not hasattr(pool, "checkedin"):
+        return {}
+    return {"size": pool.size(), "checked_in": pool.checkedin(), "checked_out": pool.checkedout()}
+
+
+class Readiness:
+    """
+    What /readyz reports. A worker is ready once the startup steps have run,
+    its pool is warm and the work started in the background at boot is done,
+    and stops being ready as soon as shutdown begins, so the load balancer
+    drains it first.
+    """
+
+    def __init__(self):
+        self.booted = time.monotonic()
+        self.startup_seconds: Optional[float] = None
+        self.warm_connections = 0
+        self.draining = False
+        self._waiting_for: dict[str, Callable[[], bool]] = {}
+
+    def wait_for(self, name: str, done: Callable[[], bool]):
+        """Keeps the worker starting until `done()` is true."""
+        self._waiting_for[name] = done
+
+    def mark_ready(self, warm_connections: int):
+        self.warm_connections = warm_connections
+        self.startup_seconds = time.monotonic() - self.booted
+
+    def mark_draining(self):
+        self.draining = True
+
+    def report(self, engine) -> tuple[bool, dict]:
+        """Whether the worker should get traffic, and why; pings the database when it should."""
+        waiting = [name for name, done in self._waiting_for.items() if not done()]
+        starting = self.startup_seconds is None or waiting
+        report = {
+            "status": "starting" if starting else "draining" if self.draining else "ready",
+            "startup_seconds": self.startup_seconds,
+            "warm_connections": self.warm_connections,
+        }
+        if waiting:
+            report["waiting_for"] = waiting
+        if report["status"] == "ready":
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except Exception as e:
+                report["status"] = "database unavailable"
+                report["error"] = str(e)
+        report["pool"] = pool_stats(engine)
+        return report["status"] == "ready", report
+
+
+readiness = Readiness()
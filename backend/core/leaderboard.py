@@ -0,0 +1,119 @@
+from typing import Optional
+import hashlib
+import os
+import threading
+
+from fastapi import Response
+import orjson
+from sqlmodel import Session, select
+
+from .database import engine
+from .models import User
+from .ranking import rank_index
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+# How often the shared top of the board is rebuilt, also the client cache lifetime;
+# 0 rebuilds it on every request.
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", "5"))
+
+
+class _Board:
+    """One materialised top-N board: its JSON array, pre-encoded, and a hash of it."""
+    __slots__ = ("top_users", "digest")
+
+    def __init__(self, top_users: bytes):
+        self.top_users = top_users
+        self.digest = hashlib.blake2b(top_users, digest_size=8).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class LeaderboardSnapshot:
+    """
+    The top of the leaderboard, materialised every LEADERBOARD_REFRESH_SECONDS
+    from the rank index and shared by all requests.
+
+    Only the caller's rank differs between responses, so the ETag is the
+    board's content hash plus that rank. It is the same on every worker and
+    lets a request be answered with 304 before any body is built.
+    """
+
+    def __init__(self, engine, size: int = LEADERBOARD_SIZE, interval: int = LEADERBOARD_REFRESH_SECONDS):
+        self.engine = engine
+        self.size = size
+        self.interval = interval
+        self._board: Optional[_Board] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshes = 0
+
+    def refresh(self) -> bool:
+        """Rebuilds the board; returns True when its content changed."""
+        with self._refresh_lock:
+            top_entries = rank_index.top(self.size)
+            top_ids = [user_id for user_id, _ in top_entries]
+            names = {}
+            if top_ids:
+                with Session(self.engine) as session:
+                    rows = session.exec(select(User.id, User.username, User.first_name).where(User.id.in_(top_ids)))
+                    names = {row.id: row.username or row.first_name for row in rows}
+
+            top_users = orjson.dumps([
+                {"rank": i + 1, "username": names.get(user_id), "score": score}
+                for i, (user_id, score) in enumerate(top_entries)
+            ])
+            self.refreshes += 1
+            if self._board is not None and self._board.top_users == top_users:
+                return False
+            self._board = _Board(top_users)
+            return True
+
+    def board(self) -> _Board:
+        """The current board, built on first use."""
+        if self._board is None:
+            self.refresh()
+        return self._board
+
+    def response(self, user_rank: Optional[int], if_none_match: Optional[str] = None) -> Response:
+        """The /leaderboard response for a caller at `user_rank`, or a 304 if they have it already."""
+        if self.interval <= 0:
+            self.refresh()
+        board = self.board()
+
+        etag = f'"{board.digest}-{user_rank or 0}"'
+        headers = {"ETag": etag, "Cache-Control": f"private, max-age={self.interval}"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        rank = b"null" if user_rank is None else str(user_rank).encode()
+        body = b'{"top_users":' + board.top_users + b',"current_user_rank":' + rank + b"}"
+        return Response(body, media_type="application/json", headers=headers)
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Leaderboard refresh failed: {e}")
+
+
+leaderboard_snapshot = LeaderboardSnapshot(engine)
@@ -0,0 +1,283 @@
+from datetime import datetime, timedelta
+from typing import Optional, Union
+import os
+import threading
+
+from sqlalchemy import DateTime, event, func, insert, literal, update
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import select
+
+from .models import LedgerCursor, ScoreEvent, User
+
+# Seconds between compactions, 0 disables the background compactor (run
+# `python -m backend.cli ledger-compact` instead). Reads add up the events
+# not folded yet, so this bounds how many each of them sums.
+LEDGER_COMPACT_SECONDS = int(os.getenv("LEDGER_COMPACT_SECONDS", "60"))
+LEDGER_COMPACT_BATCH = int(os.getenv("LEDGER_COMPACT_BATCH", "50000"))
+# Events younger than this are left for the next run: a transaction that
+# took a lower event id may not have committed yet.
+LEDGER_COMPACT_LAG = int(os.getenv("LEDGER_COMPACT_LAG", "10"))
+
+SCORE_SOURCES = ("tap", "game", "task", "referral", "farming", "opening")
+
+# Arbitrary key for the PostgreSQL advisory lock held while compacting
+_COMPACT_LOCK_KEY = 7_301_114
+
+
+def record_score_event(session, user_id: int, source: str, delta: int):
+    """Queues a ledger entry; all of a session's entries are bulk-inserted when it commits."""
+    if delta:
+        session.info.setdefault("score_events", []).append({"user_id": user_id, "source": source, "delta": delta})
+
+
+def queued_delta(session, user_id: int) -> int:
+    """The sum of the user's entries queued on `session` and not inserted yet."""
+    return sum(entry["delta"] for entry in session.info.get("score_events", ()) if entry["user_id"] == user_id)
+
+
+def score_event_rows(deltas: dict, source: str) -> list:
+    """Ledger rows for a {user_id: delta} batch, for callers writing outside an ORM session."""
+    now = datetime.utcnow()
+    return [{"user_id": user_id, "source": source, "delta": delta, "created_at": now}
+            for user_id, delta in deltas.items() if delta]
+
+
+@event.listens_for(SASession, "before_commit")
+def flush_score_events(session):
+    """Bulk-inserts the ledger entries queued on `session`."""
+    events = session.info.pop("score_events", None)
+    if events:
+        # Stamped at insert time, which is what the compactor's lag is measured from
+        now = datetime.utcnow()
+        session.execute(insert(ScoreEvent), [{**entry, "created_at": now} for entry in events])
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_score_events(session):
+    session.info.pop("score_events", None)
+
+
+def folded_event_id():
+    """The id of the last event folded into User.score, as a SQL expression."""
+    return func.coalesce(select(LedgerCursor.last_event_id).where(LedgerCursor.id == 1).scalar_subquery(), 0)
+
+
+def unfolded_delta(user_id: Union[int, object]):
+    """
+    The sum of a user's events not folded into User.score yet, as a scalar
+    subquery; `user_id` is an id or a column to correlate with.
+    """
+    return func.coalesce(
+        select(func.sum(ScoreEvent.delta))
+        .where(ScoreEvent.user_id == user_id, ScoreEvent.id > folded_event_id())
+        .scalar_subquery(),
+        0,
+    )
+
+
+def balance_column(user_id: Union[int, object] = User.id, extra: int = 0, label: str = "score"):
+    """
+    A user's balance: User.score plus their unfolded events, plus `extra`.
+    What every read shows as the score; for a few rows at a time.
+    """
+    balance = User.score + unfolded_delta(user_id)
+    if extra:
+        balance = balance + extra
+    return balance.label(label)
+
+
+def unfolded_totals():
+    """
+    (user_id, delta) for every user with unfolded events, to outer join to
+    a scan of the users table instead of summing their events row by row.
+    """
+    return (
+        select(ScoreEvent.user_id, func.sum(ScoreEvent.delta).label("delta"))
+        .where(ScoreEvent.id > folded_event_id())
+        .group_by(ScoreEvent.user_id)
+        .subquery("unfolded")
+    )
+
+
+def balance_join():
+    """
+    (from clause, balance expression) for full scans of the users table:
+    User outer joined to unfolded_totals, and User.score plus their delta.
+    """
+    unfolded = unfolded_totals()
+    joined = User.__table__.outerjoin(unfolded, unfolded.c.user_id == User.id)
+    return joined, User.score + func.coalesce(unfolded.c.delta, 0)
+
+
+def users_with_balances(*columns):
+    """SELECT of `columns` and the balance (labelled score) of every user, for full scans."""
+    joined, balance = balance_join()
+    return select(*columns, balance.label("score")).select_from(joined)
+
+
+def ledger_balance(session, user_id: int) -> int:
+    """A user's balance replayed from every one of their ledger events."""
+    flush_score_events(session)
+    return session.execute(
+        select(func.coalesce(func.sum(ScoreEvent.delta), 0)).where(ScoreEvent.user_id == user_id)
+    ).scalar()
+
+
+def user_ledger(session, user_id: int, limit: int = 50) -> Optional[dict]:
+    """Audit view of one user: their score, what the full ledger replays to and the latest events."""
+    flush_score_events(session)
+    scores = session.execute(select(User.score, balance_column(user_id)).where(User.id == user_id)).first()
+    if scores is None:
+        return None
+    folded, score = scores
+    events = session.execute(
+        select(ScoreEvent.id, ScoreEvent.source, ScoreEvent.delta, ScoreEvent.created_at)
+        .where(ScoreEvent.user_id == user_id)
+        .order_by(ScoreEvent.id.desc())
+        .limit(limit)
+    ).all()
+    balance = ledger_balance(session, user_id)
+    return {
+        "user_id": user_id,
+        "score": score,
+        "folded_score": folded,
+        "unfolded": score - folded,
+        "ledger_balance": balance,
+        "drift": score - balance,
+        "events": [
+            {"id": e.id, "source": e.source, "delta": e.delta, "created_at": e.created_at.isoformat()}
+            for e in events
+        ],
+    }
+
+
+def lock_compaction(connection, wait: bool = True) -> bool:
+    """
+    Keeps other compactions out of the caller's transaction, on PostgreSQL;
+    False when `wait` is off and one is running. SQLite serializes writers.
+    """
+    if connection.dialect.name != "postgresql":
+        return True
+    if wait:
+        connection.execute(select(func.pg_advisory_xact_lock(_COMPACT_LOCK_KEY)))
+        return True
+    return connection.execute(select(func.pg_try_advisory_xact_lock(_COMPACT_LOCK_KEY))).scalar()
+
+
+def _cursor(connection) -> int:
+    last_event_id = connection.execute(select(LedgerCursor.last_event_id).where(LedgerCursor.id == 1)).scalar()
+    if last_event_id is None:
+        # Tables made by SQLModel.metadata.create_all (the benchmarks) have no row yet
+        connection.execute(insert(LedgerCursor).values(id=1, last_event_id=0))
+        return 0
+    return last_event_id
+
+
+def _move_cursor(connection, start: int, end: int):
+    moved = connection.execute(
+        update(LedgerCursor).where(LedgerCursor.id == 1, LedgerCursor.last_event_id == start).values(last_event_id=end)
+    )
+    if moved.rowcount != 1:
+        raise RuntimeError("Another compaction moved the ledger cursor")
+
+
+def backfill_opening_balances(engine) -> int:
+    """
+    Gives every user with a score but no ledger entries an 'opening' event
+    for it, so balances that predate the ledger add up. The events are
+    already part of User.score, so the cursor is moved past them. Run once,
+    with the app stopped, when turning the ledger on for an existing database.
+    """
+    compact_ledger(engine, lag=0)
+    has_events = select(ScoreEvent.id).where(ScoreEvent.user_id == User.id).exists()
+    opening = (
+        select(User.id, literal("opening"), User.score, literal(datetime.utcnow(), DateTime))
+        .where(User.score != 0, ~has_events)
+    )
+    with engine.begin() as connection:
+        lock_compaction(connection)
+        start = _cursor(connection)
+        result = connection.execute(
+            insert(ScoreEvent).from_select(["user_id", "source", "delta", "created_at"], opening)
+        )
+        end = connection.execute(select(func.coalesce(func.max(ScoreEvent.id), 0))).scalar()
+        _move_cursor(connection, start, end)
+    return result.rowcount
+
+
+def compact_ledger(engine, batch: int = LEDGER_COMPACT_BATCH, lag: int = LEDGER_COMPACT_LAG) -> int:
+    """
+    Folds ledger events into User.score in id order, `batch` events per
+    transaction, and returns how many were folded. Each transaction adds the
+    events' sums to the users and moves the cursor past them, so balances
+    read at any point count every event exactly once. Stops at the first
+    event younger than `lag` seconds.
+    """
+    # scoring imports this module
+    from .scoring import tap_level_expr
+
+    folded = 0
+    while True:
+        cutoff = datetime.utcnow() - timedelta(seconds=lag)
+        with engine.begin() as connection:
+            if not lock_compaction(connection, wait=False):
+                return folded
+            start = _cursor(connection)
+            young = connection.execute(
+                select(func.min(ScoreEvent.id)).where(ScoreEvent.id > start, ScoreEvent.created_at >= cutoff)
+            ).scalar()
+            window = select(ScoreEvent.id).where(ScoreEvent.id > start)
+            if young is not None:
+                window = window.where(ScoreEvent.id < young)
+            window = window.order_by(ScoreEvent.id).limit(batch).subquery()
+            count, end = connection.execute(select(func.count(), func.max(window.c.id)).select_from(window)).one()
+            if not count:
+                return folded
+
+            sums = (
+                select(ScoreEvent.user_id, func.sum(ScoreEvent.delta).label("delta"))
+                .where(ScoreEvent.id > start, ScoreEvent.id <= end)
+                .group_by(ScoreEvent.user_id)
+                .subquery()
+            )
+            new_score = User.score + sums.c.delta
+            connection.execute(
+                update(User)
+                .where(User.id == sums.c.user_id)
+                .values(score=new_score, tap_level=tap_level_expr(new_score))
+            )
+            _move_cursor(connection, start, end)
+            folded += count
+        if count < batch:
+            return folded
+
+
+class LedgerCompactor:
+    """Background thread that periodically runs compact_ledger."""
+
+    def __init__(self, engine, interval: int = LEDGER_COMPACT_SECONDS):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ledger-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                folded = compact_ledger(self.engine)
+                if folded:
+                    print(f"Ledger compacted, {folded} events folded into user scores.")
+            except Exception as e:
+                print(f"Ledger compaction failed: {e}")
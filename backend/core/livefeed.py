@@ -0,0 +1,237 @@
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+import asyncio
+import json
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+
+from .database import engine
+from .leaderboard import leaderboard_snapshot
+from .ranking import rank_index
+from .scoring import load_user_state
+from .usercache import user_cache
+
+# Open /live streams allowed per process, and per user (tabs, devices).
+LIVE_MAX_CONNECTIONS = int(os.getenv("LIVE_MAX_CONNECTIONS", "5000"))
+LIVE_MAX_PER_USER = int(os.getenv("LIVE_MAX_PER_USER", "3"))
+# Time-derived state (farming rewards, recharged sessions, rank) is re-checked
+# this often; changes pushed by the scoring code are sent right away, but never
+# more than once per LIVE_MIN_INTERVAL_SECONDS to the same stream.
+LIVE_TICK_SECONDS = float(os.getenv("LIVE_TICK_SECONDS", "5"))
+LIVE_MIN_INTERVAL_SECONDS = float(os.getenv("LIVE_MIN_INTERVAL_SECONDS", "1"))
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15"))
+# Streams are ended after this long and the client reconnects, which spreads
+# clients over workers and keeps a restart from waiting on idle streams.
+LIVE_MAX_STREAM_SECONDS = float(os.getenv("LIVE_MAX_STREAM_SECONDS", "300"))
+LIVE_RETRY_MS = 3000
+
+
+class LiveFeedFull(Exception):
+    """The process already serves LIVE_MAX_CONNECTIONS streams."""
+
+
+class UserStreamLimit(Exception):
+    """The user already has LIVE_MAX_PER_USER streams open."""
+
+
+class LiveStreamResponse(StreamingResponse):
+    """
+    Releases its subscriber however the response ends: the stream's own
+    cleanup only runs once the body is iterated, which a client that goes
+    away before the first chunk never gets to.
+    """
+
+    def __init__(self, hub: "LiveHub", subscriber: "Subscriber", content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.hub = hub
+        self.subscriber = subscriber
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.hub.unsubscribe(self.subscriber)
+
+
+class Subscriber:
+    """
+    One open stream. Notifications only mark it stale and wake it up, so a
+    slow client never queues anything: whatever changed while it was busy is
+    folded into the next state it is sent.
+    """
+    __slots__ = ("user_id", "stale", "closed", "_loop", "_wakeup", "_scheduled")
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.stale = False
+        self.closed = False
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._scheduled = False
+
+    def notify(self, stale: bool = True):
+        """Wakes the stream up; safe to call from any thread."""
+        if stale:
+            self.stale = True
+        if self._scheduled:
+            return
+        self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # The loop is gone, and with it the stream
+            pass
+
+    def close(self):
+        self.closed = True
+        self.notify(stale=False)
+
+    def _wake(self):
+        self._scheduled = False
+        self._wakeup.set()
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def load_user_row(user_id: int):
+    """load_user_state in a session of its own, for code outside a request session."""
+    with Session(engine) as session:
+        return load_user_state(session, user_id)
+
+
+class LiveHub:
+    """
+    In-process pub/sub for the /live stream. Committed user changes reach it
+    through user_cache invalidations and wake that user's streams; rank and
+    leaderboard changes are picked up from memory on every tick. An idle
+    stream costs a socket and a timer, not queries.
+    """
+
+    def __init__(self, max_connections: int = LIVE_MAX_CONNECTIONS, max_per_user: int = LIVE_MAX_PER_USER):
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._subscribers: dict[int, list[Subscriber]] = {}
+        self.connections = 0
+        self.rejected = 0
+        self.notifications = 0
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        subscriber = Subscriber(user_id, asyncio.get_running_loop())
+        with self._lock:
+            streams = self._subscribers.get(user_id, [])
+            if self.connections >= self.max_connections:
+                self.rejected += 1
+                raise LiveFeedFull()
+            if len(streams) >= self.max_per_user:
+                self.rejected += 1
+                raise UserStreamLimit()
+            self._subscribers[user_id] = [*streams, subscriber]
+            self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            streams = self._subscribers.get(subscriber.user_id, [])
+            if subscriber not in streams:
+                return
+            streams = [stream for stream in streams if stream is not subscriber]
+            if streams:
+                self._subscribers[subscriber.user_id] = streams
+            else:
+                del self._subscribers[subscriber.user_id]
+            self.connections -= 1
+
+    def notify(self, user_ids: Iterable[int]):
+        """Tells the streams of `user_ids` that their stored state changed."""
+        with self._lock:
+            if not self._subscribers:
+                return
+            streams = [stream for user_id in user_ids for stream in self._subscribers.get(user_id, ())]
+        for stream in streams:
+            stream.notify()
+        self.notifications += len(streams)
+
+    def close_all(self):
+        with self._lock:
+            streams = [stream for user_streams in self._subscribers.values() for stream in user_streams]
+        for stream in streams:
+            stream.close()
+
+    def stats(self) -> dict:
+        return {"connections": self.connections, "rejected": self.rejected, "notifications": self.notifications}
+
+    async def stream(self, subscriber: Subscriber, row, render_state: Callable[[object, datetime], str]):
+        """
+        The server-sent events for `subscriber`, starting from the user's
+        state `row`. Emits "state" (render_state(row, now)), "rank" and
+        "leaderboard" events, each only when its content changed.
+        """
+        user_id = subscriber.user_id
+        sent: dict[str, str] = {}
+        board_digest: Optional[str] = None
+        started = last_sent = time.monotonic()
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n"
+            while not subscriber.closed and time.monotonic() - started < LIVE_MAX_STREAM_SECONDS:
+                if subscriber.stale:
+                    subscriber.stale = False
+                    row = await run_in_threadpool(load_user_row, user_id)
+                    if row is None:
+                        break
+
+                chunks = []
+                for event, data in (
+                    ("state", render_state(row, datetime.utcnow())),
+                    ("rank", json.dumps({"current_user_rank": rank_index.rank(user_id)})),
+                ):
+                    if sent.get(event) != data:
+                        sent[event] = data
+                        chunks.append(_sse(event, data))
+                board = leaderboard_snapshot.board()
+                if board.digest != board_digest:
+                    board_digest = board.digest
+                    chunks.append(_sse("leaderboard", '{"top_users":' + board.top_users.decode() + "}"))
+
+                if chunks:
+                    yield "".join(chunks)
+                    last_sent = time.monotonic()
+                    # Notifications arriving meanwhile collapse into one update
+                    await asyncio.sleep(LIVE_MIN_INTERVAL_SECONDS)
+                elif time.monotonic() - last_sent >= LIVE_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+
+                await subscriber.wait(LIVE_TICK_SECONDS)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def response(self, subscriber: Subscriber, row, render_state: Callable[[object, datetime], str]) -> StreamingResponse:
+        """The event stream of `subscriber` as a response that unsubscribes it when done."""
+        try:
+            return LiveStreamResponse(
+                self, subscriber, self.stream(subscriber, row, render_state),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+        except BaseException:
+            self.unsubscribe(subscriber)
+            raise
+
+
+live_hub = LiveHub()
+user_cache.subscribe(live_hub.notify)
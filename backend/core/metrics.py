@@ -0,0 +1,191 @@
+from contextvars import ContextVar
+from typing import Optional
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+# Request/SQL instrumentation is opt-in; when off, nothing is hooked in.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED") == "true"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """What a single request spent on SQL and auth; lives in a ContextVar."""
+    __slots__ = ("queries", "db_seconds", "auth_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.auth_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class _RouteMetrics:
+    __slots__ = ("latency", "queries", "db_seconds", "auth_seconds")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.auth_seconds = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes: dict[tuple[str, str, int], _RouteMetrics] = {}
+        self.auth_latency = Histogram()
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route, status)
+        with self._lock:
+            metrics = self.routes.get(key)
+            if metrics is None:
+                metrics = self.routes[key] = _RouteMetrics()
+            metrics.latency.observe(seconds)
+            metrics.queries += stats.queries
+            metrics.db_seconds += stats.db_seconds
+            metrics.auth_seconds += stats.auth_seconds
+
+    def record_auth(self, seconds: float):
+        with self._lock:
+            self.auth_latency.observe(seconds)
+        stats = _current.get()
+        if stats is not None:
+            stats.auth_seconds += seconds
+
+
+registry = MetricsRegistry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    stats = _current.get()
+    if stats is not None and started is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Counts statements and DB time per request on `engine` (a sync Engine)."""
+    if not METRICS_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def record_auth_time(seconds: float):
+    registry.record_auth(seconds)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, SQL statement count and DB/auth time
+    per route. Routes are labelled by their path template, not the raw URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "unmatched"
+            registry.record_request(scope["method"], label, status[0], elapsed, stats)
+
+
+def _format_labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _render_histogram(lines: list, name: str, histogram: Histogram, labels: dict):
+    prefix = _format_labels(labels)
+    sep = "," if prefix else ""
+    suffix = f"{{{prefix}}}" if prefix else ""
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}{sep}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}{sep}le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def render_prometheus(gauges: Optional[dict] = None, counters: Optional[dict] = None) -> str:
+    """
+    Renders all metrics, plus the given `{name: value}` gauges and counters,
+    in Prometheus text format. Counter names get the _total suffix.
+    """
+    lines = []
+    with registry._lock:
+        lines.append("# HELP http_request_duration_seconds Request latency by route.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route, status), metrics in registry.routes.items():
+            labels = {"method": method, "route": route, "status": status}
+            _render_histogram(lines, "http_request_duration_seconds", metrics.latency, labels)
+
+        for name, attr, help_text in (
+            ("http_request_sql_statements_total", "queries", "SQL statements executed by route."),
+            ("http_request_db_seconds_total", "db_seconds", "Time spent in the database by route."),
+            ("http_request_auth_seconds_total", "auth_seconds", "Time spent validating initData by route."),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (method, route, status), metrics in registry.routes.items():
+                labels = _format_labels({"method": method, "route": route, "status": status})
+                lines.append(f"{name}{{{labels}}} {getattr(metrics, attr)}")
+
+        lines.append("# HELP auth_validation_duration_seconds get_validated_data latency.")
+        lines.append("# TYPE auth_validation_duration_seconds histogram")
+        _render_histogram(lines, "auth_validation_duration_seconds", registry.auth_latency, {})
+
+    for name, value in (counters or {}).items():
+        lines.append(f"# TYPE {name}_total counter")
+        lines.append(f"{name}_total {value}")
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+import os
+import re
+
+from sqlalchemy import func, inspect, text
+from sqlmodel import select
+
+try:
+    import fcntl
+except ImportError:
+    # No lock file on Windows; SQLite there is for development only
+    fcntl = None
+
+# Apply pending migrations at startup; set to false to run them with
+# `python -m backend.cli db-upgrade` before deploying instead.
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true") == "true"
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+
+# Arbitrary key for the PostgreSQL advisory lock held while migrating
+_MIGRATE_LOCK_KEY = 7_301_115
+
+
+def alembic_config(connection=None):
+    """An Alembic config for backend/migrations that runs on `connection`."""
+    # Alembic is only imported by the code paths that migrate
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    config.attributes["connection"] = connection
+    return config
+
+
+def head_revision() -> str:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(engine) -> Optional[str]:
+    """The revision the database is at; None before its first migration."""
+    from alembic.runtime.migration import MigrationContext
+
+    with engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def script_head() -> Optional[str]:
+    """
+    The head revision, read from the migration files without loading Alembic;
+    None if there is no single head.
+    """
+    revisions, parents = set(), set()
+    for path in (MIGRATIONS_DIR / "versions").glob("*.py"):
+        source = path.read_text(encoding="utf-8")
+        revision = re.search(r"^revision = ['\"](\w+)['\"]", source, re.M)
+        if revision:
+            revisions.add(revision.group(1))
+        parents.update(re.findall(r"^down_revision = ['\"](\w+)['\"]", source, re.M))
+    heads = revisions - parents
+    return heads.pop() if len(heads) == 1 else None
+
+
+def is_up_to_date(engine) -> bool:
+    """True when the database is at the head revision; a plain query, no Alembic."""
+    head = script_head()
+    with engine.connect() as connection:
+        if head is None or not inspect(connection).has_table("alembic_version"):
+            return False
+        return connection.execute(text("SELECT version_num FROM alembic_version")).scalars().all() == [head]
+
+
+@contextmanager
+def _migration_lock(connection):
+    """
+    Held while migrating, so one worker migrates while the others wait and
+    then find nothing to do: an advisory lock on PostgreSQL, a lock file next
+    to the database on SQLite.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_lock(_MIGRATE_LOCK_KEY)))
+        connection.commit()
+        try:
+            yield
+        finally:
+            connection.execute(select(func.pg_advisory_unlock(_MIGRATE_LOCK_KEY)))
+            connection.commit()
+        return
+
+    database = connection.engine.url.database
+    if connection.dialect.name != "sqlite" or fcntl is None or not database or database == ":memory:":
+        yield
+        return
+    with open(database + ".migrate-lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _migrate(engine, action, revision: str):
+    with engine.connect() as connection:
+        with _migration_lock(connection):
+            action(alembic_config(connection), revision)
+
+
+def upgrade_database(engine, revision: str = "head"):
+    """
+    Applies the migrations up to `revision`. A database created before
+    migrations existed starts from the baseline, which only adds what it lacks.
+    """
+    from alembic import command
+
+    _migrate(engine, command.upgrade, revision)
+
+
+def downgrade_database(engine, revision: str):
+    from alembic import command
+
+    _migrate(engine, command.downgrade, revision)
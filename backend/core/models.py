@@ -1,4 +1,5 @@
 
+from sqlalchemy import BigInteger, Column, Index, Integer
 from sqlmodel import Field, SQLModel
 from typing import Optional
 from datetime import datetime 
@@ -7,6 +8,9 @@ import uuid
 MAX_SESSIONS = 10
 
 class User(SQLModel, table=True):
+    # Keyset pagination of a referrer's friends walks this index
+    __table_args__ = (Index("ix_user_referred_by_id_id", "referred_by_id", "id"),)
+
     id: int = Field(default=None, primary_key=True)
     first_name: str
     last_name: Optional[str] = None
@@ -27,6 +31,10 @@ class User(SQLModel, table=True):
 
 
 
+# The admin dashboard pages through users in this order
+Index("ix_user_score_id", User.__table__.c.score.desc(), User.__table__.c.id)
+
+
 class Task(SQLModel, table=True):
     id: int = Field(default=None, primary_key=True)
     name: str = Field(index=True)
@@ -38,3 +46,44 @@ class Task(SQLModel, table=True):
 class UserTask(SQLModel, table=True):
     user_id: int = Field(foreign_key="user.id", primary_key=True)
     task_id: int = Field(foreign_key="task.id", primary_key=True)
+
+class SyncCursor(SQLModel, table=True):
+    """The highest client sequence number /sync_batch has applied for each user."""
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    # Clients may use millisecond timestamps as sequence numbers
+    last_seq: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+
+class ScoreEvent(SQLModel, table=True):
+    """
+    Append-only ledger of every score change. Changes are only appended
+    here; the compactor folds them into User.score in id order, and reads
+    add the events past LedgerCursor to it.
+    """
+    __table_args__ = (Index("ix_scoreevent_user_id_id", "user_id", "id"),)
+
+    # BIGINT on PostgreSQL; SQLite only autoincrements a plain INTEGER primary key
+    id: Optional[int] = Field(default=None, sa_column=Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True))
+    user_id: int = Field(foreign_key="user.id")
+    source: str  # tap, game, task, referral, farming or opening
+    delta: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class LedgerCursor(SQLModel, table=True):
+    """The last ScoreEvent folded into User.score; a single row, id 1."""
+    id: int = Field(default=1, primary_key=True)
+    last_event_id: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+
+class AirdropAllocation(SQLModel, table=True):
+    """A wallet's share of the airdrop, as last computed by `python -m backend.cli airdrop-allocate`."""
+    wallet_address: str = Field(primary_key=True)
+    amount: int = Field(sa_column=Column(BigInteger, nullable=False))
+    users: int  # accounts sharing the wallet
+    score: int = Field(sa_column=Column(BigInteger, nullable=False))
+    weight: float
+    capped: bool = Field(default=False)
+
+class ReferralStats(SQLModel, table=True):
+    """Per-referrer totals, updated together with the referral bonus so /friends never counts rows."""
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    referrals: int = Field(default=0)
+    referral_earned: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
@@ -0,0 +1,348 @@
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+import functools
+import inspect
+import itertools
+import os
+import sys
+import sysconfig
+import threading
+import time
+
+from sqlalchemy import event
+
+# Requests slower than this keep a trace (SQL and call tree); 0 turns tracing off.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+# How many slow traces each worker keeps, newest first.
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "50"))
+# Stack sampling interval while requests are in flight.
+SLOW_REQUEST_SAMPLE_MS = float(os.getenv("SLOW_REQUEST_SAMPLE_MS", "10"))
+# Path prefixes never traced: streams and the profiler itself are slow by design.
+SLOW_REQUEST_EXCLUDE = tuple(
+    prefix for prefix in os.getenv("SLOW_REQUEST_EXCLUDE", "/live,/admin/profile,/admin/export").split(",") if prefix
+)
+
+MAX_STATEMENTS = 200
+MAX_STATEMENT_CHARS = 1000
+MAX_STACKS = 2000
+MAX_DEPTH = 128
+# Innermost frames of a thread that is waiting for work, not doing any
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait")}
+
+# Frame paths are shown relative to the repo, site-packages or the standard library
+_PATH_PREFIXES = sorted({
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    *(sysconfig.get_paths()[name] for name in ("purelib", "platlib", "stdlib", "platstdlib")),
+}, key=len, reverse=True)
+_labels: dict = {}
+
+
+def _label(code) -> str:
+    """`function (path:line)` for a code object."""
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        prefix = next((prefix for prefix in _PATH_PREFIXES if path.startswith(prefix + os.sep)), None)
+        if prefix:
+            path = path[len(prefix) + 1:]
+        # ";" separates frames in the folded format
+        label = _labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+    return label
+
+
+def _stack(frame) -> Optional[tuple]:
+    """The frames from the outermost in, or None for an idle thread."""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def _count(stacks: Counter, stack: tuple):
+    if len(stacks) >= MAX_STACKS and stack not in stacks:
+        stack = ("[more stacks than MAX_STACKS]",)
+    stacks[stack] += 1
+
+
+def folded(stacks: Counter) -> str:
+    """Stacks in the folded format read by flamegraph.pl, inferno and speedscope."""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+_capture_lock = threading.Lock()
+
+
+def sample_profile(seconds: float, interval: float = 0.005) -> Counter:
+    """
+    Samples the stacks of every thread of this worker for `seconds`, leaving
+    out idle ones. Blocks the calling thread, which is not sampled; raises
+    RuntimeError when another capture is running.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already being captured")
+    try:
+        # Neither the caller nor the slow request sampler are part of the workload
+        skip = {threading.get_ident()} | {
+            thread.ident for thread in threading.enumerate() if thread.name == "slow-request-sampler"
+        }
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in skip:
+                    continue
+                stack = _stack(frame)
+                if stack is not None:
+                    _count(stacks, stack)
+            time.sleep(interval)
+        return stacks
+    finally:
+        _capture_lock.release()
+
+
+class RequestTrace:
+    """The SQL statements and sampled stacks of one request; lives in a ContextVar."""
+
+    def __init__(self, trace_id: int, method: str, path: str):
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status = 500
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        # Threads the request ran on: the event loop's, and the pool
+        # threads its SQL was issued from
+        self.threads = {threading.get_ident()}
+        # (offset ms, duration ms, rows, statement)
+        self.statements: list[tuple] = []
+        self.dropped_statements = 0
+        self.db_seconds = 0.0
+        self.stacks = Counter()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": self.started_at,
+            "ms": round(self.seconds * 1000, 2),
+            "queries": len(self.statements) + self.dropped_statements,
+            "db_ms": round(self.db_seconds * 1000, 2),
+            "samples": sum(self.stacks.values()),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "statements": [
+                {"offset_ms": offset, "ms": ms, "rows": rows, "sql": sql}
+                for offset, ms, rows, sql in self.statements
+            ],
+            "dropped_statements": self.dropped_statements,
+            "call_tree": [{"stack": list(stack), "samples": count} for stack, count in self.stacks.most_common()],
+        }
+
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+class SlowRequestLog:
+    """
+    Traces every request and keeps the last `keep` that took longer than
+    `threshold` seconds. While requests are in flight, a thread samples the
+    stacks of the threads they run on; samples of the event loop thread are
+    shared by the async requests in flight at the time.
+    """
+
+    def __init__(self, threshold: float = SLOW_REQUEST_MS / 1000, keep: int = SLOW_REQUEST_KEEP,
+                 interval: float = SLOW_REQUEST_SAMPLE_MS / 1000):
+        self.threshold = threshold
+        self.interval = interval
+        self.traces: deque[RequestTrace] = deque(maxlen=keep)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._in_flight: dict[int, RequestTrace] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+
+    def begin(self, method: str, path: str) -> RequestTrace:
+        trace = RequestTrace(next(self._ids), method, path)
+        with self._lock:
+            self._in_flight[trace.id] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return trace
+
+    def end(self, trace: RequestTrace):
+        trace.seconds = time.perf_counter() - trace.started
+        with self._lock:
+            del self._in_flight[trace.id]
+            if trace.seconds >= self.threshold:
+                self.traces.appendleft(trace)
+                self.recorded += 1
+
+    def get(self, trace_id: int) -> Optional[RequestTrace]:
+        with self._lock:
+            return next((trace for trace in self.traces if trace.id == trace_id), None)
+
+    def summaries(self) -> list[dict]:
+        with self._lock:
+            return [trace.summary() for trace in self.traces]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"kept": len(self.traces), "recorded": self.recorded, "in_flight": len(self._in_flight)}
+
+    def _sample(self):
+        frames = sys._current_frames()
+        stacks = {}
+        with self._lock:
+            for trace in self._in_flight.values():
+                for thread_id in tuple(trace.threads):
+                    if thread_id not in stacks:
+                        frame = frames.get(thread_id)
+                        stacks[thread_id] = _stack(frame) if frame is not None else None
+                    if stacks[thread_id] is not None:
+                        _count(trace.stacks, stacks[thread_id])
+
+    def _run(self):
+        while True:
+            with self._lock:
+                busy = bool(self._in_flight)
+            if not busy:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self._sample()
+            time.sleep(self.interval)
+
+
+slow_requests = SlowRequestLog()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    if trace is not None:
+        # Sampled while the statement runs, when not sampled already
+        thread_id = threading.get_ident()
+        if thread_id not in trace.threads:
+            trace.threads.add(thread_id)
+            conn.info["trace_thread"] = thread_id
+        conn.info["trace_query_started"] = time.perf_counter()
+
+
+def _release_thread(conn):
+    thread_id = conn.info.pop("trace_thread", None)
+    trace = _trace.get()
+    if thread_id is not None and trace is not None:
+        trace.threads.discard(thread_id)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _release_thread(conn)
+    started = conn.info.pop("trace_query_started", None)
+    trace = _trace.get()
+    if trace is None or started is None:
+        return
+    now = time.perf_counter()
+    trace.db_seconds += now - started
+    if len(trace.statements) >= MAX_STATEMENTS:
+        trace.dropped_statements += 1
+        return
+    # Statements only, the parameters may hold user data
+    trace.statements.append((
+        round((started - trace.started) * 1000, 3),
+        round((now - started) * 1000, 3),
+        cursor.rowcount,
+        statement[:MAX_STATEMENT_CHARS],
+    ))
+
+
+def _on_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None:
+        _release_thread(context.connection)
+        context.connection.info.pop("trace_query_started", None)
+
+
+def trace_engine(engine):
+    """Records the statements of traced requests on `engine` (a sync Engine)."""
+    if not SLOW_REQUEST_MS:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _on_error)
+
+
+def _on_traced_thread(call):
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        trace = _trace.get()
+        if trace is None:
+            return call(*args, **kwargs)
+        thread_id = threading.get_ident()
+        added = thread_id not in trace.threads
+        trace.threads.add(thread_id)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            if added:
+                trace.threads.discard(thread_id)
+    return wrapper
+
+
+def trace_sync_endpoints(routes):
+    """
+    Sync endpoints run on pool threads the sampler does not know about; wraps
+    them so their whole run is sampled, not only what follows the first SQL
+    statement. Call once every route is registered.
+    """
+    if not SLOW_REQUEST_MS:
+        return
+    for route in routes:
+        dependant = getattr(route, "dependant", None)
+        call = getattr(dependant, "call", None)
+        if call is None or inspect.iscoroutinefunction(call) or inspect.isgeneratorfunction(call):
+            continue
+        dependant.call = _on_traced_thread(call)
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware tracing each request into `slow_requests`, except SLOW_REQUEST_EXCLUDE."""
+
+    def __init__(self, app, log: SlowRequestLog = slow_requests):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(SLOW_REQUEST_EXCLUDE):
+            await self.app(scope, receive, send)
+            return
+
+        trace = self.log.begin(scope["method"], scope["path"])
+        token = _trace.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _trace.reset(token)
+            trace.route = getattr(scope.get("route"), "path", None)
+            self.log.end(trace)
@@ -0,0 +1,51 @@
+from typing import NamedTuple
+
+from sqlalchemy import text
+
+from .ranking import users_by_score_statement
+from .referrals import friends_page_statement
+from .scoring import user_state_statement
+
+
+class PlanCheck(NamedTuple):
+    query: str
+    index: str
+    uses_index: bool
+    plan: str
+
+
+def hot_queries() -> dict:
+    """The statements that must stay index range scans, with the index each one relies on."""
+    return {
+        "admin users, first page": (users_by_score_statement(None, 50), "ix_user_score_id"),
+        "admin users, next page": (users_by_score_statement((1000, 1), 50), "ix_user_score_id"),
+        "friends, first page": (friends_page_statement(1, None, 20), "ix_user_referred_by_id_id"),
+        "friends, next page": (friends_page_statement(1, 1, 20), "ix_user_referred_by_id_id"),
+        # A balance only adds up the user's events past the ledger cursor
+        "user balance": (user_state_statement(1), "ix_scoreevent_user_id_id"),
+    }
+
+
+def explain(connection, statement) -> str:
+    """The database's query plan for `statement`, as text."""
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return "\n".join(row[0] for row in connection.execute(text("EXPLAIN " + sql)))
+
+
+def check_query_plans(engine) -> list[PlanCheck]:
+    """
+    EXPLAINs every hot query and reports whether its plan uses the expected
+    index. PostgreSQL prefers sequential scans on small tables, so they are
+    disabled for the check: what matters is that the index can serve the query.
+    """
+    checks = []
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, (statement, index) in hot_queries().items():
+            plan = explain(connection, statement)
+            checks.append(PlanCheck(name, index, index in plan, plan))
+        connection.rollback()
+    return checks
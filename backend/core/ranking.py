@@ -0,0 +1,297 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+import os
+import threading
+
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+from .cachebus import RESET, cache_bus
+from .ledger import balance_column, users_with_balances
+from .models import User
+
+# How often the in-memory index is rebuilt from the database (seconds).
+RANK_RECONCILE_SECONDS = int(os.getenv("RANK_RECONCILE_SECONDS", "300"))
+
+# Target chunk size of the sorted list; chunks are split at twice this size.
+_LOAD = 512
+
+
+class _OrderStatisticList:
+    """
+    A sorted list split into chunks, with a Fenwick tree over the chunk
+    lengths so "how many keys are smaller than X" is answered in O(log n).
+    """
+
+    def __init__(self, keys: Optional[list] = None):
+        keys = keys or []
+        self._lists = [keys[i:i + _LOAD] for i in range(0, len(keys), _LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(keys)
+        self._build_tree()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _build_tree(self):
+        tree = [len(chunk) for chunk in self._lists]
+        for i in range(len(tree)):
+            j = i | (i + 1)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos: int, delta: int):
+        while pos < len(self._tree):
+            self._tree[pos] += delta
+            pos |= pos + 1
+
+    def _tree_prefix(self, pos: int) -> int:
+        total = 0
+        while pos > 0:
+            total += self._tree[pos - 1]
+            pos &= pos - 1
+        return total
+
+    def add(self, key):
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._build_tree()
+            return
+
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._lists[pos], key)
+        self._len += 1
+
+        chunk = self._lists[pos]
+        if len(chunk) > 2 * _LOAD:
+            # Split the oversized chunk; the tree layout changes so rebuild it.
+            self._lists.insert(pos + 1, chunk[_LOAD:])
+            del chunk[_LOAD:]
+            self._maxes[pos] = chunk[-1]
+            self._maxes.insert(pos + 1, self._lists[pos + 1][-1])
+            self._build_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, key) -> bool:
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        idx = bisect_left(chunk, key)
+        if chunk[idx] != key:
+            return False
+
+        del chunk[idx]
+        self._len -= 1
+        if chunk:
+            self._maxes[pos] = chunk[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_tree()
+        return True
+
+    def count_less(self, key) -> int:
+        """Number of stored keys strictly smaller than `key`."""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return self._tree_prefix(pos) + bisect_left(self._lists[pos], key)
+
+    def head(self, n: int) -> list:
+        result = []
+        for chunk in self._lists:
+            if len(result) >= n:
+                break
+            result.extend(chunk[:n - len(result)])
+        return result
+
+
+class RankIndex:
+    """
+    Keeps every user's score in memory ordered by (score DESC, id) so the
+    leaderboard never has to sort the user table.
+
+    Ranks follow SQL RANK() semantics: 1 + number of users with a higher score.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scores: dict[int, int] = {}
+        self._keys = _OrderStatisticList()
+        self._journal: Optional[dict[int, int]] = None
+        # One reconcile at a time: the boot load can overlap a cache bus reset
+        self._reconcile_lock = threading.Lock()
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def load(self, rows: Iterable[tuple[int, int]]):
+        """Replaces the whole index with `(user_id, score)` rows."""
+        scores = {user_id: score for user_id, score in rows}
+        keys = _OrderStatisticList(sorted((-score, user_id) for user_id, score in scores.items()))
+        with self._lock:
+            self._scores = scores
+            self._keys = keys
+            self.loaded = True
+
+    def update(self, user_id: int, score: int, broadcast: bool = True):
+        """Records the committed score of a user, with `broadcast` in the other workers too."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal[user_id] = score
+            self._set(user_id, score)
+        if broadcast:
+            cache_bus.publish("scores", ((user_id, score),))
+
+    def _set(self, user_id: int, score: int):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._keys.remove((-old, user_id))
+        self._scores[user_id] = score
+        self._keys.add((-score, user_id))
+
+    def score(self, user_id: int) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            score = self._scores.get(user_id)
+            if score is None:
+                return None
+            return self._keys.count_less((-score, float("-inf"))) + 1
+
+    def top(self, n: int) -> list[tuple[int, int]]:
+        """Returns the `n` best `(user_id, score)` pairs, best first."""
+        with self._lock:
+            return [(user_id, -neg_score) for neg_score, user_id in self._keys.head(n)]
+
+    def reconcile(self, session: Session) -> int:
+        """
+        Rebuilds the index from the database and returns how many users had
+        drifted. Updates that land while the table is being read are replayed
+        on top of the fresh snapshot so they are not lost.
+        """
+        with self._reconcile_lock:
+            with self._lock:
+                self._journal = {}
+            try:
+                rows = session.exec(users_with_balances(User.id)).all()
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+
+            fresh = dict(rows)
+            keys = _OrderStatisticList(sorted((-score, user_id) for user_id, score in fresh.items()))
+            with self._lock:
+                drifted = sum(1 for user_id, score in fresh.items() if self._scores.get(user_id) != score)
+                drifted += sum(1 for user_id in self._scores if user_id not in fresh)
+                journal, self._journal = self._journal, None
+                self._scores = fresh
+                self._keys = keys
+                self.loaded = True
+                for user_id, score in journal.items():
+                    self._set(user_id, score)
+            return drifted
+
+
+rank_index = RankIndex()
+
+
+def _apply_scores(updates: list):
+    for user_id, score in updates:
+        rank_index.update(user_id, score, broadcast=False)
+
+
+cache_bus.on("scores", _apply_scores)
+
+
+def users_by_score_statement(cursor: Optional[tuple[int, int]], limit: int):
+    """
+    One page of users ordered by (score DESC, id), plus one extra row to tell
+    whether there is a next page. `cursor` is the (score, id) of the previous
+    page's last row; each page is a range scan of ix_user_score_id. The order
+    is by the folded User.score, so rows carry their balance for display.
+    """
+    statement = select(User.id, User.username, User.score, User.wallet_address, balance_column(label="balance"))
+    if cursor is not None:
+        score, user_id = cursor
+        statement = statement.where(or_(User.score < score, and_(User.score == score, User.id > user_id)))
+    return statement.order_by(User.score.desc(), User.id).limit(limit + 1)
+
+
+def load_rank_index(engine):
+    """
+    Fills the rank index from the database. Scores committed while the table
+    is being read are kept, so this can run while the worker serves requests.
+    """
+    with Session(engine) as session:
+        rank_index.reconcile(session)
+    print(f"Rank index loaded with {len(rank_index)} users.")
+
+
+class RankReconciler:
+    """
+    Background thread that periodically reconciles the rank index with the DB,
+    and right away when the cache bus lost messages: the score updates of
+    other workers may be among them.
+    """
+
+    def __init__(self, engine, interval: int = RANK_RECONCILE_SECONDS):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._due = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        cache_bus.on(RESET, self._on_reset)
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="rank-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._due.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _on_reset(self, _):
+        # Called on the cache bus receiver thread, which must not read the table
+        if self._thread is not None:
+            self._due.set()
+        else:
+            threading.Thread(target=self.reconcile, name="rank-reconciler-reset", daemon=True).start()
+
+    def reconcile(self):
+        try:
+            with Session(self.engine) as session:
+                drifted = rank_index.reconcile(session)
+            if drifted:
+                print(f"Rank index reconciled, {drifted} users corrected.")
+        except Exception as e:
+            print(f"Rank index reconciliation failed: {e}")
+
+    def _run(self):
+        while True:
+            self._due.wait(self.interval)
+            if self._stop.is_set():
+                return
+            self._due.clear()
+            self.reconcile()
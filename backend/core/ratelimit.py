@@ -0,0 +1,144 @@
+from array import array
+from collections import OrderedDict
+from typing import Optional
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+
+from .models import MAX_SESSIONS
+from .scoring import RECHARGE_SECONDS
+
+# A 60 second game with a 50-point ball every 400 ms, the most one game can earn.
+MAX_GAME_POINTS = 7500
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true") == "true"
+# Score-writing requests per second per user, and how many can come at once.
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "2"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Points per second a user can plausibly earn: sessions recharge one per
+# RECHARGE_SECONDS and at most MAX_SESSIONS full games can be banked.
+RATE_LIMIT_POINTS_PER_SECOND = float(os.getenv("RATE_LIMIT_POINTS_PER_SECOND", str(MAX_GAME_POINTS / RECHARGE_SECONDS)))
+RATE_LIMIT_POINTS_BURST = float(os.getenv("RATE_LIMIT_POINTS_BURST", str(MAX_GAME_POINTS * MAX_SESSIONS)))
+# Users tracked at once; the least recently seen are forgotten first.
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+RATE_LIMIT_STRIPES = 16
+
+
+class _Stripe:
+    """The buckets of the users hashed to one lock: parallel arrays indexed by slot."""
+    __slots__ = ("lock", "slots", "requests", "points", "updated", "allowed", "throttled", "implausible")
+
+    def __init__(self, capacity: int):
+        self.lock = threading.Lock()
+        # user_id -> slot, least recently seen first
+        self.slots: OrderedDict[int, int] = OrderedDict()
+        self.requests = array("d", bytes(8 * capacity))
+        self.points = array("d", bytes(8 * capacity))
+        self.updated = array("d", bytes(8 * capacity))
+        self.allowed = 0
+        self.throttled = 0
+        self.implausible = 0
+
+
+class TokenBucketLimiter:
+    """
+    Two token buckets per user, one for requests and one for points. Users
+    are spread over RATE_LIMIT_STRIPES locks, so concurrent requests rarely
+    contend. A stripe that is full reuses the slot of its least recently seen
+    user; that user gets full buckets when they return.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_PER_SECOND,
+        burst: float = RATE_LIMIT_BURST,
+        points_rate: float = RATE_LIMIT_POINTS_PER_SECOND,
+        points_burst: float = RATE_LIMIT_POINTS_BURST,
+        max_users: int = RATE_LIMIT_MAX_USERS,
+        stripes: int = RATE_LIMIT_STRIPES,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.points_rate = points_rate
+        self.points_burst = points_burst
+        self._stripes = [_Stripe(max(1, max_users // stripes)) for _ in range(stripes)]
+
+    def acquire(self, user_id: int, points: int = 0) -> Optional[float]:
+        """
+        Takes one request and `points` points from the user's buckets. Returns
+        None when allowed, otherwise the seconds until it would be; math.inf
+        when `points` is more than the points bucket can ever hold.
+        """
+        stripe = self._stripes[user_id % len(self._stripes)]
+        now = time.monotonic()
+        with stripe.lock:
+            if points > self.points_burst:
+                stripe.implausible += 1
+                return math.inf
+
+            slot = stripe.slots.get(user_id)
+            if slot is None:
+                slot = self._allocate(stripe, user_id)
+                requests, earned = self.burst, self.points_burst
+            else:
+                stripe.slots.move_to_end(user_id)
+                elapsed = now - stripe.updated[slot]
+                requests = min(self.burst, stripe.requests[slot] + elapsed * self.rate)
+                earned = min(self.points_burst, stripe.points[slot] + elapsed * self.points_rate)
+
+            wait = None
+            if requests < 1:
+                wait = (1 - requests) / self.rate
+            elif earned < points:
+                wait = (points - earned) / self.points_rate
+            else:
+                requests -= 1
+                earned -= points
+
+            stripe.requests[slot] = requests
+            stripe.points[slot] = earned
+            stripe.updated[slot] = now
+            if wait is None:
+                stripe.allowed += 1
+            else:
+                stripe.throttled += 1
+            return wait
+
+    def _allocate(self, stripe: _Stripe, user_id: int) -> int:
+        if len(stripe.slots) < len(stripe.updated):
+            slot = len(stripe.slots)
+        else:
+            _, slot = stripe.slots.popitem(last=False)
+        stripe.slots[user_id] = slot
+        return slot
+
+    def stats(self) -> dict:
+        return {
+            "users": sum(len(stripe.slots) for stripe in self._stripes),
+            "allowed": sum(stripe.allowed for stripe in self._stripes),
+            "throttled": sum(stripe.throttled for stripe in self._stripes),
+            "implausible": sum(stripe.implausible for stripe in self._stripes),
+        }
+
+
+score_rate_limiter = TokenBucketLimiter()
+
+
+def enforce_rate_limit(user_id: int, points: int = 0):
+    """
+    Charges a score-writing request to the user's buckets; raises 429 with a
+    Retry-After when they are empty, and 422 for more points than a user
+    could ever have earned at once.
+    """
+    if not RATE_LIMIT_ENABLED or user_id is None:
+        return
+    wait = score_rate_limiter.acquire(user_id, max(points, 0))
+    if wait is None:
+        return
+    if wait == math.inf:
+        raise HTTPException(status_code=422, detail="More points than can be earned at once.")
+    raise HTTPException(status_code=429, detail="Too many requests, slow down.",
+                        headers={"Retry-After": str(math.ceil(wait))})
@@ -0,0 +1,64 @@
+from typing import Optional
+import os
+
+from sqlalchemy import delete, func, insert, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import select
+
+from .ledger import balance_column
+from .models import ReferralStats, User
+
+FRIENDS_PAGE_SIZE = int(os.getenv("FRIENDS_PAGE_SIZE", "20"))
+FRIENDS_MAX_PAGE_SIZE = 100
+
+
+def _stats_insert(dialect_name: str):
+    return (postgresql.insert if dialect_name == "postgresql" else sqlite.insert)(ReferralStats)
+
+
+def referral_credit_statement(dialect_name: str, referrer_id: int, bonus: int):
+    """Builds the upsert adding one referral and `bonus` earned points to the referrer's totals."""
+    stats = ReferralStats.__table__
+    upsert = _stats_insert(dialect_name).values(user_id=referrer_id, referrals=1, referral_earned=bonus)
+    return upsert.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "referrals": stats.c.referrals + 1,
+            "referral_earned": stats.c.referral_earned + upsert.excluded.referral_earned,
+        },
+    )
+
+
+def friends_page_statement(user_id: int, cursor: Optional[int], limit: int):
+    """
+    One page of the users `user_id` referred, ordered by id, plus one extra row
+    to tell whether there is a next page. `cursor` is the last id of the
+    previous page; each page is a range scan of ix_user_referred_by_id_id.
+    """
+    statement = select(User.id, User.username, User.first_name, balance_column()).where(User.referred_by_id == user_id)
+    if cursor is not None:
+        statement = statement.where(User.id > cursor)
+    return statement.order_by(User.id).limit(limit + 1)
+
+
+def referral_totals_statement(user_id: int):
+    return select(ReferralStats.referrals, ReferralStats.referral_earned).where(ReferralStats.user_id == user_id)
+
+
+def backfill_referral_stats(engine, bonus: int) -> int:
+    """
+    Recomputes every referrer's totals from User.referred_by_id, counting
+    `bonus` per referral. Run once, with the app stopped, on a database that
+    has referrals from before the totals were kept. Returns the referrer count.
+    """
+    totals = (
+        select(User.referred_by_id, func.count(), func.count() * literal(bonus))
+        .where(User.referred_by_id.is_not(None))
+        .group_by(User.referred_by_id)
+    )
+    with engine.begin() as connection:
+        connection.execute(delete(ReferralStats))
+        result = connection.execute(
+            insert(ReferralStats).from_select(["user_id", "referrals", "referral_earned"], totals)
+        )
+    return result.rowcount
@@ -0,0 +1,325 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, Integer, case, event, func, literal, literal_column, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session as SASession
+from sqlalchemy.sql.functions import FunctionElement
+from sqlmodel import select
+
+from .models import MAX_SESSIONS, ScoreEvent, User
+from .ledger import balance_column, folded_event_id, lock_compaction, queued_delta, record_score_event
+from .ranking import rank_index
+from .referrals import referral_credit_statement
+from .usercache import touch_user, user_cache
+
+REFERRAL_BONUS = 10000
+
+# One game session recharges every RECHARGE_SECONDS, up to MAX_SESSIONS.
+RECHARGE_SECONDS = 600
+
+# Score thresholds for each tap level, highest first.
+TAP_LEVELS = [(5000, 10), (1000, 5), (300, 3), (100, 2)]
+
+# Columns read next to the user's balance (see user_state_statement); with
+# it, enough to build a UserDataResponse. The stored score and tap level
+# lag behind the ledger, so they are not among them.
+USER_STATE_COLUMNS = (
+    User.id,
+    User.game_sessions,
+    User.wallet_address,
+    User.username,
+    User.referral_code,
+    User.last_session_recharge,
+)
+
+# What the read paths load (and cache) to answer /get_user_data.
+USER_READ_COLUMNS = (
+    *USER_STATE_COLUMNS,
+    User.first_name,
+    User.farming_rate,
+    User.last_claim_time,
+)
+
+
+def get_tap_level(score: int) -> int:
+    """Calculates the user's tap level based on their score."""
+    for threshold, level in TAP_LEVELS:
+        if score >= threshold:
+            return level
+    return 1
+
+
+def tap_level_expr(score_expr):
+    """SQL counterpart of get_tap_level, for the compactor's UPDATE."""
+    return case(*[(score_expr >= threshold, level) for threshold, level in TAP_LEVELS], else_=1)
+
+
+class intervals_between(FunctionElement):
+    """
+    Whole `seconds`-long intervals from datetime `start` to datetime `end`.
+    SQL has no portable datetime difference, so this compiles per dialect.
+    """
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(intervals_between)
+def _intervals_between(element, compiler, **kw):
+    start, end, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"CAST(FLOOR(EXTRACT(EPOCH FROM ({end} - {start})) / {seconds}) AS INTEGER)"
+
+
+@compiles(intervals_between, "sqlite")
+def _intervals_between_sqlite(element, compiler, **kw):
+    start, end, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"CAST((julianday({end}) - julianday({start})) * 86400 / {seconds} AS INTEGER)"
+
+
+def available_sessions(user, now: datetime) -> int:
+    """
+    Game sessions the user has at `now`, counting those recharged since
+    last_session_recharge. Recharges are derived on read and only written
+    when a session is used (see recharge_exprs).
+    """
+    recharged = int((now - user.last_session_recharge).total_seconds() // RECHARGE_SECONDS)
+    if recharged <= 0:
+        return user.game_sessions
+    return min(user.game_sessions + recharged, MAX_SESSIONS)
+
+
+def recharge_exprs(now_expr):
+    """
+    SQL counterpart of available_sessions: returns the (game_sessions,
+    last_session_recharge) expressions that persist the recharge in an UPDATE.
+    """
+    recharged = intervals_between(User.last_session_recharge, now_expr, literal_column(str(RECHARGE_SECONDS)))
+    sessions = case(
+        (recharged <= 0, User.game_sessions),
+        (User.game_sessions + recharged >= MAX_SESSIONS, MAX_SESSIONS),
+        else_=User.game_sessions + recharged,
+    )
+    timer = case((recharged > 0, now_expr), else_=User.last_session_recharge)
+    return sessions, timer
+
+
+def track_score(session: SASession, user_id: int, score: int):
+    """Remembers a score so it is pushed to the rank index once the session commits."""
+    session.info.setdefault("score_updates", {})[user_id] = score
+    touch_user(session, user_id)
+
+
+def user_state_statement(user_id: int, extra: int = 0, columns: tuple = USER_STATE_COLUMNS):
+    """The user's `columns` and their balance plus `extra`, labelled score."""
+    return select(*columns, balance_column(extra=extra)).where(User.id == user_id)
+
+
+def add_score_statement(
+    user_id: int,
+    *,
+    consume_session: bool = False,
+    require_session: bool = False,
+    values: Optional[dict] = None,
+    where: tuple = (),
+    now: Optional[datetime] = None,
+):
+    """
+    Builds the UPDATE ... RETURNING User.id for what goes with a score change
+    besides the score itself, which only goes to the ledger; None when
+    there is nothing to update.
+
+    consume_session: also use up one game session if any are left.
+    require_session: only apply when a game session is left (and use it up).
+    Both count and persist the sessions recharged up to `now`.
+    values / where: extra SET values and WHERE criteria folded into the statement.
+    """
+    if not (consume_session or require_session or values or where):
+        return None
+    set_values = {}
+    criteria = [User.id == user_id, *where]
+
+    if require_session or consume_session:
+        sessions, timer = recharge_exprs(literal(now or datetime.utcnow(), DateTime))
+        set_values["last_session_recharge"] = timer
+        if require_session:
+            criteria.append(sessions > 0)
+            set_values["game_sessions"] = sessions - 1
+        else:
+            set_values["game_sessions"] = case((sessions > 0, sessions - 1), else_=sessions)
+    if values:
+        set_values.update(values)
+
+    return (
+        update(User)
+        .where(*criteria)
+        .values(**set_values)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def credit_referrer_statement(referral_code: str):
+    """The id and balance of the owner of `referral_code`."""
+    return select(User.id, balance_column()).where(User.referral_code == referral_code)
+
+
+def _recorded(session, row, source: str, delta: int):
+    if row is not None:
+        track_score(session, row.id, row.score)
+        record_score_event(session, row.id, source, delta)
+    return row
+
+
+# Score changes are appended to the ledger and folded into User.score by the
+# compactor, so a change only takes the user's row lock when it also uses a
+# game session or sets `values`. The state row is read after that UPDATE, in
+# a statement of its own: in the UPDATE's RETURNING, PostgreSQL could pair a
+# row the compactor just folded with the events it folded.
+
+def add_score(session: SASession, user_id: int, delta: int, *, source: str, **options):
+    """
+    Records `delta` in the ledger under `source` and applies the rest of the
+    change (see add_score_statement for the options). Returns the user state
+    row after it, or None when no row matched.
+    """
+    statement = add_score_statement(user_id, **options)
+    if statement is not None and session.execute(statement).first() is None:
+        return None
+    row = session.execute(user_state_statement(user_id, queued_delta(session, user_id) + delta)).first()
+    return _recorded(session, row, source, delta)
+
+
+async def add_score_async(session, user_id: int, delta: int, *, source: str, **options):
+    """add_score for an AsyncSession."""
+    statement = add_score_statement(user_id, **options)
+    if statement is not None and (await session.execute(statement)).first() is None:
+        return None
+    row = (await session.execute(user_state_statement(user_id, queued_delta(session, user_id) + delta))).first()
+    return _recorded(session, row, source, delta)
+
+
+def _credited(session, row, bonus: int):
+    if row is None:
+        return None
+    score = row.score + queued_delta(session, row.id) + bonus
+    track_score(session, row.id, score)
+    record_score_event(session, row.id, "referral", bonus)
+    return row.id
+
+
+def credit_referrer(session: SASession, referral_code: str, bonus: int = REFERRAL_BONUS) -> Optional[int]:
+    """
+    Awards the referral bonus to the owner of `referral_code` and adds it to
+    their referral totals, in the caller's transaction. Returns their id.
+    """
+    referrer_id = _credited(session, session.execute(credit_referrer_statement(referral_code)).first(), bonus)
+    if referrer_id is not None:
+        session.execute(referral_credit_statement(session.get_bind().dialect.name, referrer_id, bonus))
+    return referrer_id
+
+
+async def credit_referrer_async(session, referral_code: str, bonus: int = REFERRAL_BONUS) -> Optional[int]:
+    """credit_referrer for an AsyncSession."""
+    row = (await session.execute(credit_referrer_statement(referral_code))).first()
+    referrer_id = _credited(session, row, bonus)
+    if referrer_id is not None:
+        await session.execute(referral_credit_statement(session.get_bind().dialect.name, referrer_id, bonus))
+    return referrer_id
+
+
+def rebuild_score(session: SASession, user_id: int):
+    """
+    Sets a user's score so that their balance is what their whole ledger
+    replays to, for repairing drift found in an audit. Returns the user state
+    row after it, or None for an unknown user.
+    """
+    # The folded part of the ledger must not move while it is summed
+    lock_compaction(session.connection())
+    folded = (
+        select(func.coalesce(func.sum(ScoreEvent.delta), 0))
+        .where(ScoreEvent.user_id == user_id, ScoreEvent.id <= folded_event_id())
+        .scalar_subquery()
+    )
+    statement = (
+        update(User)
+        .where(User.id == user_id)
+        .values(score=folded, tap_level=tap_level_expr(folded))
+        .execution_options(synchronize_session=False)
+    )
+    if session.execute(statement).rowcount == 0:
+        return None
+    row = session.execute(user_state_statement(user_id, queued_delta(session, user_id))).first()
+    track_score(session, row.id, row.score)
+    return row
+
+
+def new_player(user_data: dict, referrer_id: Optional[int], now: datetime) -> User:
+    """Builds the row for a first-time user from their Telegram profile."""
+    return User(
+        id=user_data.get('id'),
+        first_name=user_data.get('first_name'),
+        last_name=user_data.get('last_name'),
+        username=user_data.get('username'),
+        score=0,
+        game_sessions=MAX_SESSIONS,
+        last_session_recharge=now,
+        tap_level=1,
+        referred_by_id=referrer_id
+    )
+
+
+def load_user_state(session, user_id: int):
+    """The user's USER_READ_COLUMNS row and balance, served from user_cache when possible."""
+    row = user_cache.get(user_id)
+    if row is None:
+        stamp = user_cache.stamp()
+        row = session.execute(user_state_statement(user_id, columns=USER_READ_COLUMNS)).first()
+        if row is not None:
+            user_cache.put(user_id, row, stamp)
+    return row
+
+
+async def load_user_state_async(session, user_id: int):
+    """load_user_state for an AsyncSession."""
+    row = user_cache.get(user_id)
+    if row is None:
+        stamp = user_cache.stamp()
+        row = (await session.execute(user_state_statement(user_id, columns=USER_READ_COLUMNS))).first()
+        if row is not None:
+            user_cache.put(user_id, row, stamp)
+    return row
+
+
+def update_profile_statement(user, user_data: dict):
+    """
+    Builds the UPDATE copying a changed Telegram username/first name onto the
+    user; None when nothing changed.
+    """
+    if (user.username == user_data.get('username') and
+            user.first_name == user_data.get('first_name')):
+        return None
+    return (
+        update(User)
+        .where(User.id == user.id)
+        .values(username=user_data.get('username'), first_name=user_data.get('first_name'))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def farming_rewards(user, now: datetime) -> int:
+    """Points farmed since the last claim; farming_rate is per hour."""
+    time_since_last_claim = now - user.last_claim_time
+    return int(time_since_last_claim.total_seconds() * (user.farming_rate / 3600))
+
+
+@event.listens_for(SASession, "after_commit")
+def _publish_scores(session):
+    updates = session.info.pop("score_updates", None)
+    if updates:
+        for user_id, score in updates.items():
+            rank_index.update(user_id, score)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_scores(session):
+    session.info.pop("score_updates", None)
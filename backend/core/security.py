@@ -1,8 +1,100 @@
-
 from fastapi import Header, HTTPException
-from telegram_webapps_authentication import Authenticator, InitialData
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import parse_qsl
+import hashlib
 import os
-from typing import Optional
+import threading
+import time
+
+from .metrics import METRICS_ENABLED, record_auth_time
+
+if TYPE_CHECKING:
+    from telegram_webapps_authentication import Authenticator, InitialData
+
+# Validated initData is cached for at most this many seconds...
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+# ...and never past auth_date + AUTH_MAX_AGE.
+AUTH_MAX_AGE = int(os.getenv("AUTH_MAX_AGE", "86400"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+DEV_USER_DATA = {
+    "user": {
+        "id": 999999,
+        "first_name": "Dev",
+        "last_name": "User",
+        "username": "dev_user",
+        "language_code": "en",
+        "referral_code_used": "dev_referral_code" # Add for testing
+    }
+}
+
+
+class _ValidatedDataCache:
+    """Bounded LRU of validated initData digests with a per-entry expiry."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, data: dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_auth_cache = _ValidatedDataCache(AUTH_CACHE_SIZE)
+_authenticator: Optional["Authenticator"] = None
+_dev_mode: Optional[bool] = None
+
+
+def init_auth():
+    """
+    Reads the auth settings once and builds the long-lived authenticator.
+    Called at startup; get_validated_data falls back to it on first use.
+    """
+    global _authenticator, _dev_mode
+    _dev_mode = os.getenv("DEV_MODE") == "true"
+    bot_token = os.getenv("BOT_TOKEN")
+    _authenticator = None
+    if bot_token:
+        # Only imported when there is something to validate, not in DEV_MODE
+        from telegram_webapps_authentication import Authenticator
+        _authenticator = Authenticator(bot_token)
+    if _dev_mode:
+        print("--- [DEV MODE] Bypassing authentication. Returning mock user data. ---")
+
+
+def auth_cache_stats() -> dict:
+    return {"hits": _auth_cache.hits, "misses": _auth_cache.misses, "size": len(_auth_cache)}
+
+
+def _auth_date(telegram_data: str) -> Optional[int]:
+    for key, value in parse_qsl(telegram_data):
+        if key == "auth_date":
+            return int(value) if value.isdigit() else None
+    return None
 
 
 def get_validated_data(
@@ -10,31 +102,37 @@ def get_validated_data(
 ) -> dict:
     """
     A FastAPI dependency that validates Telegram initData OR returns mock data
-    if DEV_MODE is enabled.
+    if DEV_MODE is enabled. Successfully validated initData is cached, so the
+    signature is only checked once per distinct header.
     """
-    if os.getenv("DEV_MODE") == "true":
-        print("--- [DEV MODE] Bypassing authentication. Returning mock user data. ---")
-        return {
-            "user": {
-                "id": 999999,
-                "first_name": "Dev",
-                "last_name": "User",
-                "username": "dev_user",
-                "language_code": "en",
-                "referral_code_used": "dev_referral_code" # Add for testing
-            }
-        }
+    if not METRICS_ENABLED:
+        return _validate(telegram_data)
+    started = time.perf_counter()
+    try:
+        return _validate(telegram_data)
+    finally:
+        record_auth_time(time.perf_counter() - started)
+
+
+def _validate(telegram_data: Optional[str]) -> dict:
+    if _dev_mode is None:
+        init_auth()
+    if _dev_mode:
+        return DEV_USER_DATA
 
     if not telegram_data:
         raise HTTPException(status_code=401, detail="telegram-data header is missing.")
 
-    bot_token = os.getenv("BOT_TOKEN")
-    if not bot_token:
+    cache_key = hashlib.blake2b(telegram_data.encode(), digest_size=16).digest()
+    cached = _auth_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if _authenticator is None:
         raise HTTPException(status_code=500, detail="BOT_TOKEN not configured.")
 
-    authenticator = Authenticator(bot_token)
     try:
-        validated_object: InitialData = authenticator.get_initial_data(telegram_data)
+        validated_object: "InitialData" = _authenticator.get_initial_data(telegram_data)
 
         # --- NEW AND IMPROVED FIX ---
         # Manually construct the user dictionary for maximum compatibility
@@ -50,9 +148,26 @@ def get_validated_data(
         if hasattr(validated_object, 'start_param') and validated_object.start_param:
             user_dict['referral_code_used'] = validated_object.start_param
 
-        return {"user": user_dict}
+        validated = {"user": user_dict}
         # --- END OF FIX ---
 
     except ValueError as e:
         raise HTTPException(status_code=401, detail=f"Authentication failed: {e}")
 
+    expires_at = time.time() + AUTH_CACHE_TTL
+    auth_date = _auth_date(telegram_data)
+    if auth_date is not None:
+        expires_at = min(expires_at, auth_date + AUTH_MAX_AGE)
+    if expires_at > time.time():
+        _auth_cache.put(cache_key, validated, expires_at)
+    return validated
+
+
+async def get_validated_data_async(
+    telegram_data: Optional[str] = Header(None, alias="telegram-data")
+) -> dict:
+    """
+    get_validated_data for the async routes. Validation is CPU-only and
+    usually a cache hit, so it runs inline instead of hopping to the thread pool.
+    """
+    return get_validated_data(telegram_data)
@@ -0,0 +1,120 @@
+from typing import NamedTuple, Optional
+import os
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+from .models import SyncCursor, User
+from .scoring import add_score, add_score_async
+from .tapbuffer import tap_buffer
+
+SYNC_BATCH_MAX_EVENTS = int(os.getenv("SYNC_BATCH_MAX_EVENTS", "200"))
+
+
+class SyncConflict(Exception):
+    """Another batch for the same user moved the high-water mark first."""
+
+
+class SyncBatchResult(NamedTuple):
+    # User state row after the last applied event, None when nothing was applied
+    row: Optional[object]
+    last_seq: int
+    applied: int
+    rejected: int
+
+
+def _cursor_statement(user_id: int):
+    """The user's id (to tell a missing user apart) and current high-water mark."""
+    return (
+        select(User.id, SyncCursor.last_seq)
+        .outerjoin(SyncCursor, SyncCursor.user_id == User.id)
+        .where(User.id == user_id)
+    )
+
+
+def _fresh_events(events, last_seq: int) -> list:
+    """Events above the high-water mark, in sequence order, one per sequence number."""
+    fresh = []
+    for event in sorted(events, key=lambda event: event.seq):
+        if event.seq > last_seq and (not fresh or event.seq != fresh[-1].seq):
+            fresh.append(event)
+    return fresh
+
+
+def _advance_statement(user_id: int, cursor_seq: Optional[int], new_seq: int):
+    if cursor_seq is None:
+        return insert(SyncCursor).values(user_id=user_id, last_seq=new_seq)
+    # Compare-and-set, so two batches racing for the same user cannot both apply
+    return (
+        update(SyncCursor)
+        .where(SyncCursor.user_id == user_id, SyncCursor.last_seq == cursor_seq)
+        .values(last_seq=new_seq)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _score_options(event) -> dict:
+    # A game needs a session left; taps use one up if there is one, like /sync_score
+    if event.kind == "game":
+        return {"source": "game", "require_session": True}
+    return {"source": "tap", "consume_session": True}
+
+
+def apply_sync_batch(session, user_id: int, events) -> Optional[SyncBatchResult]:
+    """
+    Applies the events (objects with seq, kind and points) whose sequence
+    number is above the user's high-water mark, and moves the mark, inside
+    the caller's transaction. A resent batch is therefore a no-op.
+
+    Returns None when the user does not exist; raises SyncConflict when a
+    concurrent batch got there first, the caller should roll back.
+    """
+    cursor = session.execute(_cursor_statement(user_id)).first()
+    if cursor is None:
+        return None
+    last_seq = cursor.last_seq or 0
+    fresh = _fresh_events(events, last_seq)
+    if not fresh:
+        return SyncBatchResult(None, last_seq, 0, 0)
+
+    try:
+        result = session.execute(_advance_statement(user_id, cursor.last_seq, fresh[-1].seq))
+    except IntegrityError:
+        raise SyncConflict()
+    if result.rowcount == 0:
+        raise SyncConflict()
+
+    tap_buffer.drain(session, user_id)
+    row, applied = None, 0
+    for event in fresh:
+        event_row = add_score(session, user_id, event.points, **_score_options(event))
+        if event_row is not None:
+            row, applied = event_row, applied + 1
+    return SyncBatchResult(row, fresh[-1].seq, applied, len(fresh) - applied)
+
+
+async def apply_sync_batch_async(session, user_id: int, events) -> Optional[SyncBatchResult]:
+    """apply_sync_batch for an AsyncSession."""
+    cursor = (await session.execute(_cursor_statement(user_id))).first()
+    if cursor is None:
+        return None
+    last_seq = cursor.last_seq or 0
+    fresh = _fresh_events(events, last_seq)
+    if not fresh:
+        return SyncBatchResult(None, last_seq, 0, 0)
+
+    try:
+        result = await session.execute(_advance_statement(user_id, cursor.last_seq, fresh[-1].seq))
+    except IntegrityError:
+        raise SyncConflict()
+    if result.rowcount == 0:
+        raise SyncConflict()
+
+    await tap_buffer.drain_async(session, user_id)
+    row, applied = None, 0
+    for event in fresh:
+        event_row = await add_score_async(session, user_id, event.points, **_score_options(event))
+        if event_row is not None:
+            row, applied = event_row, applied + 1
+    return SyncBatchResult(row, fresh[-1].seq, applied, len(fresh) - applied)
@@ -0,0 +1,230 @@
+from typing import Optional
+import os
+import threading
+import time
+
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, case, event, insert, select, update
+from sqlalchemy.orm import Session as SASession
+
+from .database import engine
+from .ledger import balance_column, record_score_event, score_event_rows
+from .models import ScoreEvent, User
+from .ranking import rank_index
+from .scoring import recharge_exprs
+from .usercache import touch_user, user_cache
+
+# Write-behind mode for /sync_score is opt-in.
+TAP_WRITE_BEHIND = os.getenv("TAP_WRITE_BEHIND") == "true"
+# Seconds between background flushes.
+TAP_FLUSH_INTERVAL = float(os.getenv("TAP_FLUSH_INTERVAL", "2"))
+# Flush early once this many users have pending taps.
+TAP_FLUSH_MAX_USERS = int(os.getenv("TAP_FLUSH_MAX_USERS", "500"))
+# Users per query when reading back the flushed scores
+_SCORES_CHUNK = 1000
+
+
+def _build_flush_statement():
+    table = User.__table__
+    syncs = bindparam("b_syncs")
+    sessions, timer = recharge_exprs(bindparam("b_now", type_=DateTime))
+    # Each buffered sync used up one game session if one was left, the same
+    # as the unbuffered sync_score path. The taps themselves go to the ledger.
+    return (
+        update(table)
+        .where(table.c.id == bindparam("b_id"))
+        .values(
+            game_sessions=case((sessions > syncs, sessions - syncs), else_=0),
+            last_session_recharge=timer,
+        )
+    )
+
+
+class TapBuffer:
+    """
+    Accumulates /sync_score deltas per user in memory and writes them to the
+    database in batches, so the write rate no longer follows raw tap traffic.
+
+    Entries being written stay visible through pending() until the flush has
+    committed, so responses never briefly lose buffered taps.
+    """
+
+    def __init__(self, engine, *, enabled: bool = TAP_WRITE_BEHIND,
+                 interval: float = TAP_FLUSH_INTERVAL, max_users: int = TAP_FLUSH_MAX_USERS):
+        self.engine = engine
+        self.enabled = enabled
+        self.interval = interval
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # user_id -> [score delta, number of syncs]
+        self._pending: dict[int, list[int]] = {}
+        self._in_flight: dict[int, list[int]] = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._statement = _build_flush_statement()
+
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.max_depth = 0
+
+    def add(self, user_id: int, delta: int):
+        with self._lock:
+            entry = self._pending.get(user_id)
+            if entry is None:
+                self._pending[user_id] = [delta, 1]
+            else:
+                entry[0] += delta
+                entry[1] += 1
+            depth = len(self._pending)
+            if depth > self.max_depth:
+                self.max_depth = depth
+        if depth >= self.max_users:
+            self._wakeup.set()
+
+    def pending(self, user_id: int) -> tuple[int, int]:
+        """Returns the buffered (score delta, syncs) for a user."""
+        with self._lock:
+            delta = syncs = 0
+            for source in (self._in_flight, self._pending):
+                entry = source.get(user_id)
+                if entry is not None:
+                    delta += entry[0]
+                    syncs += entry[1]
+            return delta, syncs
+
+    def drain(self, session: SASession, user_id: int):
+        """
+        Writes a user's buffered taps inside the caller's transaction, so a
+        following score update sees them. They are put back on rollback.
+        """
+        with self._lock:
+            entry = self._pending.pop(user_id, None)
+        if entry is None:
+            return
+        params = {"b_id": user_id, "b_syncs": entry[1], "b_now": datetime.utcnow()}
+        session.execute(self._statement, [params])
+        session.info.setdefault("drained_taps", []).append((user_id, entry))
+        touch_user(session, user_id)
+        record_score_event(session, user_id, "tap", entry[0])
+
+    async def drain_async(self, session, user_id: int):
+        """drain for an AsyncSession."""
+        with self._lock:
+            entry = self._pending.pop(user_id, None)
+        if entry is None:
+            return
+        params = {"b_id": user_id, "b_syncs": entry[1], "b_now": datetime.utcnow()}
+        await session.execute(self._statement, [params])
+        session.info.setdefault("drained_taps", []).append((user_id, entry))
+        touch_user(session, user_id)
+        record_score_event(session, user_id, "tap", entry[0])
+
+    def _restore(self, entries):
+        with self._lock:
+            for user_id, (delta, syncs) in entries:
+                entry = self._pending.setdefault(user_id, [0, 0])
+                entry[0] += delta
+                entry[1] += syncs
+
+    def flush(self) -> int:
+        """Writes every buffered delta in one executemany batch."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._in_flight = batch
+
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        params = [{"b_id": user_id, "b_syncs": syncs, "b_now": now} for user_id, (_, syncs) in batch.items()]
+        events = score_event_rows({user_id: delta for user_id, (delta, _) in batch.items()}, "tap")
+        user_ids = list(batch)
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self._statement, params)
+                if events:
+                    connection.execute(insert(ScoreEvent), events)
+                # The new balances, for the rank index once they are committed
+                scores = [
+                    row
+                    for start in range(0, len(user_ids), _SCORES_CHUNK)
+                    for row in connection.execute(
+                        select(User.id, balance_column()).where(User.id.in_(user_ids[start:start + _SCORES_CHUNK]))
+                    )
+                ]
+        except Exception as e:
+            self.flush_errors += 1
+            print(f"Tap buffer flush failed, {len(batch)} users kept for retry: {e}")
+            with self._lock:
+                self._in_flight = {}
+            self._restore(batch.items())
+            return 0
+        # Cached rows predate the flush; drop them before the taps leave
+        # _in_flight. This also wakes the users' /live streams.
+        user_cache.invalidate(batch)
+        with self._lock:
+            self._in_flight = {}
+        for user_id, score in scores:
+            rank_index.update(user_id, score)
+
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        return len(batch)
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = len(self._pending)
+        return {
+            "enabled": self.enabled,
+            "depth": depth,
+            "max_depth": self.max_depth,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tap-buffer-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the flusher and writes whatever is still buffered."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+tap_buffer = TapBuffer(engine)
+
+
+@event.listens_for(SASession, "after_commit")
+def _forget_drained_taps(session):
+    session.info.pop("drained_taps", None)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _restore_drained_taps(session):
+    drained = session.info.pop("drained_taps", None)
+    if drained:
+        tap_buffer._restore(drained)
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from typing import Optional
+import os
+import threading
+
+import orjson
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import select
+
+from .cachebus import RESET, cache_bus
+from .models import Task, UserTask
+
+# Users whose completed tasks are kept in memory, least recently used first out.
+TASK_COMPLETION_CACHE_SIZE = int(os.getenv("TASK_COMPLETION_CACHE_SIZE", "50000"))
+
+TASK_FIELDS = ("id", "name", "description", "points", "link", "icon")
+
+
+class _Catalog:
+    """One immutable version of the task list, with each task pre-serialised."""
+    __slots__ = ("version", "tasks", "index", "payloads")
+
+    def __init__(self, version: int, tasks: list):
+        self.version = version
+        self.tasks = tasks
+        # task id -> bit position in the completion bitsets
+        self.index = {task.id: bit for bit, task in enumerate(tasks)}
+        # Everything of the TaskResponse JSON but the trailing "completed" value
+        self.payloads = [
+            orjson.dumps({field: getattr(task, field) for field in TASK_FIELDS})[:-1] + b',"completed":'
+            for task in tasks
+        ]
+
+    def bits(self, task_ids) -> int:
+        bits = 0
+        for task_id in task_ids:
+            bit = self.index.get(task_id)
+            if bit is not None:
+                bits |= 1 << bit
+        return bits
+
+    def render(self, bits: int) -> bytes:
+        """The /tasks JSON body for a user with completion bitset `bits`."""
+        return b"[" + b",".join(
+            payload + (b"true}" if bits >> bit & 1 else b"false}")
+            for bit, payload in enumerate(self.payloads)
+        ) + b"]"
+
+
+class TaskCatalog:
+    """
+    In-process cache of the task list and of which tasks each user completed.
+
+    The catalog only changes through the admin task routes, which call
+    invalidate(); that bumps the version, and completion bitsets built against
+    an older version are rebuilt on next use since bit positions may move.
+
+    As in UserStateCache, a bitset read from the database is only stored if
+    its user completed no task after stamp() was taken, so a read racing a
+    completion cannot cache the bitset from before it.
+    """
+
+    def __init__(self, max_users: int = TASK_COMPLETION_CACHE_SIZE):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._version = 0
+        self._catalog: Optional[_Catalog] = None
+        # user_id -> (catalog version, bitset)
+        self._completions: OrderedDict[int, tuple[int, int]] = OrderedDict()
+        # user_id -> change counter of their latest completion, for rejecting racing stores
+        self._changed: OrderedDict[int, int] = OrderedDict()
+        self._counter = 0
+        # Highest counter dropped from _changed
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, broadcast: bool = True):
+        with self._lock:
+            self._version += 1
+            self._catalog = None
+            self._completions.clear()
+        if broadcast:
+            cache_bus.publish("tasks")
+
+    def stamp(self) -> int:
+        return self._counter
+
+    def _record_change(self, user_id: int):
+        """Marks the user as changed now; the caller holds the lock."""
+        self._counter += 1
+        self._changed[user_id] = self._counter
+        self._changed.move_to_end(user_id)
+        while len(self._changed) > self.max_users:
+            _, counter = self._changed.popitem(last=False)
+            self._floor = max(self._floor, counter)
+
+    def _install(self, version: int, tasks: list) -> _Catalog:
+        catalog = _Catalog(version, tasks)
+        with self._lock:
+            # An invalidation during the load means `tasks` may already be stale
+            if version == self._version:
+                self._catalog = catalog
+        return catalog
+
+    def _cached_bits(self, catalog: _Catalog, user_id: int) -> Optional[int]:
+        with self._lock:
+            entry = self._completions.get(user_id)
+            if entry is not None and entry[0] == catalog.version:
+                self._completions.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def _store_bits(self, catalog: _Catalog, user_id: int, bits: int, stamp: int):
+        with self._lock:
+            if catalog.version != self._version:
+                return
+            if max(self._changed.get(user_id, 0), self._floor) > stamp:
+                return
+            self._completions[user_id] = (catalog.version, bits)
+            self._completions.move_to_end(user_id)
+            while len(self._completions) > self.max_users:
+                self._completions.popitem(last=False)
+
+    def catalog(self, session) -> _Catalog:
+        catalog, version = self._catalog, self._version
+        if catalog is None:
+            catalog = self._install(version, list(session.exec(select(Task).order_by(Task.id))))
+        return catalog
+
+    async def catalog_async(self, session) -> _Catalog:
+        catalog, version = self._catalog, self._version
+        if catalog is None:
+            catalog = self._install(version, list(await session.exec(select(Task).order_by(Task.id))))
+        return catalog
+
+    def render(self, session, user_id: int) -> bytes:
+        """The /tasks response body for `user_id`, as pre-encoded JSON."""
+        stamp = self.stamp()
+        catalog = self.catalog(session)
+        bits = self._cached_bits(catalog, user_id)
+        if bits is None:
+            bits = catalog.bits(session.exec(select(UserTask.task_id).where(UserTask.user_id == user_id)))
+            self._store_bits(catalog, user_id, bits, stamp)
+        return catalog.render(bits)
+
+    async def render_async(self, session, user_id: int) -> bytes:
+        stamp = self.stamp()
+        catalog = await self.catalog_async(session)
+        bits = self._cached_bits(catalog, user_id)
+        if bits is None:
+            bits = catalog.bits(await session.exec(select(UserTask.task_id).where(UserTask.user_id == user_id)))
+            self._store_bits(catalog, user_id, bits, stamp)
+        return catalog.render(bits)
+
+    def mark_completed(self, user_id: int, task_id: int):
+        """Sets the task's bit in a cached bitset; users not in the cache load on next use."""
+        with self._lock:
+            self._record_change(user_id)
+            entry = self._completions.get(user_id)
+            catalog = self._catalog
+            if entry is None or catalog is None or entry[0] != catalog.version:
+                return
+            bit = catalog.index.get(task_id)
+            if bit is not None:
+                self._completions[user_id] = (entry[0], entry[1] | 1 << bit)
+
+    def forget(self, user_ids):
+        """Drops the users' cached bitsets; they are reloaded on next use."""
+        with self._lock:
+            for user_id in user_ids:
+                self._record_change(user_id)
+                self._completions.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {"version": self._version, "users": len(self._completions),
+                "hits": self.hits, "misses": self.misses}
+
+
+task_catalog = TaskCatalog()
+cache_bus.on("tasks", lambda _: task_catalog.invalidate(broadcast=False))
+cache_bus.on(RESET, lambda _: task_catalog.invalidate(broadcast=False))
+# Another worker's completion only clears the cached bitset here: the bit
+# positions may differ if that worker's catalog is of another version.
+cache_bus.on("completions", lambda user_ids: task_catalog.forget(user_ids))
+
+
+def track_completion(session, user_id: int, task_id: int):
+    """Marks the task completed in the catalog cache once `session` commits."""
+    session.info.setdefault("completed_tasks", []).append((user_id, task_id))
+
+
+@event.listens_for(SASession, "after_commit")
+def _publish_completions(session):
+    completed = session.info.pop("completed_tasks", ())
+    for user_id, task_id in completed:
+        task_catalog.mark_completed(user_id, task_id)
+    if completed:
+        cache_bus.publish("completions", [user_id for user_id, _ in completed])
+
+
+@event.listens_for(SASession, "after_rollback")
+def _discard_completions(session):
+    session.info.pop("completed_tasks", None)
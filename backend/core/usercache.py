@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+
+from .cachebus import RESET, cache_bus
+from .models import User
+
+# Seconds a user's state row is served from memory; 0 turns the cache off.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+
+
+class UserStateCache:
+    """
+    Short-lived LRU of per-user state rows for the read paths.
+
+    Committed writes invalidate their users. A row read from the database is
+    only stored if its user was not invalidated after stamp() was taken, so a
+    read racing a commit cannot put the pre-commit row back.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, object]] = OrderedDict()
+        # user_id -> invalidation counter, for rejecting racing put()s
+        self._invalidated: OrderedDict[int, int] = OrderedDict()
+        self._counter = 0
+        # Highest counter dropped from _invalidated
+        self._floor = 0
+        self._listeners: list[Callable[[list[int]], None]] = []
+        self.hits = 0
+        self.misses = 0
+
+    def stamp(self) -> int:
+        return self._counter
+
+    def get(self, user_id: int):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id: int, row, stamp: int):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if max(self._invalidated.get(user_id, 0), self._floor) > stamp:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def subscribe(self, listener: Callable[[list[int]], None]):
+        """Calls `listener` with the user ids of every invalidation."""
+        self._listeners.append(listener)
+
+    def invalidate(self, user_ids: Iterable[int], broadcast: bool = True):
+        """Drops the users' rows here and, with `broadcast`, in the other workers."""
+        user_ids = list(user_ids)
+        with self._lock:
+            for user_id in user_ids:
+                self._counter += 1
+                self._entries.pop(user_id, None)
+                self._invalidated[user_id] = self._counter
+                self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_size:
+                _, counter = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, counter)
+        if broadcast:
+            cache_bus.publish("users", user_ids)
+        for listener in self._listeners:
+            listener(user_ids)
+
+    def clear(self):
+        """Drops every row, and rejects put()s of rows read before now."""
+        with self._lock:
+            self._counter += 1
+            self._floor = self._counter
+            self._entries.clear()
+            self._invalidated.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserStateCache()
+cache_bus.on("users", lambda user_ids: user_cache.invalidate(user_ids, broadcast=False))
+cache_bus.on(RESET, lambda _: user_cache.clear())
+
+
+def touch_user(session, user_id: Optional[int]):
+    """Drops the user's cached state once `session` commits."""
+    if user_id is not None:
+        session.info.setdefault("touched_users", set()).add(user_id)
+
+
+@event.listens_for(SASession, "after_flush")
+def _touch_flushed_users(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            touch_user(session, obj.id)
+
+
+@event.listens_for(SASession, "after_commit")
+def _invalidate_touched_users(session):
+    touched = session.info.pop("touched_users", None)
+    if touched:
+        user_cache.invalidate(touched)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _forget_touched_users(session):
+    session.info.pop("touched_users", None)
@@ -0,0 +1,33 @@
+from fastapi import Depends
+
+from .core import enforce_rate_limit, get_validated_data_async
+from .schemas import GameResult, SyncBatchRequest, SyncRequest
+
+# Rate-limited stand-ins for get_validated_data on the score-writing endpoints.
+# They share the endpoint's body model, so the points being claimed are known,
+# and must be declared before the session so a throttled request never opens one.
+
+
+async def throttle_sync_score(
+    sync_request: SyncRequest,
+    validated_data: dict = Depends(get_validated_data_async)
+) -> dict:
+    enforce_rate_limit(validated_data.get('user', {}).get('id'), sync_request.taps)
+    return validated_data
+
+
+async def throttle_game_score(
+    result: GameResult,
+    validated_data: dict = Depends(get_validated_data_async)
+) -> dict:
+    enforce_rate_limit(validated_data.get('user', {}).get('id'), result.points_earned)
+    return validated_data
+
+
+async def throttle_sync_batch(
+    batch: SyncBatchRequest,
+    validated_data: dict = Depends(get_validated_data_async)
+) -> dict:
+    points = sum(max(event.points, 0) for event in batch.events)
+    enforce_rate_limit(validated_data.get('user', {}).get('id'), points)
+    return validated_data
@@ -1,87 +1,116 @@
 # backend/main.py
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import FileResponse
-from sqlmodel import Session, select, text
-import os
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlmodel import Session
+from sqlalchemy.exc import IntegrityError
+from starlette.routing import Match
 
-from pathlib import Path 
 from dotenv import load_dotenv
-from fastapi.responses import HTMLResponse
 from typing import Optional
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-# Core application imports
+from datetime import datetime
+import threading
 
-from .core import * 
-from .admin import *
+# The core modules read their settings (DATABASE_URL, DB_*, ...) at import
+# time, so the .env file has to be loaded before they are imported.
+load_dotenv()
 
-BACKEND_DIR = Path(__file__).parent 
-# This will be the absolute path to your project's root folder
-BASE_DIR = BACKEND_DIR.parent 
-# This is the absolute path to your 'frontend' folder
-FRONTEND_DIR = BASE_DIR / "frontend"
+# Core application imports
 
-load_dotenv()
-app = FastAPI(title="Unique Sale Airdrop")
+from .core import (
+    ASYNC_DB, FRIENDS_MAX_PAGE_SIZE, FRIENDS_PAGE_SIZE, LedgerCompactor, LiveFeedFull, METRICS_ENABLED,
+    MetricsMiddleware, REFERRAL_BONUS, RankReconciler, SLOW_REQUEST_MS, SYNC_BATCH_MAX_EVENTS,
+    SlowRequestMiddleware, SyncConflict, Task, User, UserStreamLimit, UserTask, add_score, apply_sync_batch,
+    cache_bus, create_db_and_tables, credit_referrer, engine, farming_rewards, friends_page_statement,
+    get_frontend_assets, get_session, get_validated_data, get_validated_data_async, init_auth,
+    leaderboard_snapshot, live_hub, load_rank_index, load_user_row, load_user_state, new_player, rank_index,
+    readiness, referral_totals_statement, tap_buffer, task_catalog, touch_user, trace_sync_endpoints,
+    track_completion, track_score, update_profile_statement, warm_async_pool, warm_pool,
+)
+from .admin import router
+from .schemas import (
+    FriendsPageResponse, GameResult, LeaderboardResponse, SyncBatchRequest, SyncBatchResponse, SyncRequest,
+    TaskResponse, UserDataResponse, WalletSaveRequest, friends_page_response, live_state_event,
+    sync_batch_response, task_response, user_state, user_state_response,
+)
+from .dependencies import throttle_game_score, throttle_sync_batch, throttle_sync_score
+
+# Endpoints that return plain data are encoded with orjson
+app = FastAPI(title="Unique Sale Airdrop", default_response_class=ORJSONResponse)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if SLOW_REQUEST_MS:
+    app.add_middleware(SlowRequestMiddleware)
 
 app.include_router(router, prefix="/admin", tags=["Admin"])
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
-    with Session(engine) as session: # Make sure you have 'engine' defined from create_db_and_tables
-
-        if not session.exec(select(Task)).first():
-            print("No tasks found, creating default tasks...")
-            default_tasks = [
-                Task(name="Follow on X", description="Follow our official X account", points=5000, link="https://x.com/uniquesale_fin", icon="twitter" ),
-                Task(name="Join Telegram", description="Join our community Telegram channel", points=5000, link="https://t.me/uniquesalefinance", icon="telegram" ),
-                Task(name="Subscribe to YouTube", description="Subscribe to our YouTube channel", points=3000, link="https://youtube.com/your_channel", icon="youtube" ),
-            ]
-            for task in default_tasks:
-                session.add(task)
-            session.commit()
-            print("Default tasks created.")
+# The player endpoints below exist in a sync and an async flavour
+# (backend/async_routes.py); ASYNC_DB picks which one is mounted.
+player_router = APIRouter()
 
+rank_reconciler = RankReconciler(engine)
+ledger_compactor = LedgerCompactor(engine)
 
-class UserDataResponse(BaseModel):
-    score: int
-    walletAddress: Optional[str]
-    game_sessions: int
-    max_sessions: int
-    tap_level: int
-    username: Optional[str] # Add this
-    claimable_rewards: int = 0 # Add this
-    referral_code: str
 
-class SyncRequest(BaseModel):
-    taps: int
+def load_rankings():
+    try:
+        load_rank_index(engine)
+    except Exception as e:
+        # The reconciler loads it on its next run
+        print(f"Rank index load failed: {e}")
+        return
+    leaderboard_snapshot.refresh()
 
 
+@app.on_event("startup")
+def on_startup():
+    init_auth()
+    # Schema changes and the default tasks are migrations: applied once, by
+    # whichever worker takes the migration lock first
+    create_db_and_tables()
+    cache_bus.start()
+    get_frontend_assets()
+    # Reading every user's balance takes a while on a big table, and each
+    # worker does it; the worker stays unready on /readyz until it is done
+    readiness.wait_for("rank index", lambda: rank_index.loaded)
+    threading.Thread(target=load_rankings, name="rank-index-load", daemon=True).start()
+    leaderboard_snapshot.start()
+    rank_reconciler.start()
+    ledger_compactor.start()
+    tap_buffer.start()
+
+
+@app.on_event("startup")
+async def warm_up():
+    warmed = warm_pool(engine)
+    if ASYNC_DB:
+        warmed += await warm_async_pool()
+    readiness.mark_ready(warmed)
 
-class GameResult(BaseModel):
-    points_earned: int
 
+@app.on_event("shutdown")
+def on_shutdown():
+    readiness.mark_draining()
+    live_hub.close_all()
+    tap_buffer.stop()
+    ledger_compactor.stop()
+    leaderboard_snapshot.stop()
+    rank_reconciler.stop()
+    cache_bus.stop()
 
-def get_tap_level(score: int) -> int:
-    """Calculates the user's tap level based on their score."""
-    if score >= 5000:
-        return 10
-    if score >= 1000:
-        return 5
-    if score >= 300:
-        return 3
-    if score >= 100:
-        return 2
-    return 1
 
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process answers; says nothing about the database."""
+    return {"status": "ok"}
 
-@app.get("/")
-async def read_root():
-    html_file_path = os.path.join(os.path.dirname(__file__), "..", "frontend", "index.html")
-    return FileResponse(html_file_path)
 
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """Readiness: startup is done, the pool is warm and the database answers."""
+    ready, report = readiness.report(engine)
+    return ORJSONResponse(report, status_code=200 if ready else 503)
 
 
 @app.post("/claim_rewards", response_model=UserDataResponse)
@@ -99,27 +128,20 @@ def claim_rewards(
     claimable_rewards = int(time_since_last_claim.total_seconds() * (db_user.farming_rate / 3600))
 
     if claimable_rewards > 0:
-        db_user.score += claimable_rewards
-        db_user.last_claim_time = datetime.utcnow() # Reset the claim timer
-        session.add(db_user)
+        # Only the request that still sees the old claim timer gets to claim,
+        # so a double-tapped button cannot pay out twice.
+        tap_buffer.drain(session, user_id)
+        row = add_score(
+            session, user_id, claimable_rewards, source="farming",
+            values={"last_claim_time": datetime.utcnow()},
+            where=(User.last_claim_time == db_user.last_claim_time,),
+        )
         session.commit()
-        session.refresh(db_user)
-
-    # Return the full, updated user state
-    return UserDataResponse(
-        score=db_user.score,
-        walletAddress=db_user.wallet_address,
-        game_sessions=db_user.game_sessions,
-        max_sessions=MAX_SESSIONS,
-        tap_level=get_tap_level(db_user.score),
-        username=db_user.username,
-        claimable_rewards=0,
-        referral_code=db_user.referral_code
-    )
-
+        if row is not None:
+            return user_state_response(row)
 
-class WalletSaveRequest(BaseModel):
-    wallet_address: str
+    # Return the full, updated user state; the User row lacks the unfolded ledger tail
+    return user_state_response(load_user_state(session, user_id))
 
 
 @app.post("/save_wallet", response_model=UserDataResponse)
@@ -139,20 +161,8 @@ def save_wallet(
     user.wallet_address = request.wallet_address
     session.add(user)
     session.commit()
-    session.refresh(user)
 
-    # --- THIS IS THE FIX ---
-    # The variable name has been corrected from 'db_user' to 'user'
-    return UserDataResponse(
-        score=user.score,
-        walletAddress=user.wallet_address,
-        game_sessions=user.game_sessions,
-        max_sessions=MAX_SESSIONS,
-        tap_level=get_tap_level(user.score),
-        username=user.username,
-        claimable_rewards=0, # Claimable rewards don't change here, so return 0 or recalculate if needed
-        referral_code=user.referral_code # Corrected from db_user.referral_code
-    )
+    return user_state_response(load_user_state(session, user_id))
 
 
 
@@ -160,47 +170,34 @@ def save_wallet(
 def submit_game_score(
     result: GameResult,
     *,
-    session: Session = Depends(get_session),
-    validated_data: dict = Depends(get_validated_data)
+    validated_data: dict = Depends(throttle_game_score),
+    session: Session = Depends(get_session)
 ):
     user_id = validated_data.get('user', {}).get('id')
-    db_user = session.get(User, user_id)
-
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found.")
-    
 
-    if db_user.game_sessions <= 0:
+    # The session check and decrement happen in one statement; the score goes to the ledger.
+    tap_buffer.drain(session, user_id)
+    row = add_score(session, user_id, result.points_earned, source="game", require_session=True)
+    if row is None:
+        # Puts the drained taps back in the buffer
+        session.rollback()
+        if not session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found.")
         raise HTTPException(status_code=403, detail="No game sessions left.")
-
-    db_user.game_sessions -= 1
-    db_user.score += result.points_earned
-
-    if db_user.score >= 5000:
-        db_user.tap_level = 10
-    elif db_user.score >= 1000:
-        db_user.tap_level = 5
-    elif db_user.score >= 300:
-        db_user.tap_level = 3
-    elif db_user.score >= 100:
-        db_user.tap_level = 2
-    
-    session.add(db_user)
     session.commit()
-    session.refresh(db_user)
 
-    return {"status": "success", "new_score": db_user.score, "sessions_left": db_user.game_sessions}
+    return {"status": "success", "new_score": row.score, "sessions_left": row.game_sessions}
 
 
-# In backend/main.py, replace the whole function
-
-@app.get("/get_user_data", response_model=UserDataResponse)
+@player_router.get("/get_user_data", response_model=UserDataResponse)
 def get_user_data(validated_data: dict = Depends(get_validated_data), session: Session = Depends(get_session)):
     user_data = validated_data.get('user', {})
     user_id = user_data.get('id')
-    
-    # Use 'db_user' consistently
-    db_user = session.get(User, user_id)
+    now = datetime.utcnow()
+
+    # App opens are reads: recharged sessions and farming rewards are derived
+    # from the stored timestamps, and the row itself usually comes from user_cache.
+    db_user = load_user_state(session, user_id)
 
     if not db_user:
         # This is a new user
@@ -210,206 +207,129 @@ def get_user_data(validated_data: dict = Depends(get_validated_data), session: S
         referrer_id = None
         referral_code_used = user_data.get('referral_code_used')
         if referral_code_used:
-            referrer = session.exec(select(User).where(User.referral_code == referral_code_used)).first()
-            if referrer:
-                referrer_id = referrer.id
-                # Award bonus to the referrer
-                referrer.score += 10000 # Example: 10,000 point bonus
-                session.add(referrer)
-                print(f"Awarded 10,000 points to referrer {referrer_id}")
-        db_user = User(
-            id=user_id,
-            first_name=user_data.get('first_name'),
-            last_name=user_data.get('last_name'),
-            username=user_data.get('username'),
-            score=0,
-            game_sessions=MAX_SESSIONS,
-            last_session_recharge=datetime.utcnow(),
-            tap_level=1,
-            referred_by_id=referrer_id
-        )
+            # Finds the referrer and records the bonus in the score ledger
+            referrer_id = credit_referrer(session, referral_code_used)
+            if referrer_id:
+                print(f"Awarded {REFERRAL_BONUS:,} points to referrer {referrer_id}")
+        db_user = new_player(user_data, referrer_id, now)
         # 1. Add the new user to the session FIRST
-    session.add(db_user)
-    # 2. THEN commit the transaction
-    session.commit()
-    # 3. NOW it's safe to refresh the object
-    session.refresh(db_user)
+        session.add(db_user)
+        track_score(session, user_id, 0)
+        # 2. THEN commit the transaction
+        session.commit()
+        # 3. NOW it's safe to refresh the object
+        session.refresh(db_user)
     else:
+        # Only a changed Telegram profile is written
+        statement = update_profile_statement(db_user, user_data)
+        if statement is not None:
+            session.execute(statement)
+            touch_user(session, user_id)
+            session.commit()
+            db_user = load_user_state(session, user_id)
 
-        if (db_user.username != user_data.get('username') or 
-            db_user.first_name != user_data.get('first_name')):
-            db_user.username = user_data.get('username')
-            db_user.first_name = user_data.get('first_name')
-            session.add(db_user)
-
-        # Recharge game sessions based on time passed
-        time_passed = datetime.utcnow() - db_user.last_session_recharge
-        # Assuming 1 session recharges every 10 minutes (600 seconds)
-        sessions_to_add = int(time_passed.total_seconds() / 600) 
-        if sessions_to_add > 0:
-            db_user.game_sessions = min(db_user.game_sessions + sessions_to_add, MAX_SESSIONS)
-            # Reset the recharge timer
-            db_user.last_session_recharge = datetime.utcnow()
-            session.add(db_user)
-    time_since_last_claim = datetime.utcnow() - db_user.last_claim_time
-    # Calculate rewards earned in seconds, then convert to a whole number
-    # User's farming_rate is per hour, so we divide by 3600 to get per-second rate
-    claimable_rewards = int(time_since_last_claim.total_seconds() * (db_user.farming_rate / 3600))
-
-
-    session.commit()
-    session.refresh(db_user)
-
-    # --- THIS IS THE FIX ---
-    # Use the correct 'db_user' variable here
-    return UserDataResponse(
-        score=db_user.score,
-        walletAddress=db_user.wallet_address,
-        game_sessions=db_user.game_sessions,
-        max_sessions=MAX_SESSIONS,
-        tap_level=get_tap_level(db_user.score), # Use the helper function
-        username=db_user.username,
-        claimable_rewards= claimable_rewards,
-        referral_code=db_user.referral_code
-    )
+    return user_state_response(db_user, claimable_rewards=farming_rewards(db_user, now), now=now)
 
  
-@app.post("/sync_score", response_model=UserDataResponse)
+@player_router.post("/sync_score", response_model=UserDataResponse)
 def sync_score(
     sync_request: SyncRequest,
     *,
-    session: Session = Depends(get_session),
-    validated_data: dict = Depends(get_validated_data)
+    validated_data: dict = Depends(throttle_sync_score),
+    session: Session = Depends(get_session)
 ):
     user_data = validated_data.get('user', {})
     user_id = user_data.get('id')
-    db_user = session.get(User, user_id)
 
-    if not db_user:
+    if tap_buffer.enabled:
+        # Write-behind: buffer the delta and answer from the buffered state
+        row = load_user_state(session, user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="User not found during sync")
+        tap_buffer.add(user_id, sync_request.taps)
+        return ORJSONResponse(user_state(row))
+
+    # Score, tap level and the session decrement are applied atomically, so
+    # concurrent syncs from the same user never overwrite each other.
+    row = add_score(session, user_id, sync_request.taps, source="tap", consume_session=True)
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found during sync")
-
-    if db_user.game_sessions > 0:
-        db_user.game_sessions -= 1
-
-    db_user.score += sync_request.taps
-
-    if db_user.score >= 5000:
-        db_user.tap_level = 10
-    elif db_user.score >= 1000:
-        db_user.tap_level = 5
-    elif db_user.score >= 300:
-        db_user.tap_level = 3
-    elif db_user.score >= 100:
-        db_user.tap_level = 2
-    else:
-        db_user.tap_level = 1
-    
-    session.add(db_user)
     session.commit()
-    session.refresh(db_user)
-
-    return UserDataResponse(
-        score=db_user.score,
-        walletAddress=db_user.wallet_address,
-        game_sessions=db_user.game_sessions,
-        max_sessions=MAX_SESSIONS,
-        tap_level=get_tap_level(db_user.score), # Use the helper function for consistency
-        username=db_user.username,
-        claimable_rewards=0 ,
-        referral_code=db_user.referral_code
-    )
 
+    return user_state_response(row)
 
 
+@player_router.post("/sync_batch", response_model=SyncBatchResponse)
+def sync_batch(
+    batch: SyncBatchRequest,
+    *,
+    validated_data: dict = Depends(throttle_sync_batch),
+    session: Session = Depends(get_session)
+):
+    user_id = validated_data.get('user', {}).get('id')
+    if len(batch.events) > SYNC_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_BATCH_MAX_EVENTS} events per batch")
 
-# In backend/main.py, add these Pydantic models at the top with the others
-
-class LeaderboardUser(BaseModel):
-    rank: int
-    username: Optional[str]
-    score: int
-
-class LeaderboardResponse(BaseModel):
-    top_users: list[LeaderboardUser]
-    current_user_rank: Optional[int]
+    # Events the server already applied are skipped, so clients can resend freely
+    try:
+        result = apply_sync_batch(session, user_id, batch.events)
+    except SyncConflict:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Another sync for this user is in progress, retry")
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found during sync")
+    session.commit()
 
+    row = result.row or load_user_state(session, user_id)
+    return sync_batch_response(row, result)
 
-# Now, find the @app.get("/leaderboard") endpoint and REPLACE it entirely with this new version:
 
-@app.get("/leaderboard", response_model=LeaderboardResponse)
+@player_router.get("/leaderboard", response_model=LeaderboardResponse)
 def get_leaderboard(
     *,
-    session: Session = Depends(get_session),
+    if_none_match: Optional[str] = Header(None),
     validated_data: dict = Depends(get_validated_data)
 ):
     user_id = validated_data.get('user', {}).get('id')
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid user data")
 
-    # Get top 10 users
-    top_users_statement = select(User).order_by(User.score.desc()).limit(10)
-    top_users_result = session.exec(top_users_statement).all()
-
-    top_users_list = [
-        LeaderboardUser(rank=i + 1, username=user.username or user.first_name, score=user.score)
-        for i, user in enumerate(top_users_result)
-    ]
-
-    # Get current user's rank
-    user_rank = None
-    try:
-        # Use a window function to get the rank of all users
-        rank_query = text(
-            "SELECT rank FROM (SELECT id, RANK() OVER (ORDER BY score DESC) as rank FROM user) as ranked_users WHERE id = :user_id"
-        )
-        user_rank_row = session.exec(rank_query, params={"user_id": user_id}).first()
-        if user_rank_row:
-            user_rank = user_rank_row[0]
-    except Exception as e:
-        print(f"Could not retrieve user rank: {e}")
-        # This is not critical, so we can fail gracefully
-        user_rank = None
+    # The top of the board is a shared, pre-encoded snapshot and the caller's
+    # rank comes from the in-memory rank index, so no database access here.
+    return leaderboard_snapshot.response(rank_index.rank(user_id), if_none_match)
 
-    return LeaderboardResponse(top_users=top_users_list, current_user_rank=user_rank)
 
 
+@app.get("/live")
+async def live_feed(validated_data: dict = Depends(get_validated_data_async)):
+    """
+    Server-sent events with the caller's state, rank and the top of the
+    leaderboard, pushed as they change instead of being polled.
+    """
+    user_id = validated_data['user']['id']
+    row = await run_in_threadpool(load_user_row, user_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        subscriber = live_hub.subscribe(user_id)
+    except LiveFeedFull:
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={"Retry-After": "30"})
+    except UserStreamLimit:
+        raise HTTPException(status_code=429, detail="Too many live connections for this user")
 
-# In backend/main.py, add these new Pydantic and API endpoints
+    return live_hub.response(subscriber, row, live_state_event)
 
-class TaskResponse(BaseModel):
-    id: int
-    name: str
-    description: str
-    points: int
-    link: str
-    icon: str
-    completed: bool
 
-@app.get("/tasks", response_model=list[TaskResponse])
+@player_router.get("/tasks", response_model=list[TaskResponse])
 def get_tasks(
     validated_data: dict = Depends(get_validated_data),
     session: Session = Depends(get_session)
 ):
     user_id = validated_data['user']['id']
-    all_tasks = session.exec(select(Task)).all()
-    completed_tasks_statement = select(UserTask).where(UserTask.user_id == user_id)
-    completed_tasks = session.exec(completed_tasks_statement).all()
-    completed_task_ids = {ut.task_id for ut in completed_tasks}
-
-    response = []
-    for task in all_tasks:
-        response.append(TaskResponse(
-            id=task.id,
-            name=task.name,
-            description=task.description,
-            points=task.points,
-            link=task.link,
-            icon=task.icon,
-            completed=(task.id in completed_task_ids)
-        ))
-    return response
+    # The catalog and the user's completed tasks come from the in-process cache
+    return Response(task_catalog.render(session, user_id), media_type="application/json")
 
-@app.post("/claim_task/{task_id}", response_model=TaskResponse)
+@player_router.post("/claim_task/{task_id}", response_model=TaskResponse)
 def claim_task(
     task_id: int,
     validated_data: dict = Depends(get_validated_data),
@@ -422,60 +342,85 @@ def claim_task(
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    # Check if user has already completed this task
-    existing_completion = session.get(UserTask, (user_id, task_id))
-    if existing_completion:
-        raise HTTPException(status_code=400, detail="Task already completed")
-
-    # Mark task as completed
-    user_task = UserTask(user_id=user_id, task_id=task_id)
-    session.add(user_task)
+    # Mark task as completed; the composite primary key rejects a second claim
+    session.add(UserTask(user_id=user_id, task_id=task_id))
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        if session.get(UserTask, (user_id, task_id)):
+            raise HTTPException(status_code=400, detail="Task already completed")
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # Award points to the user
-    user = session.get(User, user_id)
-    user.score += task.points
-    session.add(user)
-    
+    # Award points to the user in the same transaction
+    tap_buffer.drain(session, user_id)
+    if add_score(session, user_id, task.points, source="task") is None:
+        session.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    response = task_response(task, completed=True)
+    track_completion(session, user_id, task_id)
     session.commit()
-    session.refresh(user)
-
-    return TaskResponse(
-        id=task.id,
-        name=task.name,
-        description=task.description,
-        points=task.points,
-        link=task.link,
-        icon=task.icon,
-        completed=True
-    )
 
-# In backend/main.py
+    return response
 
-class FriendResponse(BaseModel):
-    username: Optional[str]
-    score: int
+# In backend/main.py
 
-@app.get("/friends", response_model=list[FriendResponse])
+@player_router.get("/friends", response_model=FriendsPageResponse)
 def get_friends(
+    cursor: Optional[int] = None,
+    limit: int = FRIENDS_PAGE_SIZE,
     validated_data: dict = Depends(get_validated_data),
     session: Session = Depends(get_session)
 ):
     user_id = validated_data['user']['id']
-    
-    # Find all users who have the current user's ID as their 'referred_by_id'
-    friends_statement = select(User).where(User.referred_by_id == user_id)
-    friends = session.exec(friends_statement).all()
-    
-    return [FriendResponse(username=f.username or f.first_name, score=f.score) for f in friends]
+    limit = max(1, min(limit, FRIENDS_MAX_PAGE_SIZE))
+
+    # One page of the users referred by this user, plus their kept-up totals
+    rows = session.execute(friends_page_statement(user_id, cursor, limit)).all()
+    totals = session.execute(referral_totals_statement(user_id)).first()
+    return friends_page_response(rows, limit, totals)
+
 
 
+if ASYNC_DB:
+    # Imported only when used, it pulls in SQLAlchemy's asyncio extension
+    from .async_routes import router as async_player_router
+    app.include_router(async_player_router)
+else:
+    app.include_router(player_router)
+
+
+# The frontend, fingerprinted and precompressed by backend/core/assets.py.
+# Registered last so it never shadows an API route.
+@app.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def frontend(
+    path: str,
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    response = get_frontend_assets().response("/" + path, accept_encoding, if_none_match)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
+
 
-@app.get("/")
-async def read_index():
+# Other methods would otherwise get a 405 from the route above for any path
+@app.api_route("/{path:path}", methods=["POST", "PUT", "PATCH", "DELETE", "OPTIONS"], include_in_schema=False)
+async def not_found(request: Request):
+    # Unless the path is an API route that takes other methods
+    allowed = {
+        method
+        for route in app.routes
+        if getattr(route, "endpoint", None) not in (frontend, not_found)
+        and route.matches(request.scope)[0] is Match.PARTIAL
+        for method in getattr(route, "methods", None) or ()
+    }
+    if allowed:
+        raise HTTPException(status_code=405, detail="Method Not Allowed", headers={"Allow": ", ".join(sorted(allowed))})
+    raise HTTPException(status_code=404, detail="Not Found")
 
-    return FileResponse(FRONTEND_DIR / "index.html")
 
-app.mount("/", StaticFiles(directory=FRONTEND_DIR), name="static")
+trace_sync_endpoints(app.routes)
 
 
 
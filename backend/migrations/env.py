@@ -0,0 +1,49 @@
+"""
+Alembic environment. The app runs it through backend.core.migrations with
+its own connection; the alembic command line (alembic.ini) connects to
+DATABASE_URL itself.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlmodel import SQLModel
+
+from backend.core import models  # noqa: F401, registers the tables on SQLModel.metadata
+from backend.core.database import DATABASE_URL, build_engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+target_metadata = SQLModel.metadata
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # Revisions with an autocommit block (CREATE INDEX CONCURRENTLY) need this
+        transaction_per_migration=True,
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url") or DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get("connection") is not None:
+    run_migrations(config.attributes["connection"])
+else:
+    with build_engine().connect() as connection:
+        run_migrations(connection)
@@ -0,0 +1,91 @@
+"""Baseline: the schema create_db_and_tables used to build
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Databases created before migrations were introduced already have some or
+all of these tables, so each one is only created when it is missing.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _tables():
+    return [
+        ("user", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("first_name", sa.String, nullable=False),
+            sa.Column("last_name", sa.String),
+            sa.Column("username", sa.String, index=True),
+            sa.Column("score", sa.Integer, nullable=False),
+            sa.Column("wallet_address", sa.String),
+            sa.Column("game_sessions", sa.Integer, nullable=False),
+            sa.Column("last_session_recharge", sa.DateTime, nullable=False),
+            sa.Column("tap_level", sa.Integer, nullable=False),
+            sa.Column("farming_rate", sa.Integer, nullable=False),
+            sa.Column("last_claim_time", sa.DateTime, nullable=False),
+            sa.Column("referral_code", sa.String, nullable=False, unique=True, index=True),
+            sa.Column("referred_by_id", sa.Integer, sa.ForeignKey("user.id")),
+        ]),
+        ("task", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String, nullable=False, index=True),
+            sa.Column("description", sa.String, nullable=False),
+            sa.Column("points", sa.Integer, nullable=False),
+            sa.Column("link", sa.String, nullable=False),
+            sa.Column("icon", sa.String, nullable=False),
+        ]),
+        ("usertask", [
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+            sa.Column("task_id", sa.Integer, sa.ForeignKey("task.id"), primary_key=True),
+        ]),
+        ("synccursor", [
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+            sa.Column("last_seq", sa.BigInteger, nullable=False),
+        ]),
+        ("scoreevent", [
+            sa.Column("id", sa.BigInteger().with_variant(sa.Integer, "sqlite"), primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), nullable=False),
+            sa.Column("source", sa.String, nullable=False),
+            sa.Column("delta", sa.Integer, nullable=False),
+            sa.Column("created_at", sa.DateTime, nullable=False),
+            sa.Index("ix_scoreevent_user_id_id", "user_id", "id"),
+        ]),
+        ("scoresnapshot", [
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+            sa.Column("balance", sa.BigInteger, nullable=False),
+            sa.Column("last_event_id", sa.BigInteger, nullable=False),
+        ]),
+        ("referralstats", [
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+            sa.Column("referrals", sa.Integer, nullable=False),
+            sa.Column("referral_earned", sa.BigInteger, nullable=False),
+        ]),
+    ]
+
+
+def _existing_tables() -> set:
+    if op.get_context().as_sql:
+        return set()
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    existing = _existing_tables()
+    # The foreign keys only point at user and task, which come first
+    for name, elements in _tables():
+        if name not in existing:
+            op.create_table(name, *elements)
+
+
+def downgrade():
+    existing = _existing_tables()
+    for name, _ in reversed(_tables()):
+        if name in existing or op.get_context().as_sql:
+            op.drop_table(name)
@@ -0,0 +1,38 @@
+"""Index users by (score DESC, id) and by (referred_by_id, id)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+(score DESC, id) is the admin dashboard's keyset order and
+(referred_by_id, id) the /friends one. On PostgreSQL the indexes are built
+CONCURRENTLY, so the user table stays writable while this runs.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "ix_user_score_id": [sa.text("score DESC"), "id"],
+    "ix_user_referred_by_id_id": ["referred_by_id", "id"],
+}
+
+
+def upgrade():
+    if op.get_context().dialect.name == "postgresql":
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES.items():
+                op.create_index(name, "user", columns, if_not_exists=True, postgresql_concurrently=True)
+    else:
+        for name, columns in INDEXES.items():
+            op.create_index(name, "user", columns, if_not_exists=True)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name="user", if_exists=True)
@@ -0,0 +1,50 @@
+"""Seed the default tasks
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Every worker used to check for an empty task table on each boot. As a
+migration the seeding runs once per database, under the migration lock.
+A database that already has tasks is left as it is.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+DEFAULT_TASKS = [
+    {"name": "Follow on X", "description": "Follow our official X account", "points": 5000,
+     "link": "https://x.com/uniquesale_fin", "icon": "twitter"},
+    {"name": "Join Telegram", "description": "Join our community Telegram channel", "points": 5000,
+     "link": "https://t.me/uniquesalefinance", "icon": "telegram"},
+    {"name": "Subscribe to YouTube", "description": "Subscribe to our YouTube channel", "points": 3000,
+     "link": "https://youtube.com/your_channel", "icon": "youtube"},
+]
+
+task = sa.table(
+    "task",
+    sa.column("name", sa.String),
+    sa.column("description", sa.String),
+    sa.column("points", sa.Integer),
+    sa.column("link", sa.String),
+    sa.column("icon", sa.String),
+)
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        # An offline script cannot tell whether the table is empty
+        return
+    if op.get_bind().execute(sa.select(sa.func.count()).select_from(task)).scalar():
+        return
+    print("No tasks found, creating default tasks...")
+    op.bulk_insert(task, DEFAULT_TASKS)
+
+
+def downgrade():
+    # The tasks may have been edited or claimed since; they are left in place
+    pass
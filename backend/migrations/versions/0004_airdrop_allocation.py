@@ -0,0 +1,39 @@
+"""Add the airdrop allocation table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+One row per wallet, rewritten in bulk by `python -m backend.cli airdrop-allocate`.
+Like the baseline, the table is only created when missing: databases built
+with SQLModel.metadata.create_all (the benchmarks) already have it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def _has_table() -> bool:
+    return not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table("airdropallocation")
+
+
+def upgrade():
+    if _has_table():
+        return
+    op.create_table(
+        "airdropallocation",
+        sa.Column("wallet_address", sa.String, primary_key=True),
+        sa.Column("amount", sa.BigInteger, nullable=False),
+        sa.Column("users", sa.Integer, nullable=False),
+        sa.Column("score", sa.BigInteger, nullable=False),
+        sa.Column("weight", sa.Float, nullable=False),
+        sa.Column("capped", sa.Boolean, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("airdropallocation")
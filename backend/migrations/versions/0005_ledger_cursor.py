@@ -0,0 +1,65 @@
+"""Fold the score ledger into User.score behind a cursor
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+Score changes are now only appended to scoreevent and folded into
+user.score by the compactor; ledgercursor holds the last event folded.
+Every existing event was applied to user.score in place when it was
+recorded, so the cursor starts past all of them. The per-user snapshots
+the old compactor kept are no longer read and are dropped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+scoreevent = sa.table("scoreevent", sa.column("id"), sa.column("user_id"), sa.column("delta"))
+ledgercursor = sa.table("ledgercursor", sa.column("id"), sa.column("last_event_id"))
+user = sa.table("user", sa.column("id"), sa.column("score"))
+
+
+def _existing_tables() -> set:
+    if op.get_context().as_sql:
+        return set()
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade():
+    existing = _existing_tables()
+    if "ledgercursor" not in existing:
+        op.create_table(
+            "ledgercursor",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("last_event_id", sa.BigInteger, nullable=False),
+        )
+    has_row = sa.select(ledgercursor.c.id).where(ledgercursor.c.id == 1).exists()
+    last_event_id = sa.select(sa.literal(1), sa.func.coalesce(sa.func.max(scoreevent.c.id), 0)).where(~has_row)
+    op.execute(ledgercursor.insert().from_select(["id", "last_event_id"], last_event_id))
+    if "scoresnapshot" in existing or op.get_context().as_sql:
+        op.drop_table("scoresnapshot")
+
+
+def downgrade():
+    # Back to in-place scores: fold what the compactor has not folded yet
+    folded = sa.func.coalesce(
+        sa.select(ledgercursor.c.last_event_id).where(ledgercursor.c.id == 1).scalar_subquery(), 0
+    )
+    unfolded = (
+        sa.select(sa.func.sum(scoreevent.c.delta))
+        .where(scoreevent.c.user_id == user.c.id, scoreevent.c.id > folded)
+        .scalar_subquery()
+    )
+    pending = sa.select(scoreevent.c.id).where(scoreevent.c.user_id == user.c.id, scoreevent.c.id > folded).exists()
+    op.execute(user.update().where(pending).values(score=user.c.score + unfolded))
+    op.create_table(
+        "scoresnapshot",
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("balance", sa.BigInteger, nullable=False),
+        sa.Column("last_event_id", sa.BigInteger, nullable=False),
+    )
+    op.drop_table("ledgercursor")
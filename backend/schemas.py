@@ -0,0 +1,150 @@
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+from datetime import datetime
+import orjson
+
+from .core import MAX_SESSIONS, available_sessions, farming_rewards, get_tap_level, tap_buffer
+
+
+class UserDataResponse(BaseModel):
+    score: int
+    walletAddress: Optional[str]
+    game_sessions: int
+    max_sessions: int
+    tap_level: int
+    username: Optional[str] # Add this
+    claimable_rewards: int = 0 # Add this
+    referral_code: str
+
+class SyncRequest(BaseModel):
+    taps: int
+
+
+class SyncEvent(BaseModel):
+    # Client-generated, increasing per user; events at or below the last one applied are skipped
+    seq: int = Field(gt=0)
+    kind: Literal["taps", "game"] = "taps"
+    points: int
+
+
+class SyncBatchRequest(BaseModel):
+    events: list[SyncEvent]
+
+
+class SyncBatchResponse(BaseModel):
+    last_seq: int
+    applied: int
+    # Events that were not applied, e.g. a game with no session left
+    rejected: int
+    user: UserDataResponse
+
+
+
+class GameResult(BaseModel):
+    points_earned: int
+
+
+class WalletSaveRequest(BaseModel):
+    wallet_address: str
+
+
+class LeaderboardUser(BaseModel):
+    rank: int
+    username: Optional[str]
+    score: int
+
+class LeaderboardResponse(BaseModel):
+    top_users: list[LeaderboardUser]
+    current_user_rank: Optional[int]
+
+
+class TaskResponse(BaseModel):
+    id: int
+    name: str
+    description: str
+    points: int
+    link: str
+    icon: str
+    completed: bool
+
+
+class FriendResponse(BaseModel):
+    username: Optional[str]
+    score: int
+
+
+class FriendsPageResponse(BaseModel):
+    friends: list[FriendResponse]
+    # Pass back as ?cursor= for the next page; None on the last page
+    next_cursor: Optional[int]
+    total_friends: int
+    referral_earned: int
+
+
+# The player endpoints build their bodies as plain dicts straight from the
+# ORM rows and return them as ORJSONResponse. Returning a Response skips
+# FastAPI's response_model validation, which would only re-check values that
+# come from our own schema; response_model stays on the routes for the docs.
+
+
+def user_state(user, claimable_rewards: int = 0, now: Optional[datetime] = None) -> dict:
+    """The UserDataResponse fields for a User or a scoring-service result row."""
+    score = user.score
+    game_sessions = available_sessions(user, now or datetime.utcnow())
+    # Taps still sitting in the write-behind buffer are part of the user's state
+    pending_taps, pending_syncs = tap_buffer.pending(user.id)
+    if pending_syncs:
+        score += pending_taps
+        game_sessions = max(game_sessions - pending_syncs, 0)
+    return {
+        "score": score,
+        "walletAddress": user.wallet_address,
+        "game_sessions": game_sessions,
+        "max_sessions": MAX_SESSIONS,
+        "tap_level": get_tap_level(score),
+        "username": user.username,
+        "claimable_rewards": claimable_rewards,
+        "referral_code": user.referral_code,
+    }
+
+
+def user_state_response(user, claimable_rewards: int = 0, now: Optional[datetime] = None) -> ORJSONResponse:
+    return ORJSONResponse(user_state(user, claimable_rewards, now))
+
+
+def live_state_event(row, now: datetime) -> str:
+    """The JSON of a /live "state" event: what /get_user_data would return at `now`."""
+    return orjson.dumps(user_state(row, claimable_rewards=farming_rewards(row, now), now=now)).decode()
+
+
+def sync_batch_response(row, result) -> ORJSONResponse:
+    return ORJSONResponse({
+        "last_seq": result.last_seq,
+        "applied": result.applied,
+        "rejected": result.rejected,
+        "user": user_state(row),
+    })
+
+
+def friends_page_response(rows, limit: int, totals) -> ORJSONResponse:
+    """The FriendsPageResponse for friends_page_statement rows and the referral totals row."""
+    page = rows[:limit]
+    return ORJSONResponse({
+        "friends": [{"username": row.username or row.first_name, "score": row.score} for row in page],
+        "next_cursor": page[-1].id if len(rows) > limit else None,
+        "total_friends": totals.referrals if totals else 0,
+        "referral_earned": totals.referral_earned if totals else 0,
+    })
+
+
+def task_response(task, completed: bool) -> ORJSONResponse:
+    return ORJSONResponse({
+        "id": task.id,
+        "name": task.name,
+        "description": task.description,
+        "points": task.points,
+        "link": task.link,
+        "icon": task.icon,
+        "completed": completed,
+    })
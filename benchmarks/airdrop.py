@@ -0,0 +1,179 @@
+"""
+Times the airdrop allocation engine (backend/core/airdrop.py) over a
+synthetic user table: loading users, referral edges and task completions
+into arrays, computing the per-wallet amounts and writing them back.
+
+About 40% of the users were referred, mostly by a small set of active
+referrers; 60% have a wallet, 2% of those share one with another account.
+
+    python -m benchmarks.airdrop --users 1000000
+    python -m benchmarks.airdrop --users 100000 --baseline
+    python -m benchmarks.airdrop --url postgresql://localhost/unique_bench --users 2000000
+
+--baseline also runs the same rules as a loop over ORM objects, the way it
+would be written without the engine, and checks both give the same amounts.
+The target database is wiped first, never point it at real data.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+import argparse
+import math
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlmodel import Session, SQLModel, select
+
+from backend.core.airdrop import WALLET_MAX_LENGTH, WALLET_MIN_LENGTH, AllocationRules, allocate_airdrop
+from backend.core.database import build_engine
+from backend.core.models import AirdropAllocation, Task, User, UserTask
+
+SEED_CHUNK = 50_000
+TASKS = 3
+REFERRED_SHARE = 0.4
+ACTIVE_REFERRERS = 0.01
+WALLET_SHARE = 0.6
+SHARED_WALLETS = 0.02
+INVALID_WALLETS = 0.005
+
+
+def seed(engine, users: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for model in (AirdropAllocation, UserTask, User, Task):
+            connection.execute(delete(model))
+        connection.execute(insert(Task), [
+            {"id": i, "name": f"task {i}", "description": "", "points": 1000, "link": "", "icon": ""}
+            for i in range(1, TASKS + 1)
+        ])
+
+    ids = np.arange(1, users + 1)
+    scores = rng.lognormal(8, 1.5, users).astype(np.int64)
+    scores[rng.random(users) < 0.2] = 0
+    # Referrers come before the users they referred, most of them from a few active ones
+    referred = (rng.random(users) < REFERRED_SHARE) & (ids > 1)
+    active = rng.random(users) < 0.7
+    pool = np.maximum((ids - 1) * ACTIVE_REFERRERS, 1).astype(np.int64)
+    parents = np.where(active, rng.integers(0, pool) + 1, rng.integers(0, np.maximum(ids - 1, 1)) + 1)
+    parents = np.where(referred, parents, 0)
+    wallets = [None] * users
+    has_wallet = np.flatnonzero(rng.random(users) < WALLET_SHARE)
+    for row in has_wallet:
+        wallets[row] = uuid.UUID(int=int(rng.integers(0, 2 ** 63))).hex[:WALLET_MIN_LENGTH + row % 12]
+    for row in rng.choice(has_wallet, int(len(has_wallet) * SHARED_WALLETS), replace=False):
+        wallets[row] = wallets[has_wallet[rng.integers(0, len(has_wallet))]]
+    for row in rng.choice(has_wallet, int(len(has_wallet) * INVALID_WALLETS), replace=False):
+        wallets[row] = "not a wallet"
+    completed = rng.random((users, TASKS)) < 0.3
+
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        for start in range(0, users, SEED_CHUNK):
+            stop = min(start + SEED_CHUNK, users)
+            connection.execute(insert(User), [
+                {"id": int(ids[i]), "first_name": f"user{ids[i]}", "score": int(scores[i]),
+                 "wallet_address": wallets[i], "game_sessions": 10, "last_session_recharge": now,
+                 "tap_level": 1, "farming_rate": 100, "last_claim_time": now,
+                 "referral_code": f"code-{ids[i]}", "referred_by_id": int(parents[i]) or None}
+                for i in range(start, stop)
+            ])
+            rows, tasks = np.nonzero(completed[start:stop])
+            connection.execute(insert(UserTask), [
+                {"user_id": int(ids[start + row]), "task_id": int(task) + 1} for row, task in zip(rows, tasks)
+            ])
+
+
+def baseline(engine, rules: AllocationRules) -> dict:
+    """The same rules over ORM objects, one user at a time; returns wallet -> amount."""
+    with Session(engine) as session:
+        users = session.exec(select(User)).all()
+        tasks = Counter(completion.user_id for completion in session.exec(select(UserTask)))
+
+    by_id = {user.id: user for user in users}
+    direct, referrals = Counter(), defaultdict(list)
+    for user in users:
+        if user.referred_by_id in by_id and user.referred_by_id != user.id:
+            referrals[user.referred_by_id].append(user.id)
+            if user.score >= rules.min_score:
+                direct[user.referred_by_id] += 1
+
+    wallets, accounts = {}, Counter()
+    for user in users:
+        wallet = (user.wallet_address or "").strip()
+        if user.score < rules.min_score or not wallet:
+            continue
+        if not (WALLET_MIN_LENGTH <= len(wallet) <= WALLET_MAX_LENGTH and wallet.isascii()):
+            continue
+        second = sum(direct[referee] for referee in referrals[user.id])
+        weight = user.score * (1 + rules.task_bonus * tasks[user.id]) * (
+            1 + rules.referral_bonus * min(direct[user.id], rules.referral_cap)
+            + rules.referral_level2_bonus * min(second, rules.referral_cap)
+        )
+        accounts[wallet] += 1
+        if rules.wallet_policy == "sum":
+            wallets[wallet] = wallets.get(wallet, 0) + weight
+        else:
+            wallets[wallet] = max(wallets.get(wallet, 0), weight)
+
+    cap = math.floor(rules.max_share * rules.total)
+    amounts, free, remaining = {}, dict(wallets), rules.total
+    while remaining > 0 and free:
+        total_weight = sum(free.values())
+        over = [wallet for wallet, weight in free.items() if remaining * weight / total_weight > cap]
+        if not over:
+            amounts.update((wallet, remaining * weight / total_weight) for wallet, weight in free.items())
+            break
+        for wallet in over:
+            amounts[wallet] = cap
+            del free[wallet]
+        remaining -= cap * len(over)
+    return {wallet: math.floor(amount) for wallet, amount in amounts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to benchmark (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--total", type=int, default=1_000_000_000_000, help="units to distribute")
+    parser.add_argument("--max-share", type=float, default=0.001)
+    parser.add_argument("--chunk", type=int, default=50_000, help="rows per fetch and per insert")
+    parser.add_argument("--baseline", action="store_true", help="also run the ORM loop and compare")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(args.url or f"sqlite:///{os.path.join(tmp, 'airdrop.db')}", echo=False)
+        started = time.perf_counter()
+        seed(engine, args.users)
+        print(f"seeded {args.users:,} users in {time.perf_counter() - started:.1f}s\n")
+
+        rules = AllocationRules(total=args.total, max_share=args.max_share)
+        allocation = allocate_airdrop(engine, rules, chunk_size=args.chunk)
+        stats = allocation.stats
+        total = stats["load_seconds"] + stats["compute_seconds"] + stats["write_seconds"]
+        for key in ("users", "eligible_users", "wallets", "shared_wallets", "invalid_wallets", "capped_wallets",
+                    "allocated", "unallocated"):
+            print(f"{key:<16}{stats[key]:>18,}")
+        print(f"\n{'engine':<10}{'load s':>9}{'compute s':>11}{'write s':>9}{'total s':>9}{'users/s':>12}")
+        print(f"{'':<10}{stats['load_seconds']:>9.2f}{stats['compute_seconds']:>11.2f}"
+              f"{stats['write_seconds']:>9.2f}{total:>9.2f}{args.users / total:>12,.0f}")
+
+        if args.baseline:
+            started = time.perf_counter()
+            expected = baseline(engine, rules)
+            elapsed = time.perf_counter() - started
+            wallets = np.char.decode(allocation.wallets, "ascii").tolist()
+            # The engine also hands out the rounding remainder, one unit per wallet at most
+            off = sum(abs(expected.get(wallet, 0) - amount) > 1
+                      for wallet, amount in zip(wallets, allocation.amounts.tolist()))
+            off += len(expected.keys() - set(wallets))
+            print(f"{'orm loop':<10}{'':>29}{elapsed:>9.2f}{args.users / elapsed:>12,.0f}  (no write)")
+            print(f"\nwallets differing from the ORM loop: {off}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
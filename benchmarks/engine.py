@@ -0,0 +1,82 @@
+"""
+Compares database throughput of the original engine setup (echo=True,
+default pool, SQLite rollback journal) against build_engine().
+
+Each simulated request reads one user and, 30% of the time, applies an
+atomic score update and commits, which is the shape of the player endpoints.
+
+    python -m benchmarks.engine --users 5000 --threads 8 --seconds 5
+    python -m benchmarks.engine --url postgresql://localhost/unique_bench
+"""
+from contextlib import redirect_stdout
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlmodel import Session, SQLModel, create_engine, delete
+
+from backend.core.database import build_engine
+from backend.core.models import User
+from backend.core.scoring import add_score
+
+
+def seed(engine, users: int):
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.exec(delete(User))
+        session.add_all(User(id=i, first_name=f"user{i}", score=random.randint(0, 10000)) for i in range(1, users + 1))
+        session.commit()
+
+
+def run(engine, users: int, threads: int, seconds: float) -> int:
+    done = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(slot: int):
+        rng = random.Random(slot)
+        while time.perf_counter() < deadline:
+            user_id = rng.randint(1, users)
+            with Session(engine) as session:
+                session.get(User, user_id)
+                if rng.random() < 0.3:
+                    add_score(session, user_id, rng.randint(1, 50), source="tap", consume_session=True)
+                    session.commit()
+            done[slot] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to benchmark (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name in ("legacy", "tuned"):
+            url = args.url or f"sqlite:///{os.path.join(tmp, name + '.db')}"
+            # echo=True logs to stdout; keep the cost but hide the output
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                engine = create_engine(url, echo=True) if name == "legacy" else build_engine(url, echo=False)
+                seed(engine, args.users)
+                count = run(engine, args.users, args.threads, args.seconds)
+            engine.dispose()
+            results[name] = count / args.seconds
+            print(f"{name:>7}: {results[name]:10.1f} req/s")
+
+        print(f"speedup: {results['tuned'] / results['legacy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares recording score changes as in-place User.score updates against
+appending them to the ScoreEvent ledger (what the app does), one change per
+transaction (the request path) and in bulk (the tap buffer path), then times
+compaction folding the ledger into User.score.
+
+Changes are skewed towards a small set of hot users, the way a few very
+active players dominate tap traffic.
+
+    python -m benchmarks.ledger --users 5000 --threads 8 --seconds 5
+    python -m benchmarks.ledger --url postgresql://localhost/unique_bench
+"""
+from datetime import datetime
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import bindparam, delete, insert, update
+from sqlmodel import SQLModel
+
+from backend.core.database import build_engine
+from backend.core.ledger import compact_ledger
+from backend.core.models import LedgerCursor, ScoreEvent, User
+
+HOT_USERS = 50
+HOT_SHARE = 0.8
+
+
+def seed(engine, users: int):
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for model in (LedgerCursor, ScoreEvent, User):
+            connection.execute(delete(model))
+        connection.execute(insert(User), [{"id": i, "first_name": f"user{i}", "score": 0}
+                                          for i in range(1, users + 1)])
+
+
+def pick_user(rng: random.Random, users: int) -> int:
+    if rng.random() < HOT_SHARE:
+        return rng.randint(1, min(HOT_USERS, users))
+    return rng.randint(1, users)
+
+
+def in_place(connection, changes):
+    connection.execute(
+        update(User).where(User.id == bindparam("b_id")).values(score=User.score + bindparam("b_delta")),
+        [{"b_id": user_id, "b_delta": delta} for user_id, delta in changes],
+    )
+
+
+def append(connection, changes):
+    now = datetime.utcnow()
+    connection.execute(insert(ScoreEvent), [
+        {"user_id": user_id, "source": "tap", "delta": delta, "created_at": now} for user_id, delta in changes
+    ])
+
+
+def run(engine, write, users: int, threads: int, seconds: float, batch: int) -> int:
+    done = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(slot: int):
+        rng = random.Random(slot)
+        while time.perf_counter() < deadline:
+            changes = [(pick_user(rng, users), rng.randint(1, 50)) for _ in range(batch)]
+            with engine.begin() as connection:
+                write(connection, changes)
+            done[slot] += batch
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to benchmark (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--batch", type=int, default=500, help="changes per bulk transaction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(args.url or f"sqlite:///{os.path.join(tmp, 'ledger.db')}", echo=False)
+        print(f"{'strategy':<22}{'changes/s':>12}")
+        for batch in (1, args.batch):
+            for name, write in (("in-place update", in_place), ("ledger append", append)):
+                seed(engine, args.users)
+                count = run(engine, write, args.users, args.threads, args.seconds, batch)
+                label = f"{name} x{batch}"
+                print(f"{label:<22}{count / args.seconds:>12.1f}")
+
+        # The last run left a ledger behind (the "ledger append" bulk run); fold it
+        started = time.perf_counter()
+        folded = compact_ledger(engine, lag=0)
+        elapsed = time.perf_counter() - started
+        print(f"\ncompaction: {folded} events in {elapsed:.2f}s -> {folded / elapsed:.1f} events/s")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Replays a realistic player session mix against the FastAPI app in-process
+and reports latency percentiles, throughput and SQL statements per endpoint.
+
+Authentication is replaced by a DEV_MODE-style stub that takes the user id
+from an x-bench-user header, so every simulated player is a distinct user.
+
+    python -m benchmarks.load --users 10000 --concurrency 64 --requests 20000
+    python -m benchmarks.load --url postgresql://localhost/unique_bench --async-db
+
+The target database is wiped and re-seeded, never point it at real data.
+"""
+from contextvars import ContextVar
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# Share of each endpoint in the traffic mix, roughly what one app open,
+# a couple of games and a look at the other tabs produce.
+MIX = {
+    "get_user_data": 30,
+    "sync_score": 25,
+    "submit_game_score": 10,
+    "leaderboard": 10,
+    "tasks": 10,
+    "claim_task": 5,
+    "friends": 10,
+}
+
+_queries: ContextVar[list] = ContextVar("bench_queries")
+
+
+def _count_query(*args):
+    holder = _queries.get(None)
+    if holder is not None:
+        holder[0] += 1
+
+
+def seed(engine, users: int, tasks: int):
+    """Creates `users` players (a fifth of them referred by another) and `tasks` tasks."""
+    from sqlalchemy import delete, insert
+    from sqlmodel import SQLModel
+    from backend.core.models import Task, User, UserTask
+
+    rng = random.Random(0)
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for model in (UserTask, Task, User):
+            connection.execute(delete(model))
+        connection.execute(insert(Task), [
+            {"id": i, "name": f"Task {i}", "description": "Benchmark task", "points": 1000,
+             "link": "https://example.com", "icon": "telegram"}
+            for i in range(1, tasks + 1)
+        ])
+        for start in range(1, users + 1, 5000):
+            connection.execute(insert(User), [
+                {"id": i, "first_name": f"Player{i}", "username": f"player{i}",
+                 "score": rng.randint(0, 50000), "referral_code": f"ref-{i}",
+                 "referred_by_id": rng.randint(1, i - 1) if i > 1 and rng.random() < 0.2 else None}
+                for i in range(start, min(start + 5000, users + 1))
+            ])
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def drive(app, users: int, tasks: int, concurrency: int, total: int) -> tuple[dict, float]:
+    import httpx
+
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+    results = {name: {"latency": [], "queries": [], "status": {}} for name in names}
+    remaining = [total]
+
+    def build_request(name: str, rng: random.Random):
+        if name == "sync_score":
+            return "POST", "/sync_score", {"taps": rng.randint(1, 200)}
+        if name == "submit_game_score":
+            return "POST", "/submit_game_score", {"points_earned": rng.randint(-100, 500)}
+        if name == "claim_task":
+            return "POST", f"/claim_task/{rng.randint(1, tasks)}", None
+        return "GET", f"/{name}", None
+
+    async def worker(slot: int, client):
+        rng = random.Random(slot)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, weights)[0]
+            method, path, body = build_request(name, rng)
+            holder = [0]
+            token = _queries.set(holder)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body,
+                                            headers={"x-bench-user": str(rng.randint(1, users))})
+            elapsed = time.perf_counter() - started
+            _queries.reset(token)
+            result = results[name]
+            result["latency"].append(elapsed)
+            result["queries"].append(holder[0])
+            result["status"][response.status_code] = result["status"].get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(slot, client) for slot in range(concurrency)))
+        wall = time.perf_counter() - started
+    return results, wall
+
+
+def report(results: dict, wall: float):
+    total = sum(len(r["latency"]) for r in results.values())
+    print(f"{'endpoint':<18}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}  status")
+    for name, result in results.items():
+        latency = [s * 1000 for s in result["latency"]]
+        queries = statistics.mean(result["queries"]) if result["queries"] else 0
+        status = " ".join(f"{code}:{count}" for code, count in sorted(result["status"].items()))
+        print(f"{name:<18}{len(latency):>7}{percentile(latency, 50):>9.2f}{percentile(latency, 95):>9.2f}"
+              f"{percentile(latency, 99):>9.2f}{queries:>9.2f}  {status}")
+    print(f"\n{total} requests in {wall:.2f}s -> {total / wall:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to benchmark (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--tasks", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--async-db", action="store_true", help="mount the async player endpoints")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads its configuration at import time
+        os.environ["DATABASE_URL"] = args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["ASYNC_DB"] = "true" if args.async_db else "false"
+        os.environ.setdefault("DEV_MODE", "false")
+
+        from fastapi import Header
+        from sqlalchemy import event
+        from backend.core import database
+        from backend.core.security import get_validated_data, get_validated_data_async
+        from backend.main import app
+
+        def bench_user(x_bench_user: str = Header(...)) -> dict:
+            user_id = int(x_bench_user)
+            return {"user": {"id": user_id, "first_name": f"Player{user_id}", "username": f"player{user_id}"}}
+
+        async def bench_user_async(x_bench_user: str = Header(...)) -> dict:
+            return bench_user(x_bench_user)
+
+        app.dependency_overrides[get_validated_data] = bench_user
+        app.dependency_overrides[get_validated_data_async] = bench_user_async
+
+        seed(database.engine, args.users, args.tasks)
+        event.listen(database.engine, "before_cursor_execute", _count_query)
+        if args.async_db:
+            event.listen(database.get_async_engine().sync_engine, "before_cursor_execute", _count_query)
+
+        async def run():
+            await app.router.startup()
+            try:
+                return await drive(app, args.users, args.tasks, args.concurrency, args.requests)
+            finally:
+                await app.router.shutdown()
+
+        print(f"{args.users} users, {args.tasks} tasks, concurrency {args.concurrency}, "
+              f"{'async' if args.async_db else 'sync'} endpoints on {os.environ['DATABASE_URL']}\n")
+        report(*asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measures the CPU time per request of /get_user_data, /tasks and /leaderboard
+in-process, next to the same endpoints answered the old way: a Pydantic model
+built field by field, validated again through response_model and encoded
+with the stdlib json module.
+
+The old-style endpoints run on a bare FastAPI app next to the real one and
+load their data through the same caches, so the difference is the response path.
+
+    python -m benchmarks.responses --requests 5000 --tasks 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.load import seed
+
+ENDPOINTS = ("get_user_data", "tasks", "leaderboard")
+
+
+def baseline_app():
+    """The three endpoints as they were answered before the orjson response path."""
+    from datetime import datetime
+    from fastapi import Depends, FastAPI
+    from fastapi.responses import JSONResponse
+    from sqlmodel import Session
+    import orjson
+    from backend.core import (farming_rewards, get_session, get_validated_data, leaderboard_snapshot,
+                              load_user_state, rank_index, task_catalog)
+    from backend.core.taskcatalog import TASK_FIELDS
+    from backend.schemas import (LeaderboardResponse, LeaderboardUser, TaskResponse, UserDataResponse,
+                                 user_state)
+
+    app = FastAPI()
+
+    @app.get("/get_user_data", response_model=UserDataResponse, response_class=JSONResponse)
+    def get_user_data(validated_data: dict = Depends(get_validated_data), session: Session = Depends(get_session)):
+        now = datetime.utcnow()
+        row = load_user_state(session, validated_data["user"]["id"])
+        return UserDataResponse(**user_state(row, farming_rewards(row, now), now))
+
+    @app.get("/tasks", response_model=list[TaskResponse], response_class=JSONResponse)
+    def get_tasks(validated_data: dict = Depends(get_validated_data), session: Session = Depends(get_session)):
+        catalog = task_catalog.catalog(session)
+        body = orjson.loads(task_catalog.render(session, validated_data["user"]["id"]))
+        return [
+            TaskResponse(**{field: getattr(task, field) for field in TASK_FIELDS}, completed=entry["completed"])
+            for task, entry in zip(catalog.tasks, body)
+        ]
+
+    @app.get("/leaderboard", response_model=LeaderboardResponse, response_class=JSONResponse)
+    def get_leaderboard(validated_data: dict = Depends(get_validated_data)):
+        top_users = orjson.loads(leaderboard_snapshot.board().top_users)
+        return LeaderboardResponse(
+            top_users=[LeaderboardUser(**user) for user in top_users],
+            current_user_rank=rank_index.rank(validated_data["user"]["id"]),
+        )
+
+    return app
+
+
+async def measure(app, path: str, users: int, requests: int) -> tuple[float, int]:
+    """CPU milliseconds per request and the response size for `requests` sequential GETs of `path`."""
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm the caches so both paths are measured on the same hot data
+        for user_id in range(1, users + 1):
+            await client.get(path, headers={"x-bench-user": str(user_id)})
+        size = 0
+        started = time.process_time()
+        for i in range(requests):
+            response = await client.get(path, headers={"x-bench-user": str(i % users + 1)})
+            size = len(response.content)
+        elapsed = time.process_time() - started
+    return elapsed * 1000 / requests, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="distinct callers, all kept in the caches")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The app reads its configuration at import time
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["ASYNC_DB"] = "false"
+        os.environ["DEV_MODE"] = "false"
+        os.environ["METRICS_ENABLED"] = "false"
+
+        from fastapi import Header
+        from backend.core import database
+        from backend.core.security import get_validated_data
+        from backend.main import app
+
+        def bench_user(x_bench_user: str = Header(...)) -> dict:
+            user_id = int(x_bench_user)
+            return {"user": {"id": user_id, "first_name": f"Player{user_id}", "username": f"player{user_id}"}}
+
+        baseline = baseline_app()
+        for target in (app, baseline):
+            target.dependency_overrides[get_validated_data] = bench_user
+        seed(database.engine, args.users, args.tasks)
+
+        async def run():
+            await app.router.startup()
+            try:
+                return [
+                    (name, await measure(baseline, f"/{name}", args.users, args.requests),
+                     await measure(app, f"/{name}", args.users, args.requests))
+                    for name in ENDPOINTS
+                ]
+            finally:
+                await app.router.shutdown()
+
+        print(f"{args.users} users, {args.tasks} tasks, {args.requests} requests per endpoint\n")
+        print(f"{'endpoint':<16}{'baseline ms':>13}{'fast ms':>10}{'saved':>8}{'bytes':>8}")
+        for name, (slow, _), (fast, size) in asyncio.run(run()):
+            print(f"{name:<16}{slow:>13.3f}{fast:>10.3f}{1 - fast / slow:>8.0%}{size:>8}")
+
+
+if __name__ == "__main__":
+    main()
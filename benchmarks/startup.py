@@ -0,0 +1,97 @@
+"""
+Measures how long a new worker takes to become ready, as on a rolling
+restart or a scale-out: interpreter start, importing backend.main,
+running the startup handlers and waiting for the work they leave in the
+background (/readyz turning 200), each run in a fresh interpreter. The first
+run boots against an empty database (migrations and seeding), the others
+against one that is already up to date.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --url postgresql://localhost/unique_bench
+
+The target database is wiped first, never point it at real data.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child():
+    """Runs in the fresh interpreter; prints its timings in seconds."""
+    import asyncio
+    started = time.perf_counter()
+    from backend.main import app
+    imported = time.perf_counter()
+
+    async def boot():
+        import httpx
+
+        await app.router.startup()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            deadline = time.perf_counter() + 60
+            while (status := (await client.get("/readyz")).status_code) != 200 and time.perf_counter() < deadline:
+                await asyncio.sleep(0.005)
+        ready = time.perf_counter()
+        await app.router.shutdown()
+        return ready, status
+
+    ready, status = asyncio.run(boot())
+    print(f"{imported - started} {ready - imported} {status}")
+
+
+def wipe(url: str):
+    from sqlalchemy import create_engine, MetaData
+
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return
+    engine = create_engine(url)
+    metadata = MetaData()
+    metadata.reflect(engine)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database to boot against (default: a temporary SQLite file)")
+    parser.add_argument("--runs", type=int, default=5, help="boots against the up-to-date database")
+    parser.add_argument("--async-db", action="store_true", help="mount the async player endpoints")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        wipe(url)
+        env = dict(os.environ, DATABASE_URL=url, ASYNC_DB="true" if args.async_db else "false")
+        env.setdefault("DEV_MODE", "true")
+
+        print(f"{'boot':<10}{'total ms':>10}{'import ms':>11}{'startup ms':>12}  readyz")
+        rows = []
+        for run in range(args.runs + 1):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child"], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            total = time.perf_counter() - started
+            imported, startup, status = output.strip().splitlines()[-1].split()
+            row = (total * 1000, float(imported) * 1000, float(startup) * 1000)
+            print(f"{'fresh db' if run == 0 else 'warm db':<10}{row[0]:>10.0f}{row[1]:>11.0f}{row[2]:>12.0f}  {status}")
+            if run:
+                rows.append(row)
+        if rows:
+            medians = [statistics.median(column) for column in zip(*rows)]
+            print(f"{'median':<10}{medians[0]:>10.0f}{medians[1]:>11.0f}{medians[2]:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
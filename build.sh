@@ -2,3 +2,4 @@
 set -o errexit
 
 pip install -r requirements.txt
+python -m backend.cli build-assets
@@ -0,0 +1,75 @@
+"""
+The airdrop allocation maths, on hand-built arrays: referral counting, the
+capped pro-rata split, rounding to whole units, and the rules
+compute_allocation refuses.
+"""
+import numpy as np
+import pytest
+
+from backend.core.airdrop import AllocationRules, UserArrays, compute_allocation, pro_rata, referral_counts, to_units
+
+
+def users(scores, parents=None, wallets=None) -> UserArrays:
+    count = len(scores)
+    wallets = wallets or [f"wallet{i:028d}" for i in range(count)]
+    return UserArrays(
+        ids=np.arange(1, count + 1, dtype=np.int64),
+        scores=np.array(scores, np.int64),
+        parents=np.array(parents or [0] * count, np.int64),
+        tasks=np.zeros(count, np.int32),
+        wallet_rows=np.arange(count, dtype=np.int64),
+        wallets=np.array(wallets, "S44"),
+        invalid_wallets=0,
+    )
+
+
+def test_referral_counts_two_levels():
+    ids = np.array([1, 2, 3, 4, 5], np.int64)
+    # 2 and 3 were referred by 1, 4 by 2, 5 by an unknown user
+    parents = np.array([0, 1, 1, 2, 99], np.int64)
+    qualified = np.array([True, True, False, True, True])
+    direct, second = referral_counts(ids, parents, qualified)
+    assert direct.tolist() == [1, 1, 0, 0, 0]
+    assert second.tolist() == [1, 0, 0, 0, 0]
+
+
+def test_referral_counts_ignore_self_referrals():
+    ids = np.array([1, 2], np.int64)
+    direct, second = referral_counts(ids, np.array([1, 2], np.int64), np.array([True, True]))
+    assert direct.tolist() == [0, 0]
+    assert second.tolist() == [0, 0]
+
+
+def test_pro_rata_splits_in_proportion():
+    shares, capped = pro_rata(np.array([1.0, 3.0, 0.0]), 100, cap=100.0)
+    assert shares.tolist() == pytest.approx([25.0, 75.0, 0.0])
+    assert not capped.any()
+
+
+def test_pro_rata_hands_the_excess_over_the_cap_to_the_others():
+    shares, capped = pro_rata(np.array([8.0, 1.0, 1.0]), 100, cap=50.0)
+    assert shares.tolist() == pytest.approx([50.0, 25.0, 25.0])
+    assert capped.tolist() == [True, False, False]
+
+
+def test_to_units_gives_the_remainder_to_the_largest_fractions():
+    amounts = to_units(np.array([1.2, 1.7, 2.1]), 5, np.zeros(3, bool))
+    assert amounts.tolist() == [1, 2, 2]
+
+
+def test_to_units_leaves_capped_shares_alone():
+    amounts = to_units(np.array([2.0, 1.5, 1.5]), 5, np.array([True, False, False]))
+    assert amounts[0] == 2
+    assert sorted(amounts[1:].tolist()) == [1, 2]
+
+
+def test_compute_allocation_distributes_the_total():
+    allocation = compute_allocation(users([100, 300]), AllocationRules(total=1000, max_share=1.0))
+    assert allocation.amounts.tolist() == [250, 750]
+    assert allocation.stats["unallocated"] == 0
+
+
+def test_compute_allocation_refuses_a_cap_under_one_unit():
+    # 0.001 of 500 units floors to a cap of 0
+    with pytest.raises(ValueError, match="max_share"):
+        compute_allocation(users([100, 300]), AllocationRules(total=500, max_share=0.001))
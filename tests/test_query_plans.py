@@ -0,0 +1,32 @@
+"""
+The hot queries must stay index range scans: the admin users list on
+ix_user_score_id and /friends on ix_user_referred_by_id_id, first and next
+(keyset) pages alike, and a user's balance on ix_scoreevent_user_id_id.
+Runs the same check as `python -m backend.cli db-check-plans` against a
+freshly migrated SQLite database.
+"""
+import pytest
+
+from backend.core.database import build_engine
+from backend.core.migrations import upgrade_database
+from backend.core.queryplans import check_query_plans, hot_queries
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    engine = build_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}", echo=False)
+    upgrade_database(engine)
+    try:
+        yield {check.query: check for check in check_query_plans(engine)}
+    finally:
+        engine.dispose()
+
+
+def test_every_hot_query_is_checked(plans):
+    assert set(plans) == set(hot_queries())
+
+
+@pytest.mark.parametrize("query", sorted(hot_queries()))
+def test_hot_query_uses_its_index(plans, query):
+    check = plans[query]
+    assert check.uses_index, f"{query} no longer uses {check.index}:\n{check.plan}"